@@ -0,0 +1,158 @@
+"""
+Hex Viewer.
+
+Licensed under MIT
+Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+# Bump when the hex view format changes to invalidate old entries
+CACHE_VERSION = 2
+CACHE_EXT = ".hxv"
+# Folder, in the cache, of the files entries are gotten to
+TEMP_FOLDER = "views"
+
+
+class RenderCache(object):
+    """
+    On disk cache of converted hex views.
+
+    Entries are named after a hash of everything that affects the rendered output,
+    and the least recently used entries are evicted when the cache exceeds its size
+    budget.  Entries are only ever created with an atomic rename and are never
+    modified, so multiple windows (or Sublime instances) can share the cache:
+    at worst, an entry is converted twice or evicted right before it is used,
+    which is treated as a miss.
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, directory, max_size):
+        """Initialize."""
+
+        self.directory = directory
+        self.max_size = max_size
+
+    @staticmethod
+    def key(file_name, bytes_wide, group_size, hex_lower, starting_address, offset=0, length=None, source=None):
+        """
+        Get the cache key of a conversion, or `None` if the file can't be cached.
+
+        `source` identifies what was converted when it isn't the file as is (a decompressed file or zip member).
+        """
+
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+
+        # Special files have no meaningful size or modified time
+        if not stat.st_size:
+            return None
+
+        key = repr(
+            (
+                CACHE_VERSION,
+                os.path.normcase(os.path.abspath(file_name)),
+                stat.st_size,
+                stat.st_mtime_ns,
+                int(bytes_wide),
+                int(group_size),
+                bool(hex_lower),
+                starting_address,
+                offset,
+                length,
+                source
+            )
+        )
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        """Get the path of an entry."""
+
+        return os.path.join(self.directory, key + CACHE_EXT)
+
+    def temp_file(self):
+        """
+        Create an empty file to get an entry to.
+
+        The file is on the same file system as the entries, so getting an entry links it
+        instead of copying it, but it is not with the entries, so it is never evicted.
+        """
+
+        directory = os.path.join(self.directory, TEMP_FOLDER)
+        os.makedirs(directory, exist_ok=True)
+        fd, name = tempfile.mkstemp(suffix=CACHE_EXT, dir=directory)
+        os.close(fd)
+        return name
+
+    def get(self, key, dest):
+        """Copy the entry to `dest` if it is cached and return whether it was found."""
+
+        path = self.path(key)
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+            try:
+                # Hard links are instant and unaffected by the view removing its temp file
+                os.link(path, dest)
+            except OSError:
+                shutil.copyfile(path, dest)
+        except OSError:
+            return False
+        return True
+
+    def put(self, key, src):
+        """Store a copy of `src` in the cache."""
+
+        try:
+            size = os.path.getsize(src)
+            if size > self.max_size:
+                return
+
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.path(key)
+            temp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.get_ident())
+            shutil.copyfile(src, temp)
+            os.replace(temp, path)
+        except OSError:
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache is within budget."""
+
+        with self.lock:
+            entries = []
+            try:
+                for entry in os.scandir(self.directory):
+                    if entry.name.endswith(CACHE_EXT):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except OSError:
+                return
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Already removed by another window
+                    pass
+                total -= size
+
+    def clear(self):
+        """Remove all entries."""
+
+        with self.lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -8,7 +8,7 @@ import sublime
 import sublime_plugin
 import re
 from . import hex_common as common
-import threading
+from .hex_jobs import Job, INTERACTIVE, get_scheduler
 import hashlib
 import zlib
 import sys
@@ -16,21 +16,34 @@ from . import whirlpool, tiger, sum_hashes
 from binascii import unhexlify
 from io import StringIO
 import traceback
-from .hex_notify import notify, error
+from .hex_notify import notify
 
 DEFAULT_CHECKSUM = "md5"
 VALID_HASH = []
-
-active_thread = None
+COLLAPSED_CHUNK_SIZE = 1048576
+RE_COLLAPSED = re.compile(r'(\* )?([\da-fA-F]{8,})-([\da-fA-F]{8,}):')
 
 
 def parse_view_data(data_buffer):
     """Parse the hex data."""
 
+    last = b""
     for line in data_buffer:
-        yield unhexlify(
-            re.sub(r'[\da-fA-F]{8}:[\s]{2}((?:[\da-fA-F]+[\s]{1})*)\s*\:[\w\W]*', r'\1', line).replace(" ", "")
+        collapsed = RE_COLLAPSED.match(line)
+        if collapsed is not None:
+            # Expand collapsed ranges: sparse holes are zeros and repeats are copies of the previous line
+            size = int(collapsed.group(3), 16) - int(collapsed.group(2), 16) + 1
+            pattern = last if collapsed.group(1) else b"\0"
+            if pattern:
+                chunk = pattern * max(1, COLLAPSED_CHUNK_SIZE // len(pattern))
+                while size > 0:
+                    yield chunk[:size]
+                    size -= len(chunk)
+            continue
+        last = unhexlify(
+            re.sub(r'[\da-fA-F]{8,}:[\s]{2}((?:[\da-fA-F]+[\s]{1})*)\s*\:[\w\W]*', r'\1', line).replace(" ", "")
         )
+        yield last
 
 
 def verify_hashes(hashes):
@@ -242,32 +255,22 @@ class Checksum(object):
         if isinstance(data, str):
             self.hash.update(data)
 
-    def threaded_update(self, data_buffer=None, fmt_callback=None, count=None):
-        """Hash the data via a thread."""
-        global active_thread
+    def threaded_update(self, data_buffer=None, fmt_callback=None, count=None, priority=INTERACTIVE):
+        """Hash the data via a job on the scheduler."""
+
         if data_buffer is None:
             data_buffer = []
-        self.thread = HashThread(data_buffer, self.hash, fmt_callback, count)
-        self.thread.start()
-        self.chunk_thread()
-        active_thread = self.thread
-
-    def chunk_thread(self):
-        """Check how many chunks have been processed and update status."""
-
-        ratio = float(self.thread.chunk) / float(self.thread.chunks)
-        percent = int(ratio * 10)
-        leftover = 10 - percent
-        message = "[" + "-" * percent + ">" + "-" * leftover + ("] %3d%%" % int(ratio * 100)) + " chunks hashed"
-        sublime.status_message(message)
-        if not self.thread.is_alive():
-            if self.thread.abort is True:
-                notify("Hash calculation aborted!")
-                sublime.set_timeout(self.reset_thread, 500)
-            else:
-                sublime.set_timeout(self.display, 500)
+        self.thread = HashThread(data_buffer, self.hash, fmt_callback, count, priority)
+        self.thread.start(self.on_hashed)
+
+    def on_hashed(self, thread):
+        """Show the hash when done."""
+
+        self.reset_thread()
+        if thread.abort:
+            notify("Hash calculation aborted!")
         else:
-            sublime.set_timeout(self.chunk_thread, 500)
+            self.display()
 
     def reset_thread(self):
         """Reset."""
@@ -286,20 +289,30 @@ class Checksum(object):
         window.show_input_panel(self.name + ":", digest, None, None, None)
 
 
-class HashThread(threading.Thread):
+class HashThread(Job):
     """Thread hashing."""
 
-    def __init__(self, data, obj, fmt_callback=None, count=None):
+    def __init__(self, data, obj, fmt_callback=None, count=None, priority=None):
         """Initialize."""
 
+        Job.__init__(self, priority)
         self.hash = False
         self.data = data
         self.obj = obj
         self.chunk = 0
         self.chunks = len(data) if count is None else count
-        self.abort = False
         self.fmt_callback = fmt_callback if fmt_callback is not None else self.format
-        threading.Thread.__init__(self)
+
+    def get_progress(self):
+        """Get the progress of the hash."""
+
+        # Collapsed holes are expanded in several chunks, so the count can exceed the line count
+        return min(1.0, float(self.chunk) / float(self.chunks)) if self.chunks > 0 else 1.0
+
+    def describe(self):
+        """Describe the hash."""
+
+        return "chunks hashed"
 
     def format(self, data):  # noqa: A003
         """Format."""
@@ -399,24 +412,19 @@ class HexChecksumCommand(sublime_plugin.WindowCommand):
     def is_enabled(self):
         """Check if command is enabled."""
 
+        view = self.window.active_view()
         return (
             common.is_enabled() and
-            not (active_thread is not None and active_thread.is_alive())
+            view is not None and not common.is_windowed(view)
         )
 
     def run(self, hash_algorithm=None, panel=False):
         """Run command."""
 
-        if active_thread is not None and active_thread.is_alive():
-            error(
-                "HexViewer is already checksumming a file!\n"
-                "Please run the abort command to stop the current checksum."
-            )
+        if not panel:
+            self.get_checksum(hash_algorithm)
         else:
-            if not panel:
-                self.get_checksum(hash_algorithm)
-            else:
-                self.window.show_quick_panel(VALID_HASH, self.select_checksum)
+            self.window.show_quick_panel(VALID_HASH, self.select_checksum)
 
     def select_checksum(self, value):
         """Select the the checksum."""
@@ -445,13 +453,12 @@ class HexChecksumAbortCommand(sublime_plugin.WindowCommand):
     def run(self):
         """Run command."""
 
-        if active_thread is not None and active_thread.is_alive():
-            active_thread.abort = True
+        get_scheduler().cancel(HashThread)
 
     def is_enabled(self):
         """Check if command should be enabled."""
 
-        return active_thread is not None and active_thread.is_alive()
+        return bool(get_scheduler().active(HashThread))
 
 
 # Compose list of hashes
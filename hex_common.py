@@ -6,11 +6,31 @@ Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
 """
 import sublime
 from os.path import basename, splitext
+from .hex_format import (  # noqa: F401
+    ByteGeometry, ADDRESS_OFFSET, ADDRESS_WIDTH, ASCII_OFFSET, BITS_PER_BYTE,
+    get_collapsed_row_offset, get_collapsed_offset_row
+)
 
-ADDRESS_OFFSET = 11
-ASCII_OFFSET = 3
-BITS_PER_BYTE = 8
 ST_SYNTAX = "sublime-syntax"
+SETTINGS_FILE = "hex_viewer.sublime-settings"
+VIEW_STATE_KEY = "hex_viewer_state"
+HIGHLIGHT_SCOPE = "string"
+HIGHLIGHT_ICON = "dot"
+HIGHLIGHT_STYLE = "solid"
+HIGHLIGHT_EDIT_SCOPE = "keyword"
+HIGHLIGHT_EDIT_ICON = "none"
+HIGHLIGHT_EDIT_STYLE = "underline"
+MAX_HIGHIGHT = 1000
+THROTTLING = False
+INSPECTOR_INTEGER_FORMAT = "%-12s:  %-14d"
+INSPECTOR_MISSING_FORMAT = "%-12s:  %-14s"
+INSPECTOR_FLOAT_FORMAT = "%-12s:  %-14e"
+INSPECTOR_BINARY_FORMAT = "%-12s:  %-14s"
+INSPECTOR_TIMESTAMP_FORMAT = ("%-12s:  %-14s", "%c")
+
+hv_snapshot = None
+# Hex state of each view: view id -> view state
+hv_views = {}
 
 
 def is_enabled(current_view=None):
@@ -26,9 +46,71 @@ def is_enabled(current_view=None):
     # check if current view is the main active view
     if current_view is not None and current_view.id() != view.id():
         return False
-    syntax = view.settings().get('syntax')
-    language = splitext(basename(syntax))[0].lower() if syntax is not None else "plain text"
-    return bool(language == "hexviewer")
+    return get_view_state(view).is_hex
+
+
+class ViewState(object):
+    """
+    Hex state of a view read from its settings.
+
+    The state is marked stale whenever a setting of the view changes, the syntax included,
+    and read again the next time it is used.
+    """
+
+    def __init__(self, view):
+        """Initialize."""
+
+        self.load(view)
+        self.settings = view.settings()
+        self.settings.add_on_change(VIEW_STATE_KEY, self.invalidate)
+
+    def close(self):
+        """Stop listening for changes of the settings of the view."""
+
+        self.settings.clear_on_change(VIEW_STATE_KEY)
+
+    def invalidate(self):
+        """Mark the state as stale."""
+
+        self.stale = True
+
+    def load(self, view):
+        """Read the state from the settings of the view."""
+
+        # A change while reading marks the state stale again
+        self.stale = False
+        settings = view.settings()
+        syntax = settings.get('syntax')
+        language = splitext(basename(syntax))[0].lower() if syntax is not None else "plain text"
+        self.is_hex = language == "hexviewer"
+        self.bits = settings.get("hex_viewer_bits")
+        self.bytes_wide = settings.get("hex_viewer_actual_bytes")
+        self.starting_address = settings.get("hex_viewer_starting_address", 0)
+        self.window_lines = int(settings.get("hex_viewer_window_lines", 0) or 0)
+        self.address_width = int(settings.get("hex_viewer_address_width", ADDRESS_WIDTH) or ADDRESS_WIDTH)
+        if self.bits is not None and self.bytes_wide is not None:
+            self.geometry = ByteGeometry(self.bytes_wide, int(self.bits) // BITS_PER_BYTE, self.address_width)
+        else:
+            self.geometry = None
+
+
+def get_view_state(view):
+    """Get the hex state of a view, reading it again if its settings changed."""
+
+    state = hv_views.get(view.id())
+    if state is None:
+        state = hv_views[view.id()] = ViewState(view)
+    elif state.stale:
+        state.load(view)
+    return state
+
+
+def forget_view(view):
+    """Forget the hex state of a closed view."""
+
+    state = hv_views.pop(view.id(), None)
+    if state is not None:
+        state.close()
 
 
 def clear_edits(view):
@@ -42,7 +124,7 @@ def clear_edits(view):
 
 def use_hex_lowercase():
     """Check if lowercase hex format should be used."""
-    return hv_settings('use_lowercase_hex', True)
+    return get_settings().use_lowercase_hex
 
 
 def is_hex_dirty(view):
@@ -51,22 +133,7 @@ def is_hex_dirty(view):
     return True if len(view.get_regions("hex_edit")) != 0 else False
 
 
-def get_hex_char_range(group_size, bytes_wide):
-    """Get the hex char range."""
-
-    return int((group_size * 2) * bytes_wide / (group_size) + bytes_wide / (group_size)) - 1
-
-
-def get_byte_count(start, end, group_size):
-    """Get the byte count."""
-
-    return (
-        int((end - start - 1) / (group_size * 2 + 1)) * int(group_size) +
-        int(((end - start - 1) % (group_size * 2 + 1)) / 2 + 1)
-    )
-
-
-def ascii_to_hex_col(index, group_size):
+def ascii_to_hex_col(index, group_size, address_offset=ADDRESS_OFFSET):
     """
     Convert ASCII selection to the column in the hex data.
 
@@ -78,56 +145,229 @@ def ascii_to_hex_col(index, group_size):
     """
 
     start_column = int(
-        ADDRESS_OFFSET + (group_size * 2) * index / (group_size) +
+        address_offset + (group_size * 2) * index / (group_size) +
         index / (group_size)
     )
     # Convert byte column position to test point
     return start_column
 
 
-def adjust_hex_sel(view, start, end, group_size):
-    """Adjust the hex selection."""
+def get_geometry(view):
+    """Get the byte geometry of the lines of a hex view."""
 
-    num_bytes = 0
-    size = end - start
-    if view.score_selector(start, 'raw.nibble.upper') == 0:
-        if view.score_selector(start, 'raw.nibble.lower'):
-            start -= 1
-        elif view.score_selector(start + 1, 'raw.nibble.upper') and size > 0:
-            start += 1
-        else:
-            start = None
-    # Adjust ending of selection to end of last selected byte
-    if size == 0 and start is not None:
-        end = start + 1
-        num_bytes = 1
-    elif view.score_selector(end, 'raw.nibble.lower') == 0:
-        if view.score_selector(end - 1, 'raw.nibble.lower'):
-            end -= 1
+    return get_view_state(view).geometry
+
+
+def adjust_hex_sel(view, start, end, geometry):
+    """
+    Adjust the hex selection to the bytes it covers.
+
+    Returns the point of the upper nibble of the first byte, the point of the lower nibble
+    of the last byte, and the number of bytes.  The start is `None` if no byte is covered.
+    """
+
+    line = view.line(start)
+    first, num_bytes = geometry.select_hex(
+        start - line.begin(), end - line.begin(), geometry.line_bytes(view.substr(line))
+    )
+    if not num_bytes:
+        return None, end, 0
+    return (
+        line.begin() + geometry.hex_column(first),
+        line.begin() + geometry.hex_column(first + num_bytes - 1) + 1,
+        num_bytes
+    )
+
+
+def get_row_offset(view, row):
+    """Get the offset, from the first rendered line, of the first byte of a row (accounting for collapsed ranges)."""
+
+    return get_collapsed_row_offset(
+        view.settings().get("hex_viewer_collapsed", []), get_view_state(view).geometry.bytes_wide, row
+    )
+
+
+def get_offset_row(view, offset):
+    """Get the row of the byte at the offset; bytes in a collapsed range are on the range's marker row."""
+
+    return get_collapsed_offset_row(
+        view.settings().get("hex_viewer_collapsed", []), get_view_state(view).geometry.bytes_wide, offset
+    )
+
+
+def get_byte_offset(view, pt):
+    """Get the offset, from the first rendered line, of the byte at the given point."""
+
+    geometry = get_geometry(view)
+    row, column = view.rowcol(pt)
+
+    if geometry.is_ascii(column):
+        byte = column - geometry.ascii_start
+    elif column >= geometry.address_offset:
+        byte = geometry.hex_byte(column)[0]
+    else:
+        byte = 0
+    return get_row_offset(view, row) + max(0, min(byte, geometry.bytes_wide - 1))
+
+
+def is_windowed(view):
+    """Check if the hex view only shows a window of the file."""
+
+    return bool(get_view_state(view).window_lines)
+
+
+def get_window_start(offset, bytes_wide, window_lines, file_size):
+    """Get the line aligned start of a window of lines centered on the given file offset."""
+
+    bytes_wide = int(bytes_wide)
+    total_lines = int(file_size / bytes_wide) + (1 if file_size % bytes_wide else 0)
+    line = int(offset / bytes_wide) - int(window_lines / 2)
+    line = max(0, min(line, total_lines - window_lines))
+    return line * bytes_wide
+
+
+def get_highlight_style(style):
+    """
+    Get the region flags of a highlight style: `solid`, `outline`, `underline`, or `none`.
+
+    Underlines are drawn under whole regions instead of splitting them into one empty region per character.
+    """
+
+    if style == "outline":
+        return sublime.DRAW_OUTLINED
+    elif style == "none":
+        return sublime.HIDDEN
+    elif style == "underline":
+        return sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SOLID_UNDERLINE
+    return 0
+
+
+def merge_regions(regions):
+    """Merge overlapping and touching regions into as few regions as possible."""
+
+    merged = []
+    for region in sorted(regions, key=lambda r: (r.begin(), r.end())):
+        if merged and region.begin() <= merged[-1].end():
+            if region.end() > merged[-1].end():
+                merged[-1] = sublime.Region(merged[-1].begin(), region.end())
         else:
-            end -= 2
-    if start is not None and end is not None:
-        num_bytes = get_byte_count(start, end, group_size)
-    return start, end, num_bytes
+            merged.append(region)
+    return merged
+
+
+def get_icon(icon):
+    """Get the gutter icon of a highlight, `none` is no icon."""
+
+    return "" if icon == "none" else icon
+
 
+def get_format(value, default):
+    """Get an inspector format setting, or the default if it doesn't format a name and a value."""
 
-def underline(selected_bytes):
-    """Convert to empty regions to simulate underline."""
+    try:
+        value % ("", 0)
+    except (TypeError, ValueError):
+        return default
+    return value
 
-    new_regions = []
-    for region in selected_bytes:
-        start = region.begin()
-        end = region.end()
-        while start < end:
-            new_regions.append(sublime.Region(start))
-            start += 1
-    return new_regions
+
+class HexSettings(object):
+    """
+    Snapshot of the settings used on every selection change and inspector update.
+
+    The settings are read and validated once, and again when they change, so the
+    hot paths read plain attributes instead of going through the settings API.
+    Highlight styles are already mapped to their region flags, and `none` icons
+    to no icon.
+    """
+
+    def __init__(self, settings):
+        """Initialize."""
+
+        self.settings = settings
+        self.refresh()
+        settings.add_on_change(SETTINGS_FILE, self.refresh)
+
+    def refresh(self):
+        """Read the settings."""
+
+        get = self.settings.get
+
+        self.use_lowercase_hex = bool(get("use_lowercase_hex", True))
+        self.use_sub_notify = bool(get("use_sub_notify", False))
+        self.enable_fake_hex = bool(get("enable_fake_hex_file", True))
+
+        self.highlight_scope = str(get("highlight_scope", HIGHLIGHT_SCOPE))
+        self.highlight_icon = get_icon(get("highlight_icon", HIGHLIGHT_ICON))
+        self.highlight_style = get_highlight_style(get("highlight_style", HIGHLIGHT_STYLE))
+        self.highlight_throttle = bool(get("highlight_throttle", THROTTLING))
+        try:
+            self.highlight_max_bytes = max(0, int(get("highlight_max_bytes", MAX_HIGHIGHT)))
+        except (TypeError, ValueError):
+            self.highlight_max_bytes = MAX_HIGHIGHT
+
+        self.highlight_edit_scope = str(get("highlight_edit_scope", HIGHLIGHT_EDIT_SCOPE))
+        self.highlight_edit_icon = get_icon(get("highlight_edit_icon", HIGHLIGHT_EDIT_ICON))
+        self.highlight_edit_style = get_highlight_style(get("highlight_edit_style", HIGHLIGHT_EDIT_STYLE))
+
+        self.inspector = bool(get("inspector", False))
+        self.inspector_auto_show = self.inspector and bool(get("inspector_auto_show", False))
+        self.inspector_integer_format = get_format(
+            get("inspector_integer_format", INSPECTOR_INTEGER_FORMAT), INSPECTOR_INTEGER_FORMAT
+        )
+        self.inspector_missing_format = get_format(
+            get("inspector_missing/bad_format", INSPECTOR_MISSING_FORMAT), INSPECTOR_MISSING_FORMAT
+        )
+        self.inspector_float_format = get_format(
+            get("inspector_float_format", INSPECTOR_FLOAT_FORMAT), INSPECTOR_FLOAT_FORMAT
+        )
+        self.inspector_double_format = get_format(
+            get("inspector_double_format", INSPECTOR_FLOAT_FORMAT), INSPECTOR_FLOAT_FORMAT
+        )
+        self.inspector_binary_format = get_format(
+            get("inspector_binary_format", INSPECTOR_BINARY_FORMAT), INSPECTOR_BINARY_FORMAT
+        )
+        timestamp = get("inspector_timestamp_format", INSPECTOR_TIMESTAMP_FORMAT)
+        if not isinstance(timestamp, (list, tuple)) or len(timestamp) != 2:
+            timestamp = INSPECTOR_TIMESTAMP_FORMAT
+        self.inspector_timestamp_format = (
+            get_format(timestamp[0], INSPECTOR_TIMESTAMP_FORMAT[0]), str(timestamp[1])
+        )
+
+    def close(self):
+        """Stop following changes to the settings."""
+
+        self.settings.clear_on_change(SETTINGS_FILE)
+
+
+def get_settings():
+    """Get the settings snapshot, loading it the first time."""
+
+    global hv_snapshot
+
+    if hv_snapshot is None:
+        hv_snapshot = HexSettings(sublime.load_settings(SETTINGS_FILE))
+    return hv_snapshot
 
 
 def hv_settings(key=None, default=None):
     """Get the settings."""
 
     if key is not None:
-        return sublime.load_settings('hex_viewer.sublime-settings').get(key, default)
+        return get_settings().settings.get(key, default)
     else:
-        return sublime.load_settings('hex_viewer.sublime-settings')
+        return get_settings().settings
+
+
+def plugin_unloaded():
+    """Tear down plugin."""
+
+    global hv_snapshot
+
+    if hv_snapshot is not None:
+        hv_snapshot.close()
+        hv_snapshot = None
+
+    for state in hv_views.values():
+        state.close()
+    hv_views.clear()
@@ -0,0 +1,609 @@
+"""
+Hex Viewer.
+
+Licensed under MIT
+Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+import bz2
+import errno
+import gzip
+import lzma
+import mmap
+import os
+import threading
+import traceback
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from .hex_format import HexFormatter, BLOCK_SIZE, format_range, get_address_width, get_block_size, fingerprint
+
+PARALLEL_CHUNK_SIZE = 4194304
+MIN_HOLE_SIZE = 4096
+COMPRESSED_EXTENSIONS = {
+    ".gz": "gzip",
+    ".tgz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".lzma": "xz",
+    ".zip": "zip"
+}
+DECOMPRESSORS = {
+    "gzip": lambda f: gzip.GzipFile(fileobj=f, mode="rb"),
+    "bz2": bz2.BZ2File,
+    "xz": lzma.LZMAFile
+}
+
+
+def get_compression(file_name):
+    """Get the kind of compression of a file from its extension, or `None` if it isn't compressed."""
+
+    return COMPRESSED_EXTENSIONS.get(os.path.splitext(file_name)[1].lower())
+
+
+def get_members(file_name):
+    """Get the info of the files in a zip archive."""
+
+    with zipfile.ZipFile(file_name) as archive:
+        return [info for info in archive.infolist() if not info.is_dir()]
+
+
+class DecompressedFile(object):
+    """
+    Decompress a file, or a member of a zip archive, as it is read.
+
+    The decompressed size is generally not known up front, so progress is tracked
+    by the compressed bytes consumed so far, and reading fails once more than `limit`
+    bytes are decompressed.
+    """
+
+    def __init__(self, file_name, compression, member=None, limit=None):
+        """Initialize."""
+
+        self.limit = limit
+        self.count = 0
+        self.raw = open(file_name, "rb")
+        self.archive = None
+        self.file = None
+        try:
+            if compression == "zip":
+                self.archive = zipfile.ZipFile(self.raw)
+                info = self.archive.getinfo(member)
+                self.start = info.header_offset
+                self.size = info.compress_size
+                self.file = self.archive.open(info)
+            else:
+                self.start = 0
+                self.size = os.fstat(self.raw.fileno()).st_size
+                self.file = DECOMPRESSORS[compression](self.raw)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def get_sizes(file_name, compression, member=None):
+        """
+        Get the compressed size and the best known estimate of the decompressed size.
+
+        Only zip archives record the decompressed size, other files estimate it with the
+        compressed size, so limits on the decompressed size have to be enforced when reading.
+        """
+
+        if compression == "zip":
+            with zipfile.ZipFile(file_name) as archive:
+                info = archive.getinfo(member)
+                return info.compress_size, info.file_size
+        size = os.stat(file_name).st_size
+        return size, size
+
+    def readinto(self, buffer):
+        """Read decompressed data into the buffer."""
+
+        count = self.file.readinto(buffer)
+        self.count += count
+        if self.limit is not None and self.count > self.limit:
+            raise ValueError("Decompressed data is larger than %d bytes!" % self.limit)
+        return count
+
+    def consumed(self):
+        """Get the number of compressed bytes consumed."""
+
+        return max(0, min(self.raw.tell() - self.start, self.size))
+
+    def close(self):
+        """Close the file."""
+
+        if self.file is not None:
+            self.file.close()
+        if self.archive is not None:
+            self.archive.close()
+        self.raw.close()
+
+    def __enter__(self):
+        """Enter."""
+
+        return self
+
+    def __exit__(self, *args):
+        """Exit."""
+
+        self.close()
+
+
+class RenderState(object):
+    """Fingerprints of the blocks rendered in a hex view."""
+
+    def __init__(self, file_name, bytes_wide, group_size, hex_lower, starting_address, offset=0, address_width=None):
+        """Initialize."""
+
+        self.file_name = file_name
+        self.bytes_wide = bytes_wide
+        self.group_size = group_size
+        self.hex_lower = hex_lower
+        self.starting_address = starting_address
+        self.address_width = address_width
+        # File offset of the first rendered byte
+        self.offset = offset
+        self.fingerprints = []
+        self.complete = False
+        # Size and modified time of the file when it was read
+        self.stamp = None
+        # Bytes that were rendered, if kept, so the view can be re-laid out without reading the file
+        self.data = None
+
+    def matches(self, other):
+        """Check if the other state renders the file the same way."""
+
+        return (
+            self.complete and
+            self.file_name == other.file_name and
+            self.bytes_wide == other.bytes_wide and
+            self.group_size == other.group_size and
+            self.hex_lower == other.hex_lower and
+            self.starting_address == other.starting_address and
+            self.offset == other.offset and
+            self.address_width == other.address_width
+        )
+
+
+class HexConverter(object):
+    """
+    Convert a file, or a range of it, to hex view lines.
+
+    This is independent of Sublime so it can be run (and benchmarked) outside of the editor.
+    """
+
+    def __init__(
+        self, file_name, bytes_wide, group_size, starting_address=0, offset=0, length=None, fingerprints=None,
+        hex_lower=True, processes=0, sparse=False, repeats=False, compression=None, member=None, max_data_size=None
+    ):
+        """Initialize."""
+
+        self.starting_address = starting_address
+        self.bytes_wide = int(bytes_wide)
+        self.group_size = int(group_size)
+        self.file_name = file_name
+        stat = os.stat(file_name)
+        self.total_size = stat.st_size
+        # Only the bytes in `[offset, offset + length)` are converted
+        self.offset = min(offset, self.total_size)
+        remain = self.total_size - self.offset
+        self.file_size = remain if length is None else min(length, remain)
+        # Compressed files are decompressed as they are read, and zip archives have a member read instead
+        self.compression = compression
+        self.member = member if compression == "zip" else None
+        # Conversion fails if decompressing yields more bytes than this
+        self.max_data_size = max_data_size
+        self.source = None
+        data_size = self.file_size
+        if compression is not None:
+            # Progress is measured in compressed bytes as the decompressed size is generally not known
+            self.offset = 0
+            self.file_size, data_size = DecompressedFile.get_sizes(file_name, compression, self.member)
+        self.read_count = 0
+        self.abort = False
+        self.hex_lower = hex_lower
+        self.processes = int(processes)
+        self.lock = threading.Lock()
+        # Every address of the file has the same number of digits, so windows and ranges of it line up
+        self.address_width = get_address_width(
+            starting_address + (self.total_size if compression is None else data_size)
+        )
+        self.state = RenderState(
+            file_name, self.bytes_wide, self.group_size, self.hex_lower, starting_address, self.offset,
+            self.address_width
+        )
+        self.state.stamp = (stat.st_size, stat.st_mtime_ns)
+        # When the fingerprints of a previous render are given, only changed blocks are converted
+        self.old_fingerprints = fingerprints
+        self.changes = None
+        # Converted text is also sent through the queue when streaming into a view
+        self.queue = None
+        # Holes of sparse files and runs of repeated lines are only collapsed when converting the whole file
+        self.holes = self.find_holes() if sparse and length is None and compression is None else []
+        self.repeats = repeats and length is None
+        self.collapsing = bool(self.holes) or self.repeats
+        self.data_size = data_size - sum(end - start for start, end in self.holes)
+        # `[row, start, end]` of each collapsed range: the view row of its marker line and its offsets
+        self.collapsed = []
+        self.rows = 0
+
+    def find_holes(self):
+        """
+        Find the holes of a sparse file without reading them.
+
+        Returns a list of `(start, end)` for each hole worth collapsing, where `start` and `end`
+        are line aligned offsets from the start of the conversion.
+        """
+
+        if not hasattr(os, "SEEK_DATA") or not self.file_size:
+            return []
+
+        ranges = []
+        end = self.offset + self.file_size
+        try:
+            with open(self.file_name, "rb") as bin_file:
+                fd = bin_file.fileno()
+                pos = self.offset
+                while pos < end:
+                    try:
+                        data = min(os.lseek(fd, pos, os.SEEK_DATA), end)
+                    except OSError as e:
+                        if e.errno != errno.ENXIO:
+                            raise
+                        # No more data: the rest of the file is a hole
+                        data = end
+                    if data > pos:
+                        ranges.append((pos - self.offset, data - self.offset))
+                    if data >= end:
+                        break
+                    pos = os.lseek(fd, data, os.SEEK_HOLE)
+        except OSError:
+            # Not supported by the file system
+            return []
+
+        holes = []
+        bytes_wide = self.bytes_wide
+        for start, stop in ranges:
+            # Only collapse whole lines of the hole
+            start = -(-start // bytes_wide) * bytes_wide
+            stop = stop - stop % bytes_wide
+            if stop - start >= max(MIN_HOLE_SIZE, bytes_wide * 2):
+                holes.append((start, stop))
+        return holes
+
+    def get_formatter(self):
+        """Get the formatter of the lines of the converted range."""
+
+        return HexFormatter(
+            self.bytes_wide, self.group_size, self.hex_lower, self.starting_address + self.offset, self.address_width
+        )
+
+    def itermap(self, mapped, blocksize, start, end):
+        """Iterate through a memory mapped file yielding zero-copy windows."""
+
+        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+
+        with memoryview(mapped) as view:
+            for pos in range(start, end, blocksize):
+                window = view[pos:min(pos + blocksize, end)]
+                try:
+                    yield window
+                finally:
+                    # Windows must be released before the map can be closed
+                    window.release()
+
+    def iterbuffer(self, bin_file, blocksize, start, end):
+        """Iterate through the file reading blocks into a single reused buffer, until the end if `end` is `None`."""
+
+        if start:
+            bin_file.seek(start)
+
+        remain = end - start if end is not None else None
+        buffer = bytearray(blocksize)
+        with memoryview(buffer) as view:
+            count = blocksize
+            while count == blocksize:
+                limit = blocksize if remain is None else min(blocksize, remain)
+                # Special files may return short reads, so fill the buffer unless we hit the end
+                count = 0
+                while count < limit:
+                    read = bin_file.readinto(view[count:limit])
+                    if not read:
+                        break
+                    count += read
+                if not count:
+                    break
+                if remain is not None:
+                    remain -= count
+                window = view[:count]
+                try:
+                    yield window
+                finally:
+                    window.release()
+
+    def iterfile(self, maxblocksize=BLOCK_SIZE, start=None, end=None):
+        """
+        Iterate through the file chunking the data in blocks of whole lines.
+
+        Blocks are `memoryview` windows of a memory mapped file.  If the file cannot
+        be mapped (empty files, special files, etc.), fall back to reading into a
+        reused buffer.  Blocks are only valid until the next block is requested.
+        By default, the whole range to convert is iterated.  Compressed files are
+        always decompressed from the start to the end.
+        """
+
+        # Ensure read block is a multiple of the line width
+        blocksize = get_block_size(self.bytes_wide, maxblocksize)
+
+        if self.compression is not None:
+            with DecompressedFile(self.file_name, self.compression, self.member, self.max_data_size) as source:
+                self.source = source
+                try:
+                    yield from self.iterbuffer(source, blocksize, 0, None)
+                finally:
+                    self.source = None
+            return
+
+        if start is None:
+            start = self.offset
+        if end is None:
+            end = self.offset + self.file_size
+
+        with open(self.file_name, "rb") as bin_file:
+            try:
+                mapped = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                mapped = None
+
+            if mapped is None:
+                # Special files report a size of zero, so read them until the end
+                yield from self.iterbuffer(bin_file, blocksize, start, end if self.total_size else None)
+            else:
+                with mapped:
+                    yield from self.itermap(mapped, blocksize, start, end)
+
+    def keep_data(self):
+        """Keep the bytes that are rendered in the render state."""
+
+        self.state.data = bytearray()
+
+    def emit(self, f, text):
+        """Write converted text."""
+
+        f.write(text)
+        if self.queue is not None:
+            self.queue.put(text)
+
+    def update_progress(self, read_count):
+        """Update the progress with the bytes read so far, or the compressed bytes consumed when decompressing."""
+
+        if self.source is not None:
+            self.read_count = self.source.consumed()
+        else:
+            self.read_count = min(read_count, self.file_size)
+
+    def progress(self, future):
+        """Add the bytes of a finished chunk to the progress."""
+
+        if not future.cancelled():
+            with self.lock:
+                self.read_count += future.length
+
+    def convert_parallel(self, f):
+        """Convert line aligned ranges of the file in a process pool and write them in order."""
+
+        # Chunks are made of whole blocks so the fingerprints line up with the serial conversion
+        blocksize = get_block_size(self.bytes_wide)
+        chunk_size = blocksize * max(1, PARALLEL_CHUNK_SIZE // blocksize)
+        end = self.offset + self.file_size
+        pool = ProcessPoolExecutor(self.processes)
+        # Chunks are read by the worker processes, so read them again to keep them
+        bin_file = open(self.file_name, "rb") if self.state.data is not None else None
+        if bin_file is not None:
+            bin_file.seek(self.offset)
+        try:
+            futures = []
+            for start in range(self.offset, end, chunk_size):
+                future = pool.submit(
+                    format_range, self.file_name, start, min(chunk_size, end - start),
+                    self.bytes_wide, self.group_size, self.hex_lower, self.starting_address, self.address_width
+                )
+                future.length = min(chunk_size, end - start)
+                future.add_done_callback(self.progress)
+                futures.append(future)
+
+            for index, future in enumerate(futures):
+                result = None
+                while result is None:
+                    if self.abort:
+                        return
+                    try:
+                        result = future.result(timeout=0.1)
+                    except FutureTimeoutError:
+                        pass
+                text, fingerprints = result
+                self.emit(f, ("\n" if index > 0 else "") + text)
+                self.state.fingerprints.extend(fingerprints)
+                if bin_file is not None:
+                    self.state.data += bin_file.read(future.length)
+        finally:
+            # Cancel pending chunks if we were aborted or failed
+            pool.shutdown(wait=False, cancel_futures=True)
+            if bin_file is not None:
+                bin_file.close()
+
+    def convert(self, f):
+        """Convert the file block by block."""
+
+        formatter = self.get_formatter()
+
+        line = 0
+        read_count = 0
+        for byte_array in self.iterfile():
+            if self.abort:
+                return
+
+            # Convert the entire block of lines at once
+            self.emit(f, ("\n" if line > 0 else "") + formatter.format_lines(byte_array, line))
+            self.state.fingerprints.append(fingerprint(byte_array))
+            if self.state.data is not None:
+                self.state.data += byte_array
+
+            read_count += len(byte_array)
+            self.update_progress(read_count)
+            line += len(byte_array) // self.bytes_wide
+
+    def emit_lines(self, f, formatter, data, pos):
+        """Write the lines of a block of data starting at the given offset."""
+
+        self.emit(f, ("\n" if self.rows else "") + formatter.format_lines(data, pos // self.bytes_wide))
+        self.rows += -(-len(data) // self.bytes_wide)
+
+    def emit_marker(self, f, text, start, end):
+        """Write the marker line of a collapsed range."""
+
+        self.collapsed.append([self.rows, start, end])
+        self.emit(f, ("\n" if self.rows else "") + text)
+        self.rows += 1
+
+    def collapse_repeats(self, f, formatter, block, pos, prev, run_start):
+        """
+        Write a block of data collapsing runs of repeated lines.
+
+        `prev` is the last line before the block and `run_start` is the start of the run
+        of repeated lines that is still going on, if any.  Returns the updated values.
+        """
+
+        bytes_wide = self.bytes_wide
+        full = len(block) - len(block) % bytes_wide
+
+        # The whole block just repeats the previous line
+        if (
+            prev is not None and full == len(block) and
+            block[:bytes_wide] == prev and block[bytes_wide:] == block[:-bytes_wide]
+        ):
+            return prev, pos if run_start is None else run_start
+
+        segment = 0
+        last = prev
+        for i in range(0, full, bytes_wide):
+            line = block[i:i + bytes_wide]
+            if last is not None and line == last:
+                if run_start is None:
+                    if i > segment:
+                        self.emit_lines(f, formatter, block[segment:i], pos + segment)
+                    run_start = pos + i
+            else:
+                if run_start is not None:
+                    self.emit_marker(f, formatter.format_repeat(run_start, pos + i), run_start, pos + i)
+                    run_start = None
+                    segment = i
+                last = line
+
+        if run_start is not None and full < len(block):
+            # An incomplete last line never repeats
+            self.emit_marker(f, formatter.format_repeat(run_start, pos + full), run_start, pos + full)
+            run_start = None
+            segment = full
+        if run_start is None:
+            self.emit_lines(f, formatter, block[segment:], pos + segment)
+        # Blocks are only valid until the next block is read
+        return (bytes(last) if last is not prev else prev), run_start
+
+    def convert_collapsed(self, f):
+        """
+        Convert the file block by block, collapsing ranges into marker lines.
+
+        Holes of sparse files are skipped without reading them, and, if enabled,
+        runs of lines that repeat the line before them are collapsed.
+        """
+
+        formatter = self.get_formatter()
+
+        prev = None
+        run_start = None
+        read_count = 0
+        pos = 0
+        for hole_start, hole_end in self.holes + [(self.file_size, self.file_size)]:
+            # Convert the data before the hole
+            for byte_array in self.iterfile(start=self.offset + pos, end=self.offset + hole_start):
+                if self.abort:
+                    return
+
+                if self.repeats:
+                    prev, run_start = self.collapse_repeats(f, formatter, byte_array, pos, prev, run_start)
+                else:
+                    self.emit_lines(f, formatter, byte_array, pos)
+
+                pos += len(byte_array)
+                read_count += len(byte_array)
+                self.update_progress(read_count)
+
+            if run_start is not None:
+                self.emit_marker(f, formatter.format_repeat(run_start, pos), run_start, pos)
+                run_start = None
+
+            if hole_end > hole_start:
+                self.emit_marker(f, formatter.format_hole(hole_start, hole_end), hole_start, hole_end)
+                prev = None
+                read_count += hole_end - hole_start
+                self.read_count = read_count
+            pos = hole_end
+
+    def write(self, f):
+        """Convert the file to the given text file, in parallel if enabled and worth it."""
+
+        if self.collapsing:
+            # Kept bytes and fingerprints are not available when ranges are collapsed
+            self.state.data = None
+            self.convert_collapsed(f)
+            return
+
+        if self.processes > 1 and self.compression is None and self.file_size > PARALLEL_CHUNK_SIZE * 2:
+            try:
+                self.convert_parallel(f)
+                return
+            except Exception:
+                # Processes may not be available in the plugin host; convert in this thread instead
+                if f.tell():
+                    raise
+                print(str(traceback.format_exc()))
+                f.seek(0)
+                f.truncate()
+                self.read_count = 0
+        self.convert(f)
+
+    def fingerprint(self):
+        """Fingerprint the blocks of the file without converting them."""
+
+        for byte_array in self.iterfile():
+            if self.abort:
+                return
+            self.state.fingerprints.append(fingerprint(byte_array))
+            if self.state.data is not None:
+                self.state.data += byte_array
+
+    def diff(self):
+        """Fingerprint the blocks of the file and only convert the blocks that changed."""
+
+        formatter = self.get_formatter()
+
+        changes = []
+        line = 0
+        read_count = 0
+        for index, byte_array in enumerate(self.iterfile()):
+            if self.abort:
+                return
+
+            value = fingerprint(byte_array)
+            self.state.fingerprints.append(value)
+            if self.state.data is not None:
+                self.state.data += byte_array
+            if index >= len(self.old_fingerprints) or self.old_fingerprints[index] != value:
+                changes.append((index, formatter.format_lines(byte_array, line)))
+
+            read_count += len(byte_array)
+            self.update_progress(read_count)
+            line += len(byte_array) // self.bytes_wide
+        self.changes = changes
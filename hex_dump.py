@@ -0,0 +1,133 @@
+"""
+Hex Viewer.
+
+Licensed under MIT
+Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
+
+Convert files to hex view files from the command line.
+
+The output is identical to what the plugin renders, so the resulting `.hxv` files
+can be opened in Sublime Text as hex views of static data.  Files are converted in
+parallel in a process pool.  Run it as a module from the folder containing the package:
+
+    python -m HexViewer.hex_dump --bytes-per-line 16 --group-bytes-by-bits 32 *.bin
+"""
+import argparse
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .hex_format import get_layout, DEFAULT_BIT_GROUP, DEFAULT_BYTES_WIDE
+from .hex_convert import HexConverter
+
+SUFFIX = ".hxv"
+
+
+def get_output_name(file_name, directory=None):
+    """Get the name of the hex file of the given file."""
+
+    if directory is None:
+        return file_name + SUFFIX
+    return os.path.join(directory, os.path.basename(file_name) + SUFFIX)
+
+
+def get_umask():
+    """Get the file mode creation mask of the process."""
+
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def dump_file(file_name, hex_name, bytes_wide, group_size, hex_lower=True, starting_address=0):
+    """
+    Convert a file to a hex file.
+
+    The text is written to a temporary file that replaces the hex file when done,
+    so an existing hex file is never left half written.
+    """
+
+    fd, temp_name = tempfile.mkstemp(suffix=SUFFIX, dir=os.path.dirname(os.path.abspath(hex_name)))
+    try:
+        with os.fdopen(fd, "w") as f:
+            HexConverter(
+                file_name, bytes_wide, group_size, starting_address, hex_lower=hex_lower
+            ).write(f)
+        # Temporary files are only readable by the owner, give the hex file the usual permissions
+        os.chmod(temp_name, 0o666 & ~get_umask())
+        os.replace(temp_name, hex_name)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+    return hex_name
+
+
+def dump_files(files, bytes_wide, group_size, hex_lower=True, starting_address=0, directory=None, jobs=None):
+    """
+    Convert the files in a process pool.
+
+    Yields the name, hex file name, and error, if any, of each file as it finishes.
+    """
+
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = {
+            pool.submit(
+                dump_file, file_name, get_output_name(file_name, directory),
+                bytes_wide, group_size, hex_lower, starting_address
+            ): file_name for file_name in files
+        }
+        for future in as_completed(futures):
+            file_name = futures[future]
+            try:
+                yield file_name, future.result(), None
+            except Exception as e:
+                yield file_name, None, e
+
+
+def main(argv=None):
+    """Convert the files given on the command line."""
+
+    parser = argparse.ArgumentParser(
+        prog="hex_dump", description="Convert files to Hex Viewer hex files (%s)." % SUFFIX
+    )
+    parser.add_argument("files", nargs="+", help="Files to convert.")
+    parser.add_argument(
+        "--bytes-per-line", "-b", type=int, default=DEFAULT_BYTES_WIDE,
+        help="Value of 'bytes_per_line' (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--group-bytes-by-bits", "-g", type=int, default=DEFAULT_BIT_GROUP,
+        help="Value of 'group_bytes_by_bits' (default: %(default)s)."
+    )
+    parser.add_argument(
+        "--uppercase", "-u", action="store_true",
+        help="Use upper case hex, the same as setting 'use_lowercase_hex' to false."
+    )
+    parser.add_argument(
+        "--starting-address", "-a", type=lambda value: int(value, 0), default=0,
+        help="Address of the first byte of each file."
+    )
+    parser.add_argument("--output", "-o", default=None, help="Folder to write the hex files to.")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None, help="Number of files to convert at once (default: CPU count)."
+    )
+    args = parser.parse_args(argv)
+
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+    bytes_wide, group_size = get_layout(args.group_bytes_by_bits, args.bytes_per_line)
+
+    failed = 0
+    for file_name, hex_name, err in dump_files(
+        args.files, bytes_wide, group_size, not args.uppercase, args.starting_address, args.output, args.jobs
+    ):
+        if err is None:
+            print("%s -> %s" % (file_name, hex_name))
+        else:
+            failed += 1
+            print("%s: %s" % (file_name, err), file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
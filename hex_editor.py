@@ -11,12 +11,9 @@ from os.path import basename
 from struct import unpack
 from . import hex_common as common
 from binascii import unhexlify, hexlify
+from .hex_format import HexFormatter
 from .hex_notify import error
 
-HIGHLIGHT_EDIT_SCOPE = "keyword"
-HIGHLIGHT_EDIT_ICON = "none"
-HIGHLIGHT_EDIT_STYLE = "underline"
-
 
 class HexEditGlobal(object):
     """Hex edit global object."""
@@ -71,29 +68,17 @@ class HexEditorListenerCommand(sublime_plugin.EventListener):
             # Restore view
             if view is not None:
                 # Get highlight settings
-                highlight_scope = common.hv_settings("highlight_edit_scope", HIGHLIGHT_EDIT_SCOPE)
-                highlight_icon = common.hv_settings("highlight_edit_icon", HIGHLIGHT_EDIT_ICON)
-                style = common.hv_settings("highlight_edit_style", HIGHLIGHT_EDIT_STYLE)
-
-                # No icon?
-                if highlight_icon == "none":
-                    highlight_icon = ""
-
-                # Process highlight style
-                if style == "outline":
-                    style = sublime.DRAW_OUTLINED
-                elif style == "none":
-                    style = sublime.HIDDEN
-                elif style == "underline":
-                    style = sublime.DRAW_EMPTY_AS_OVERWRITE
-                else:
-                    style = 0
+                settings = common.get_settings()
+                highlight_scope = settings.highlight_edit_scope
+                highlight_icon = settings.highlight_edit_icon
+                style = settings.highlight_edit_style
 
                 # Setup view with saved settings
                 view.set_name(basename(self.fail_safe_view["name"]) + ".hxv")
                 view.settings().set("hex_viewer_bits", self.fail_safe_view["bits"])
                 view.settings().set("hex_viewer_bytes", self.fail_safe_view["bytes"])
                 view.settings().set("hex_viewer_actual_bytes", self.fail_safe_view["actual"])
+                view.settings().set("hex_viewer_address_width", self.fail_safe_view["address_width"])
                 view.settings().set("hex_viewer_file_name", self.fail_safe_view["name"])
                 view.settings().set("font_face", self.fail_safe_view["font_face"])
                 view.settings().set("font_size", self.fail_safe_view["font_size"])
@@ -105,7 +90,8 @@ class HexEditorListenerCommand(sublime_plugin.EventListener):
                 HexEditGlobal.clear()
                 view.set_scratch(True)
                 view.set_read_only(True)
-                view.sel().add(sublime.Region(common.ADDRESS_OFFSET, common.ADDRESS_OFFSET))
+                address_offset = common.get_geometry(view).address_offset
+                view.sel().add(sublime.Region(address_offset, address_offset))
                 view.add_regions(
                     "hex_edit",
                     self.fail_safe_view["edits"],
@@ -140,6 +126,7 @@ class HexEditorListenerCommand(sublime_plugin.EventListener):
                     "bits": view.settings().get("hex_viewer_bits"),
                     "bytes": view.settings().get("hex_viewer_bytes"),
                     "actual": view.settings().get("hex_viewer_actual_bytes"),
+                    "address_width": view.settings().get("hex_viewer_address_width", common.ADDRESS_WIDTH),
                     "name": file_name,
                     "font_face": view.settings().get("font_face"),
                     "font_size": view.settings().get("font_size"),
@@ -179,10 +166,9 @@ class HexDiscardEditsCommand(sublime_plugin.WindowCommand):
     def run(self):
         """Run command."""
         view = self.window.active_view()
-        group_size = int(view.settings().get("hex_viewer_bits", None))
-        bytes_wide = int(view.settings().get("hex_viewer_actual_bytes", None))
+        state = common.get_view_state(view)
         common.clear_edits(view)
-        self.window.run_command('hex_viewer', {"bits": group_size, "byte_array": bytes_wide})
+        self.window.run_command('hex_viewer', {"bits": int(state.bits), "byte_array": int(state.bytes_wide)})
 
 
 class HexEditorCommand(sublime_plugin.WindowCommand):
@@ -196,29 +182,18 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
         init_status = False
 
         # Get highlight settings
-        self.highlight_scope = common.hv_settings("highlight_edit_scope", HIGHLIGHT_EDIT_SCOPE)
-        self.highlight_icon = common.hv_settings("highlight_edit_icon", HIGHLIGHT_EDIT_ICON)
-        style = common.hv_settings("highlight_edit_style", HIGHLIGHT_EDIT_STYLE)
-
-        # No icon?
-        if self.highlight_icon == "none":
-            self.highlight_icon = ""
-
-        # Process highlight style
-        self.highlight_style = 0
-        if style == "outline":
-            self.highlight_style = sublime.DRAW_OUTLINED
-        elif style == "none":
-            self.highlight_style = sublime.HIDDEN
-        elif style == "underline":
-            self.highlight_style = sublime.DRAW_EMPTY_AS_OVERWRITE
+        settings = common.get_settings()
+        self.highlight_scope = settings.highlight_edit_scope
+        self.highlight_icon = settings.highlight_edit_icon
+        self.highlight_style = settings.highlight_edit_style
 
         # Get Seetings from settings file
-        group_size = self.view.settings().get("hex_viewer_bits", None)
-        self.bytes_wide = self.view.settings().get("hex_viewer_actual_bytes", None)
+        state = common.get_view_state(self.view)
+        self.bytes_wide = state.bytes_wide
         # Process hex grouping
-        if group_size is not None and self.bytes_wide is not None:
-            self.group_size = group_size / common.BITS_PER_BYTE
+        if state.geometry is not None:
+            self.group_size = state.geometry.group_size
+            self.geometry = state.geometry
             init_status = True
         return init_status
 
@@ -226,7 +201,11 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
         """Check if command is enabled."""
 
         view = self.window.active_view()
-        return common.is_enabled() and view is not None and not view.settings().get("hex_viewer_fake", False)
+        return (
+            common.is_enabled() and view is not None and
+            not view.settings().get("hex_viewer_fake", False) and
+            not common.is_windowed(view)
+        )
 
     def apply_edit(self, value):
         """Apply edits."""
@@ -265,7 +244,7 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
                 ascii_str = " :"
                 start = 0
                 ascii_start_pos = self.ascii_pos
-                hex_start_pos = self.line["range"].begin() + common.ADDRESS_OFFSET
+                hex_start_pos = self.line["range"].begin() + self.geometry.address_offset
                 end = len(edits)
                 count = 1
                 change_start = None
@@ -293,7 +272,8 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
                                 regions.append(sublime.Region(change_start[0], hex_start_pos + 2))
                                 change_start[0] = None
                     elif change_start is not None:
-                        if self.view.score_selector(hex_start_pos - 1, 'raw.nibble.lower'):
+                        # Unless at the start of a group, the previous char is the lower nibble of the previous byte
+                        if count != 1:
                             if change_start[0] is not None:
                                 regions.append(sublime.Region(change_start[0], hex_start_pos))
                         else:
@@ -330,23 +310,20 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
                 l_buffer += " " * int(group_space + delta * 2) + ascii_str
 
                 # Apply buffer edit
+                region, repeat = self.split_repeat(self.line["range"])
                 self.view.sel().clear()
                 self.view.set_read_only(False)
-                HexEditGlobal.bfr = l_buffer
-                HexEditGlobal.region = self.line["range"]
+                HexEditGlobal.bfr = l_buffer + repeat
+                HexEditGlobal.region = region
                 self.view.run_command("hex_edit_apply")
                 HexEditGlobal.clear()
                 self.view.set_read_only(True)
                 self.view.sel().add(sublime.Region(self.start_pos, self.end_pos))
 
-                # Underline if required
-                if self.highlight_style == sublime.DRAW_EMPTY_AS_OVERWRITE:
-                    regions = common.underline(regions)
-
                 # Highlight changed bytes
                 self.view.add_regions(
                     "hex_edit",
-                    regions,
+                    common.merge_regions(regions),
                     self.highlight_scope,
                     self.highlight_icon,
                     self.highlight_style
@@ -359,6 +336,33 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
         # Clean up
         self.reset()
 
+    def split_repeat(self, line):
+        """
+        Keep a copy of the original line if the next line is a collapsed run of lines repeating it.
+
+        Returns the region to replace with the edited line and the text to add after it.
+        """
+
+        view = self.view
+        if line.end() >= view.size() or view.substr(line.end() + 1) != "*":
+            return line, ""
+
+        settings = view.settings()
+        row = view.rowcol(line.end() + 1)[0]
+        collapsed = settings.get("hex_viewer_collapsed", [])
+        index = next((i for i, entry in enumerate(collapsed) if entry[0] == row), None)
+        if index is None:
+            return line, ""
+
+        # Take the first line out of the run
+        formatter = HexFormatter(
+            self.bytes_wide, self.group_size, common.use_hex_lowercase(),
+            settings.get("hex_viewer_starting_address", 0), self.geometry.address_width
+        )
+        text = "\n" + formatter.split_repeat(collapsed, index, view.substr(line))
+        settings.set("hex_viewer_collapsed", collapsed)
+        return line.cover(view.line(line.end() + 1)), text
+
     def reset(self):
         """Reset."""
 
@@ -368,36 +372,17 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
         self.end_pos = -1
         self.line = {}
 
-    def ascii_to_hex(self, start, end):
+    def ascii_to_hex(self, start, end, line):
         """Convert ascii to hex."""
 
-        num_bytes = 0
-        size = end - start
-        ascii_range = self.view.extract_scope(start)
-
-        # Determine if selection is within ascii range
-        if start >= ascii_range.begin() and end <= ascii_range.end() + 1:
-            # Single char selection or multi
-            num_bytes = 1 if size == 0 else end - start
+        first, num_bytes = self.geometry.select_ascii(
+            start - line.begin(), end - line.begin(), self.geometry.line_bytes(self.view.substr(line))
+        )
 
         if num_bytes != 0:
-            row, column = self.view.rowcol(start)
-            column = common.ascii_to_hex_col(start - ascii_range.begin(), self.group_size)
-            hex_pos = self.view.text_point(row, column)
-            start = hex_pos
-
-            # Traverse row finding the specified bytes
-            byte_count = num_bytes
-            while byte_count:
-                # Byte rising edge
-                if self.view.score_selector(hex_pos, 'raw.nibble.upper'):
-                    hex_pos += 2
-                    byte_count -= 1
-                    # End of selection
-                    if byte_count == 0:
-                        end = hex_pos - 1
-                else:
-                    hex_pos += 1
+            # Upper nibble of the first byte to lower nibble of the last
+            start = line.begin() + self.geometry.hex_column(first)
+            end = line.begin() + self.geometry.hex_column(first + num_bytes - 1) + 1
         return start, end, num_bytes
 
     def edit_panel(self, value, error=None):
@@ -435,18 +420,18 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
 
             # Get range of hex data
             line = self.view.line(start)
-            range_start = line.begin() + common.ADDRESS_OFFSET
-            range_end = range_start + common.get_hex_char_range(self.group_size, self.bytes_wide)
+            range_start = line.begin() + self.geometry.address_offset
+            range_end = line.begin() + self.geometry.hex_end
             hex_range = sublime.Region(range_start, range_end)
 
-            if self.view.score_selector(start, "comment"):
-                start, end, num_bytes = self.ascii_to_hex(start, end)
+            if self.geometry.is_ascii(start - line.begin()):
+                start, end, num_bytes = self.ascii_to_hex(start, end, line)
 
             # Determine if selection is within hex range
             if start >= hex_range.begin() and end <= hex_range.end():
                 # Adjust beginning of selection to begining of first selected byte
                 if num_bytes == 0:
-                    start, end, num_bytes = common.adjust_hex_sel(self.view, start, end, self.group_size)
+                    start, end, num_bytes = common.adjust_hex_sel(self.view, start, end, self.geometry)
 
                 # Get general line info for diffing and editing
                 if num_bytes != 0:
@@ -457,7 +442,9 @@ class HexEditorCommand(sublime_plugin.WindowCommand):
                     selection = self.view.substr(sublime.Region(start, end + 1))
                     self.line = {
                         "range": line,
-                        "address": self.view.substr(sublime.Region(line.begin(), line.begin() + common.ADDRESS_OFFSET)),
+                        "address": self.view.substr(
+                            sublime.Region(line.begin(), line.begin() + self.geometry.address_offset)
+                        ),
                         "selection": selection.replace(" ", ""),
                         "data1": self.view.substr(sublime.Region(hex_range.begin(), start)).replace(" ", ""),
                         "data2": self.view.substr(sublime.Region(end + 1, hex_range.end() + 1)).replace(" ", "")
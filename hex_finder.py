@@ -21,29 +21,47 @@ class HexFinderCommand(sublime_plugin.WindowCommand):
 
         if self.handshake != -1 and self.handshake == view.id():
             # Adress offset for line
-            address_offset = view.settings().get('hex_viewer_starting_address', 0)
-            group_size = view.settings().get("hex_viewer_bits", None)
-            bytes_wide = view.settings().get("hex_viewer_actual_bytes", None)
-            if group_size is None and bytes_wide is None:
+            state = common.get_view_state(view)
+            address_offset = state.starting_address
+            if state.geometry is None:
                 return
-            group_size = group_size / common.BITS_PER_BYTE
+            group_size = state.geometry.group_size
+            bytes_wide = state.geometry.bytes_wide
 
             # Go to address
             try:
                 # Address wanted
                 wanted = int(address, 16) - address_offset
+
+                # Windowed views only contain a slice of the file; move the window if needed
+                if common.is_windowed(view):
+                    window_start = view.settings().get("hex_viewer_window_start", 0)
+                    rows = view.rowcol(view.size())[0] + 1
+                    if wanted < 0 or wanted >= rows * bytes_wide:
+                        assert wanted + window_start >= 0, "Address does not exist!"
+                        self.window.run_command("hex_viewer_window", {"offset": wanted + window_start})
+                        self.reset()
+                        return
+
                 assert wanted >= 0, "Address does not exist!"
-                # Calculate row
-                row = int(wanted / (bytes_wide))
+                # Calculate row (collapsed ranges take up a single row)
+                row = common.get_offset_row(view, wanted)
                 # Byte offset into final row
-                byte = wanted % (bytes_wide)
-                #   Calculate byte number              Offset Char
-                #
-                #  wanted_char      byte
-                # ------------ = -----------  => wanted_char + 11 = column
-                #  total_chars   total_bytes
-                #
-                column = int((float(byte) / group_size) * ((group_size) * 2 + 1)) + common.ADDRESS_OFFSET
+                byte = wanted - common.get_row_offset(view, row)
+                if byte >= bytes_wide:
+                    # Address is in a collapsed range; go to its marker line
+                    column = 0
+                else:
+                    #   Calculate byte number              Offset Char
+                    #
+                    #  wanted_char      byte
+                    # ------------ = -----------  => wanted_char + address offset = column
+                    #  total_chars   total_bytes
+                    #
+                    column = (
+                        int((float(byte) / group_size) * ((group_size) * 2 + 1)) +
+                        common.get_geometry(view).address_offset
+                    )
 
                 # Go to address and focus
                 pt = view.text_point(row, column)
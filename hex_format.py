@@ -0,0 +1,358 @@
+"""
+Hex Viewer.
+
+Licensed under MIT
+Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+import hashlib
+
+BLOCK_SIZE = 65536
+BITS_PER_BYTE = 8
+DEFAULT_BIT_GROUP = 16
+DEFAULT_BYTES_WIDE = 24
+VALID_BITS = [8, 16, 32, 64, 128]
+VALID_BYTES = [8, 10, 16, 24, 32, 48, 64, 128, 256, 512]
+ADDRESS_SEPARATOR = ":  "
+ASCII_SEPARATOR = " :"
+# Addresses have at least 8 digits, and more when they don't fit
+ADDRESS_WIDTH = 8
+# Column of the first hex char with 8 digit addresses, and distance from the last group to the first ASCII char
+ADDRESS_OFFSET = ADDRESS_WIDTH + len(ADDRESS_SEPARATOR)
+ASCII_OFFSET = len(ASCII_SEPARATOR) + 1
+HOLE_MARKER = "%s-%s:  -- sparse hole: %d zero bytes --"
+REPEAT_MARKER = "* %s-%s:  -- previous line repeated %d times --"
+
+# Printable ASCII is shown as is, everything else is shown as "."
+ASCII_TABLE = bytes([c if 32 <= c < 127 else 46 for c in range(0, 256)])
+
+
+class HexFormatter(object):
+    """
+    Render blocks of binary data as hex view lines.
+
+    Each block is converted with C level primitives (`bytes.hex` and `bytes.translate`)
+    instead of formatting the data byte by byte.  Output is identical to the hex view format:
+
+        <address>:  <group> <group> ... <group>  :<ascii>
+
+    Addresses are padded to `address_width` digits, which should fit the last address of the file.
+    """
+
+    def __init__(self, bytes_wide, group_size, hex_lower=True, starting_address=0, address_width=ADDRESS_WIDTH):
+        """Initialize."""
+
+        self.bytes_wide = int(bytes_wide)
+        self.group_size = int(group_size)
+        self.hex_lower = hex_lower
+        self.starting_address = starting_address
+        self.address = ("%%0%dx" if hex_lower else "%%0%dX") % int(address_width)
+        self.address_string = self.address + ADDRESS_SEPARATOR
+        # Hex column width: two chars per byte and a space after every group
+        self.hex_width = self.bytes_wide * 2 + self.bytes_wide // self.group_size
+
+    def hexlify(self, data):
+        """Convert data to space separated hex groups."""
+
+        value = memoryview(data).hex(' ', -self.group_size)
+        return value if self.hex_lower else value.upper()
+
+    def format_line(self, data, line):
+        """Format a single, possibly incomplete, line."""
+
+        data = memoryview(data)
+        return "".join(
+            [
+                self.address_string % (line * self.bytes_wide + self.starting_address),
+                self.hexlify(data).ljust(self.hex_width),
+                ASCII_SEPARATOR,
+                data.tobytes().translate(ASCII_TABLE).decode('ascii')
+            ]
+        )
+
+    def format_hole(self, start, end):
+        """Format the marker line of a collapsed hole of zero bytes from `start` up to (not including) `end`."""
+
+        address = self.address
+        return HOLE_MARKER % (
+            address % (start + self.starting_address), address % (end - 1 + self.starting_address), end - start
+        )
+
+    def format_repeat(self, start, end):
+        """Format the marker line of a collapsed run of lines repeating the line before `start`."""
+
+        address = self.address
+        return REPEAT_MARKER % (
+            address % (start + self.starting_address), address % (end - 1 + self.starting_address),
+            (end - start) // self.bytes_wide
+        )
+
+    def split_repeat(self, collapsed, index, line):
+        """
+        Take the first line out of the collapsed run of lines at `index` of `collapsed`, which repeats `line`.
+
+        Returns the text of the lines that replace the run's marker line, and updates `collapsed` for them.
+        """
+
+        row, start, end = collapsed[index]
+        text = self.address_string % (start + self.starting_address) + line[len(self.address_string % 0):]
+        if end - start > self.bytes_wide:
+            text += "\n" + self.format_repeat(start + self.bytes_wide, end)
+            collapsed[index] = [row + 1, start + self.bytes_wide, end]
+            for entry in collapsed[index + 1:]:
+                entry[0] += 1
+        else:
+            del collapsed[index]
+        return text
+
+    def format_lines(self, data, line=0):
+        """
+        Format a block of data starting at the given line.
+
+        The block should be a multiple of `bytes_wide`; only the last block of a file
+        may end with an incomplete line.  Lines are joined with a newline, and no
+        trailing newline is added.  The block can be any object supporting the buffer
+        protocol (`bytes`, `bytearray`, `memoryview`, `mmap`, etc.).
+        """
+
+        data = memoryview(data)
+        bytes_wide = self.bytes_wide
+        hex_width = self.hex_width
+        full = len(data) - (len(data) % bytes_wide)
+
+        # Line boundaries always fall on a group boundary, so each line's hex
+        # (with its trailing space) is a fixed width slice of the whole block.
+        hex_str = self.hexlify(data[:full]) + ' '
+        ascii_str = data[:full].tobytes().translate(ASCII_TABLE).decode('ascii')
+        address = self.address_string
+        start = line * bytes_wide + self.starting_address
+
+        lines = [
+            address % (start + i * bytes_wide) +
+            hex_str[i * hex_width:(i + 1) * hex_width] +
+            ASCII_SEPARATOR +
+            ascii_str[i * bytes_wide:(i + 1) * bytes_wide]
+            for i in range(0, full // bytes_wide)
+        ]
+
+        if full != len(data):
+            lines.append(self.format_line(data[full:], line + full // bytes_wide))
+
+        return "\n".join(lines)
+
+
+class ByteGeometry(object):
+    """
+    Map the columns of hex view lines to bytes and back.
+
+    Every data line has the same layout, so positions are found with arithmetic
+    instead of inspecting the text or its scopes.  Columns are relative to the
+    start of the line, and bytes are relative to the first byte of the line.
+    """
+
+    def __init__(self, bytes_wide, group_size, address_width=ADDRESS_WIDTH):
+        """Initialize."""
+
+        self.bytes_wide = int(bytes_wide)
+        self.group_size = int(group_size)
+        self.address_width = int(address_width)
+        # Column of the first hex char
+        self.address_offset = self.address_width + len(ADDRESS_SEPARATOR)
+        # Two chars per byte and a space after each group
+        self.group_width = self.group_size * 2 + 1
+        # Column of the space after the last group
+        self.hex_end = self.address_offset + self.bytes_wide * 2 + self.bytes_wide // self.group_size - 1
+        self.ascii_start = self.hex_end + ASCII_OFFSET
+
+    def hex_column(self, byte):
+        """Get the column of the upper nibble of a byte."""
+
+        return self.address_offset + byte * 2 + byte // self.group_size
+
+    def ascii_column(self, byte):
+        """Get the column of the ASCII char of a byte."""
+
+        return self.ascii_start + byte
+
+    def hex_byte(self, column):
+        """
+        Get the byte at a column of the hex data, and the nibble (0 upper, 1 lower) the column is on.
+
+        The space after a group gives the first byte of the next group and a nibble of `None`.
+        """
+
+        group, index = divmod(column - self.address_offset, self.group_width)
+        return group * self.group_size + index // 2, (index % 2 if index < self.group_width - 1 else None)
+
+    def is_ascii(self, column):
+        """Check if a column is in the ASCII chars, or past them."""
+
+        return column >= self.ascii_start
+
+    def line_bytes(self, text):
+        """Get the number of bytes shown on a line of text; marker lines of collapsed ranges have none."""
+
+        if len(text) <= self.address_width or text[self.address_width] != ADDRESS_SEPARATOR[0]:
+            return 0
+        return self.size_bytes(len(text.rstrip("\n")))
+
+    def size_bytes(self, size):
+        """Get the number of bytes shown on a data line of the given length."""
+
+        return max(0, min(self.bytes_wide, size - self.ascii_start))
+
+    def select_hex(self, start, end, line_bytes):
+        """
+        Get the first byte and the number of bytes covered by a selection of hex columns.
+
+        A selection starting on a lower nibble starts at its byte, and one starting on
+        the space before a group starts at the group.  An empty selection covers the
+        byte it is on.  Returns `(None, 0)` if no byte is covered.
+        """
+
+        if start < self.address_offset or start >= self.hex_end:
+            return None, 0
+        first, nibble = self.hex_byte(start)
+        if first >= line_bytes or (nibble is None and start == end):
+            return None, 0
+        if start == end:
+            return first, 1
+        # The last byte is the one the end of the selection is in, or the one before the space it is on
+        last, nibble = self.hex_byte(end - 1)
+        if nibble is None:
+            last -= 1
+        last = min(last, line_bytes - 1)
+        return (first, last - first + 1) if last >= first else (None, 0)
+
+    def select_ascii(self, start, end, line_bytes):
+        """Get the first byte and the number of bytes covered by a selection of ASCII columns."""
+
+        first = start - self.ascii_start
+        if first < 0 or first >= line_bytes or end - self.ascii_start > line_bytes:
+            return None, 0
+        return first, max(1, end - start)
+
+    def select_lines(self, start, end, line_bytes):
+        """
+        Get the first byte and the number of bytes of a line covered by a selection spanning several lines.
+
+        `start` is the column the selection starts at on its first line, and `end` the column
+        it ends at on its last line.  Either is `None` when the selection covers the line from
+        its beginning or to its end.  An end in the hex chars follows the nibble rules of
+        `select_hex`, and an end in the ASCII chars those of `select_ascii`, so the selection
+        starts and ends on the byte it is dragged from and to.  Ends on the address or the
+        separator columns take the whole line, or none of it, on their side.
+        """
+
+        if start is None or start < self.address_offset or self.hex_end <= start < self.ascii_start:
+            first = 0
+        elif start < self.hex_end:
+            first = self.hex_byte(start)[0]
+        else:
+            first = start - self.ascii_start
+
+        if end is None or self.hex_end < end <= self.ascii_start:
+            last = line_bytes - 1
+        elif end <= self.address_offset:
+            last = -1
+        elif end <= self.hex_end:
+            last, nibble = self.hex_byte(end - 1)
+            if nibble is None:
+                last -= 1
+        else:
+            last = end - self.ascii_start - 1
+        last = min(last, line_bytes - 1)
+        return (first, last - first + 1) if last >= first else (None, 0)
+
+    def hex_span(self, first, count):
+        """Get the column span of the hex chars of a run of bytes, including the spaces between its groups."""
+
+        return self.hex_column(first), self.hex_column(first + count - 1) + 2
+
+
+def get_layout(bits, bytes_per_line, valid_bytes=VALID_BYTES):
+    """
+    Get the line width and group size for the given bit grouping and bytes per line.
+
+    Invalid values fall back to the defaults, and the line width is rounded down
+    to a whole number of groups.  Returns `(bytes_wide, group_size)`.
+    """
+
+    group_size = (bits if bits in VALID_BITS else DEFAULT_BIT_GROUP) // BITS_PER_BYTE
+    bytes_wide = bytes_per_line if bytes_per_line in valid_bytes else DEFAULT_BYTES_WIDE
+
+    # Check if grouping and bytes per line do not align
+    # Round to nearest bytes
+    offset = bytes_wide % group_size
+    if offset == bytes_wide:
+        bytes_wide = group_size
+    elif offset != 0:
+        bytes_wide -= offset
+    return bytes_wide, group_size
+
+
+def get_address_width(end):
+    """Get the number of digits of the addresses of data ending before the given address."""
+
+    return max(ADDRESS_WIDTH, len("%x" % max(0, end - 1)))
+
+
+def get_collapsed_row_offset(collapsed, bytes_wide, row):
+    """Get the offset of the first byte of a row from the collapsed ranges of a view, without the view."""
+
+    offset = row * bytes_wide
+    for line, start, end in collapsed:
+        if line >= row:
+            break
+        # The marker line of a collapsed range stands in for all of the range's lines
+        offset += end - start - bytes_wide
+    return offset
+
+
+def get_collapsed_offset_row(collapsed, bytes_wide, offset):
+    """Get the row of the byte at the offset from the collapsed ranges of a view, without the view."""
+
+    shift = 0
+    for line, start, end in collapsed:
+        if offset < start:
+            break
+        if offset < end:
+            # Bytes in a collapsed range are on the range's marker row
+            return line
+        shift += (end - start) // bytes_wide - 1
+    return int(offset / bytes_wide) - shift
+
+
+def get_block_size(bytes_wide, maxblocksize=BLOCK_SIZE):
+    """Get the largest block size that is a multiple of the line width."""
+
+    bytes_wide = int(bytes_wide)
+    blocksize = maxblocksize - (maxblocksize % bytes_wide)
+    return blocksize if blocksize else bytes_wide
+
+
+def fingerprint(data):
+    """Get the fingerprint of a block of data."""
+
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def format_range(
+    file_name, offset, length, bytes_wide, group_size, hex_lower=True, starting_address=0, address_width=ADDRESS_WIDTH
+):
+    """
+    Format a range of a file.
+
+    The range is read and formatted independently of the rest of the file so that
+    ranges can be converted in separate processes.  `starting_address` is the
+    address of the first byte of the file.  Returns the text and the fingerprint
+    of every block of the range.
+    """
+
+    with open(file_name, "rb") as f:
+        f.seek(offset)
+        data = f.read(length)
+    blocksize = get_block_size(bytes_wide)
+    with memoryview(data) as view:
+        fingerprints = [fingerprint(view[i:i + blocksize]) for i in range(0, len(view), blocksize)]
+    formatter = HexFormatter(bytes_wide, group_size, hex_lower, starting_address + offset, address_width)
+    return formatter.format_lines(data), fingerprints
@@ -8,22 +8,67 @@ Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
 import sublime
 import sublime_plugin
 from . import hex_common as common
-from time import time, sleep
-import threading
-from queue import Queue
+from time import time
+from bisect import bisect_right
 import re
 
-HIGHLIGHT_SCOPE = "string"
-HIGHLIGHT_ICON = "dot"
-HIGHLIGHT_STYLE = "solid"
-MS_HIGHLIGHT_DELAY = 500
-MAX_HIGHIGHT = 1000
-THROTTLING = False
+# Seconds to wait for the selection to settle, and its bounds when adapted to the cost of highlighting
+HIGHLIGHT_DELAY = 0.12
+MIN_HIGHLIGHT_DELAY = 0.03
+MAX_HIGHLIGHT_DELAY = 0.5
+# The delay is this many times the average cost of recent highlights
+DELAY_FACTOR = 3.0
+# Weight of the latest highlight in the average cost
+COST_WEIGHT = 0.3
 
-hh_highlight = None
+RE_NEWLINE = re.compile("\n")
 
-if 'hh_thread' not in globals():
-    hh_thread = None
+hh_debouncer = None
+# Highlights of the selections of each view: view id -> (stamp of the view's text and layout, highlights by selection)
+hh_cache = {}
+# Highlights last shown in each view: view id -> shown highlights
+hh_shown = {}
+
+
+class SelectionHighlight(object):
+    """The highlights of a single selection, kept until the selection or the view changes."""
+
+    def __init__(self):
+        """Initialize."""
+
+        self.regions = []
+        self.total_bytes = 0
+        # Row, start, and number of bytes of each run, for the address
+        self.runs = []
+        # Point of the first highlighted hex byte
+        self.first = -1
+
+
+class ShownHighlights(object):
+    """The highlights shown in a view, with the highlights of the selections they were merged from."""
+
+    def __init__(self, style, records, regions):
+        """Initialize."""
+
+        # Change count of the view, scope, icon, and style
+        self.style = style
+        self.records = records
+        self.regions = regions
+
+
+def get_bounds(record):
+    """Get the region covering all the highlights of a selection."""
+
+    return sublime.Region(
+        min(region.begin() for region in record.regions), max(region.end() for region in record.regions)
+    )
+
+
+def intersects(region, spans):
+    """Check if a region intersects, or touches, one of the sorted spans."""
+
+    index = bisect_right(spans, region.end(), key=lambda span: span.begin())
+    return index > 0 and spans[index - 1].end() >= region.begin()
 
 
 class HexHighlighter(object):
@@ -40,18 +85,24 @@ class HexHighlighter(object):
         self.hex_lower = common.use_hex_lowercase()
 
         # Get Seetings from settings file
-        group_size = self.view.settings().get("hex_viewer_bits", None)
-        self.inspector_enabled = common.hv_settings("inspector", False)
-        self.throttle = common.hv_settings("highlight_throttle", THROTTLING)
-        self.max_highlight = common.hv_settings("highlight_max_bytes", MAX_HIGHIGHT)
-        self.bytes_wide = self.view.settings().get("hex_viewer_actual_bytes", None)
-        self.highlight_scope = common.hv_settings("highlight_scope", HIGHLIGHT_SCOPE)
-        self.highlight_icon = common.hv_settings("highlight_icon", HIGHLIGHT_ICON)
-        self.enable_fake_hex = common.hv_settings("enable_fake_hex_file", True)
-        style = common.hv_settings("highlight_style", HIGHLIGHT_STYLE)
-
-        if (group_size is None or self.bytes_wide is None) and self.enable_fake_hex:
-            m = re.match(r'([\da-z]{8}):[\s]{2}((?:[\da-z]+[\s]{1})*)\s*\:[\w\W]*', self.view.substr(self.view.line(0)))
+        settings = common.get_settings()
+        state = common.get_view_state(self.view)
+        group_size = state.bits
+        self.geometry = state.geometry
+        self.address_offset = state.starting_address
+        self.inspector_enabled = settings.inspector
+        self.throttle = settings.highlight_throttle
+        self.max_highlight = settings.highlight_max_bytes
+        self.bytes_wide = state.bytes_wide
+        self.highlight_scope = settings.highlight_scope
+        self.highlight_icon = settings.highlight_icon
+        self.highlight_style = settings.highlight_style
+        self.enable_fake_hex = settings.enable_fake_hex
+
+        if self.geometry is None and self.enable_fake_hex:
+            m = re.match(
+                r'([\da-z]{8,}):[\s]{2}((?:[\da-z]+[\s]{1})*)\s*\:[\w\W]*', self.view.substr(self.view.line(0))
+            )
             if m is not None:
                 starting_address = int(m.group(1), 16)
                 hex_chars = m.group(2).split(' ')
@@ -61,38 +112,29 @@ class HexHighlighter(object):
                 self.view.settings().set("hex_viewer_actual_bytes", self.bytes_wide)
                 self.view.settings().set("hex_viewer_fake", True)
                 self.view.settings().set("hex_viewer_starting_address", starting_address)
+                self.view.settings().set("hex_viewer_address_width", len(m.group(1)))
+                self.address_offset = starting_address
+                self.geometry = common.ByteGeometry(self.bytes_wide, group_size / common.BITS_PER_BYTE, len(m.group(1)))
                 self.view.set_read_only(True)
                 self.view.set_scratch(True)
-                if common.hv_settings("inspector", False) and common.hv_settings("inspector_auto_show", False):
+                if settings.inspector_auto_show:
                     self.view.window().run_command("hex_show_inspector")
 
-        # No icon?
-        if self.highlight_icon == "none":
-            self.highlight_icon = ""
-
-        # Process highlight style
-        self.highlight_style = 0
-        if style == "outline":
-            self.highlight_style = sublime.DRAW_OUTLINED
-        elif style == "none":
-            self.highlight_style = sublime.HIDDEN
-        elif style == "underline":
-            self.highlight_style = sublime.DRAW_EMPTY_AS_OVERWRITE
-
         # Process hex grouping
-        if group_size is not None and self.bytes_wide is not None:
-            self.group_size = group_size / common.BITS_PER_BYTE
-            self.hex_char_range = common.get_hex_char_range(self.group_size, self.bytes_wide)
+        if self.geometry is not None:
+            self.group_size = self.geometry.group_size
             init_status = True
         return init_status
 
-    def get_address(self, start, num_bytes, line):
+    def get_address(self, start, num_bytes, row):
         """Get the address."""
 
-        address_offset = self.view.settings().get('hex_viewer_starting_address', 0)
-        lines = line
         align_to_address_offset = 2
-        add_start = lines * self.bytes_wide + start - align_to_address_offset + address_offset
+        # Rows after collapsed ranges don't line up with the address
+        add_start = (
+            common.get_collapsed_row_offset(self.collapsed, self.geometry.bytes_wide, row) +
+            start - align_to_address_offset + self.address_offset
+        )
         add_end = add_start + num_bytes - 1
         length = len(self.address)
         if length == 0:
@@ -141,135 +183,279 @@ class HexHighlighter(object):
         total = self.total_bytes if self.total_bytes == "?" else str(self.total_bytes)
         self.view.set_status('hex_total_bytes', "Total Bytes: " + total)
 
-    def hex_selection(self, start, num_bytes, first_pos):
+    def hex_selection(self, start, num_bytes, line, row):
         """Get hex selection."""
 
-        row, column = self.view.rowcol(first_pos)
-        column = common.ascii_to_hex_col(start, self.group_size)
-        hex_pos = self.view.text_point(row, column)
+        record = self.record
+        # One region covers the bytes and the spaces between their groups
+        hex_start, hex_end = self.geometry.hex_span(start, num_bytes)
 
         # Log first byte
-        if self.first_all == -1:
-            self.first_all = hex_pos
-
-        # Traverse row finding the specified bytes
-        highlight_start = -1
-        byte_count = num_bytes
-        while byte_count:
-            # Byte rising edge
-            if self.view.score_selector(hex_pos, 'raw.nibble.upper'):
-                if highlight_start == -1:
-                    highlight_start = hex_pos
-                hex_pos += 2
-                byte_count -= 1
-                # End of selection
-                if byte_count == 0:
-                    self.selected_bytes.append(sublime.Region(highlight_start, hex_pos))
-            else:
-                # Byte group falling edge
-                self.selected_bytes.append(sublime.Region(highlight_start, hex_pos))
-                hex_pos += 1
-                highlight_start = -1
+        if record.first == -1:
+            record.first = line.begin() + hex_start
+
+        record.regions.append(sublime.Region(line.begin() + hex_start, line.begin() + hex_end))
         # Log address
-        if num_bytes and not self.address_done:
-            self.get_address(start + 2, num_bytes, row)
+        if num_bytes:
+            record.runs.append((row, start + 2, num_bytes))
 
-    def ascii_to_hex(self, sel):
+    def ascii_to_hex(self, sel, line, row, line_bytes):
         """Convert ASCII to hex."""
 
-        view = self.view
-        start = sel.begin()
-        end = sel.end()
-        num_bytes = 0
-        ascii_range = view.extract_scope(sel.begin())
-        if view.match_selector(ascii_range.begin(), 'keyword.ascii-start.hex'):
-            ascii_range = sublime.Region(ascii_range.begin() + 1, ascii_range.end())
-        if view.substr(ascii_range.end()) == '\x00':
-            offset = 0
-        else:
-            offset = 1
-
-        # Determine if selection is within ascii range
-        if (
-            start >= ascii_range.begin() and
-            (
-                # Single selection should ignore the end of line selection
-                (end == start and end < ascii_range.end() - offset) or
-                (end != start and end < ascii_range.end())
-            )
-        ):
-            # Single char selection
-            if sel.size() == 0:
-                num_bytes = 1
-                self.selected_bytes.append(sublime.Region(start, end + 1))
-            else:
-                # Multi char selection
-                num_bytes = end - start
-                self.selected_bytes.append(sublime.Region(start, end))
-            self.total_bytes += num_bytes
+        start, num_bytes = self.geometry.select_ascii(
+            sel.begin() - line.begin(), sel.end() - line.begin(), line_bytes
+        )
+        if num_bytes:
+            ascii_start = line.begin() + self.geometry.ascii_column(start)
+            self.record.regions.append(sublime.Region(ascii_start, ascii_start + num_bytes))
+            self.record.total_bytes += num_bytes
             # Highlight hex values
-            self.hex_selection(start - ascii_range.begin(), num_bytes, start)
+            self.hex_selection(start, num_bytes, line, row)
 
-    def hex_to_ascii(self, sel):
+    def hex_to_ascii(self, sel, line, row, line_bytes):
         """Convert hex to ASCII."""
 
-        view = self.view
-        start = sel.begin()
-        end = sel.end()
+        # Determine if selection is within hex range
+        if sel.end() - line.begin() > self.geometry.hex_end:
+            return
+        start, num_bytes = self.geometry.select_hex(sel.begin() - line.begin(), sel.end() - line.begin(), line_bytes)
+
+        # Highlight hex values and their ascii chars
+        if num_bytes != 0:
+            self.record.total_bytes += num_bytes
+            self.hex_selection(start, num_bytes, line, row)
+
+            # Highlight Ascii
+            ascii_start = line.begin() + self.geometry.ascii_column(start)
+            self.record.regions.append(sublime.Region(ascii_start, ascii_start + num_bytes))
+
+    def line_selection(self, line, text, row, start, end):
+        """Highlight the bytes of one line of a selection spanning several lines."""
+
+        start, num_bytes = self.geometry.select_lines(start, end, self.geometry.line_bytes(text))
+        if num_bytes:
+            self.record.total_bytes += num_bytes
+            self.hex_selection(start, num_bytes, line, row)
+            ascii_start = line.begin() + self.geometry.ascii_column(start)
+            self.record.regions.append(sublime.Region(ascii_start, ascii_start + num_bytes))
+
+    def lines_selection(self, sel, first, last):
+        """
+        Highlight a selection spanning several lines.
+
+        The lines between the first and the last are selected whole, so only the hex and ASCII
+        chars of their bytes are highlighted, and their bytes are counted from their rows, as a
+        single run for the address.
+        """
+
+        first_line, first_text, first_row = first
+        last_line, last_text, last_row = last
+
+        self.line_selection(first_line, first_text, first_row, sel.begin() - first_line.begin(), None)
+        if last_row - first_row > 1:
+            geometry = self.geometry
+            record = self.record
+            for row in range(first_row + 1, last_row):
+                line, text = self.get_row(row)
+                line_bytes = geometry.line_bytes(text)
+                if not line_bytes:
+                    # Marker lines of collapsed ranges have no bytes to highlight
+                    continue
+                hex_start, hex_end = geometry.hex_span(0, line_bytes)
+                if record.first == -1:
+                    record.first = line.begin() + hex_start
+                record.regions.append(sublime.Region(line.begin() + hex_start, line.begin() + hex_end))
+                ascii_start = line.begin() + geometry.ascii_start
+                record.regions.append(sublime.Region(ascii_start, ascii_start + line_bytes))
+            num_bytes = (
+                common.get_collapsed_row_offset(self.collapsed, geometry.bytes_wide, last_row) -
+                common.get_collapsed_row_offset(self.collapsed, geometry.bytes_wide, first_row + 1)
+            )
+            record.total_bytes += num_bytes
+            record.runs.append((first_row + 1, 2, num_bytes))
+        self.line_selection(last_line, last_text, last_row, None, sel.end() - last_line.begin())
 
-        # Get range of hex data
-        line = view.line(start)
-        range_start = line.begin() + common.ADDRESS_OFFSET
-        range_end = range_start + self.hex_char_range
-        hex_range = sublime.Region(range_start, range_end)
+    def highlight_selection(self, sel, first, last):
+        """
+        Get the highlights of a selection.
 
-        # Determine if selection is within hex range
-        if start >= hex_range.begin() and end <= hex_range.end():
-            # Adjust beginning of selection to begining of first selected byte
-            start, end, num_bytes = common.adjust_hex_sel(view, start, end, self.group_size)
-
-            # Highlight hex values and their ascii chars
-            if num_bytes != 0:
-                self.total_bytes += num_bytes
-                # Zero based byte number
-                start_byte = common.get_byte_count(hex_range.begin(), start + 2, self.group_size) - 1
-                self.hex_selection(start_byte, num_bytes, start)
-
-                # Highlight Ascii
-                ascii_start = hex_range.end() + common.ASCII_OFFSET + start_byte
-                ascii_end = ascii_start + num_bytes
-                self.selected_bytes.append(sublime.Region(ascii_start, ascii_end))
+        `first` is the region, text, and row of the line the selection starts on, and `last`
+        those of the line it ends on if it spans several lines, or `None`.
+        """
+
+        self.record = SelectionHighlight()
+        if last is not None:
+            self.lines_selection(sel, first, last)
+        else:
+            line, text, row = first
+            line_bytes = self.geometry.line_bytes(text)
+            if self.geometry.is_ascii(sel.begin() - line.begin()):
+                self.ascii_to_hex(sel, line, row, line_bytes)
+            else:
+                self.hex_to_ascii(sel, line, row, line_bytes)
+        return self.record
+
+    def get_row(self, row):
+        """Get the region and text of a row from the text taken in the snapshot."""
+
+        begin, first_row, text = self.span
+        if self.line_starts is None:
+            self.line_starts = [0] + [m.end() for m in RE_NEWLINE.finditer(text)]
+        starts = self.line_starts
+        index = row - first_row
+        start = starts[index]
+        end = starts[index + 1] - 1 if index + 1 < len(starts) else len(text)
+        return sublime.Region(begin + start, begin + end), text[start:end]
+
+    def get_line(self, pt):
+        """Get the region, text, and row of the line at a point from the text taken in the snapshot."""
+
+        begin, first_row, text = self.span
+        if self.line_starts is None:
+            self.line_starts = [0] + [m.end() for m in RE_NEWLINE.finditer(text)]
+        row = first_row + bisect_right(self.line_starts, pt - begin) - 1
+        return self.get_row(row) + (row,)
+
+    def get_lines(self, sel):
+        """Get the region, text, and row of the first line of a selection, and of its last if it spans several."""
+
+        first = self.get_line(sel.begin())
+        if sel.end() <= first[0].end():
+            return first, None
+        return first, self.get_line(sel.end())
 
     def get_highlights(self):
-        """Get the highlights."""
+        """
+        Get the highlights.
+
+        Only selections that were added or changed since the last highlight of the view are
+        computed, from the text taken in the snapshot; the rest are taken from the cache,
+        which keeps the current selections only.
+        """
+
+        cached = self.cached
+        records = {}
 
         self.first_all = -1
-        for sel in self.view.sel():
+        for sel in self.selections:
             # Kick out if total bytes exceeds limit
             if self.throttle and self.total_bytes >= self.max_highlight:
                 if len(self.address) == 2:
                     self.address[1] = -1
                 self.total_bytes = "?"
+                break
+
+            key = (sel.begin(), sel.end())
+            record = cached.get(key)
+            if record is None:
+                record = self.highlight_selection(sel, *self.get_lines(sel))
+            records[key] = record
+
+            self.total_bytes += record.total_bytes
+            if self.first_all == -1:
+                self.first_all = record.first
+            for row, start, num_bytes in record.runs:
+                if self.address_done:
+                    break
+                self.get_address(start, num_bytes, row)
+
+        hh_cache[self.view_id] = (self.stamp, records)
+        self.records = records
+
+    def merge_highlights(self):
+        """
+        Merge the highlights of the selections with the highlights shown in the view.
+
+        Only the highlights of the selections that were added or removed since they were last
+        shown are merged again: the merged regions touched by the removed selections are dropped,
+        and the highlights of the added selections and of the selections under the dropped regions
+        are merged with the rest.  If nothing changed, the shown regions are kept as they are.
+        """
+
+        style = (self.change_count, self.highlight_scope, self.highlight_icon, self.highlight_style)
+        records = self.records
+        shown = hh_shown.get(self.view_id)
+        self.changed = True
+        if shown is None or shown.style != style:
+            regions = common.merge_regions([region for record in records.values() for region in record.regions])
+        else:
+            added = [record for key, record in records.items() if shown.records.get(key) is not record]
+            removed = [record for key, record in shown.records.items() if records.get(key) is not record]
+            if not added and not removed:
+                self.changed = False
+                self.shown = shown
+                self.selected_bytes = shown.regions
                 return
 
-            if self.view.score_selector(sel.begin(), 'comment'):
-                self.ascii_to_hex(sel)
-            else:
-                self.hex_to_ascii(sel)
-
-    def run(self, window):
-        """Run command."""
+            regions = shown.regions
+            fresh = [region for record in added for region in record.regions]
+            spans = common.merge_regions([get_bounds(record) for record in removed if record.regions])
+            if spans:
+                # Merged regions may also hold highlights of other selections, so merge those again
+                dropped = [region for region in regions if intersects(region, spans)]
+                regions = [region for region in regions if not intersects(region, spans)]
+                dropped = common.merge_regions(dropped)
+                added = set(id(record) for record in added)
+                for record in records.values():
+                    if record.regions and id(record) not in added and intersects(get_bounds(record), dropped):
+                        fresh.extend(record.regions)
+            # The kept regions are already sorted, so sorting them with the fresh ones is cheap
+            regions = common.merge_regions(regions + fresh)
+
+        self.shown = ShownHighlights(style, records, regions)
+        self.selected_bytes = regions
+
+    def snapshot(self, window, version):
+        """
+        Take a snapshot of the selections of the active view, on the main thread.
+
+        Returns `False` if the view is not one that can be highlighted.
+        """
 
         if window is None:
-            return
+            return False
         self.window = window
-        view = self.window.active_view()
-        self.view = view
+        self.view = window.active_view()
+        if self.view is None or not self.init():
+            return False
+        self.version = version
+        self.view_id = self.view.id()
+        self.change_count = self.view.change_count()
+        self.selections = list(self.view.sel())
+        self.collapsed = self.view.settings().get("hex_viewer_collapsed", [])
+        self.stamp = (self.change_count, self.geometry.bytes_wide, self.geometry.group_size)
+        cached_stamp, self.cached = hh_cache.get(self.view_id, (None, {}))
+        if cached_stamp != self.stamp:
+            self.cached = {}
+        # Take the text of the lines covering the selections that have to be highlighted in a single read, so the view
+        # isn't read off the main thread; the lines of the selections are found in it when computing
+        self.span = None
+        self.line_starts = None
+        uncached = [sel for sel in self.selections if (sel.begin(), sel.end()) not in self.cached]
+        if uncached:
+            span = self.view.line(
+                sublime.Region(min(sel.begin() for sel in uncached), max(sel.end() for sel in uncached))
+            )
+            self.span = (span.begin(), self.view.rowcol(span.begin())[0], self.view.substr(span))
+        return True
 
-        if not self.init():
-            return
+    def compute(self):
+        """Compute the highlights of the snapshot, off the main thread, without reading the view."""
 
         self.get_highlights()
+        self.merge_highlights()
+
+    def is_current(self):
+        """Check if the view is still active and unchanged since the snapshot."""
+
+        view = self.window.active_view()
+        return (
+            view is not None and view.id() == self.view.id() and
+            self.view.change_count() == self.change_count
+        )
+
+    def apply(self):
+        """Show the highlights, on the main thread."""
 
         # Show inspector panel
         if self.inspector_enabled:
@@ -279,16 +465,17 @@ class HexHighlighter(object):
                 {'first_byte': self.first_all, 'reset': reset, 'bytes_wide': self.bytes_wide}
             )
 
-        # Highlight selected regions
-        if self.highlight_style == sublime.DRAW_EMPTY_AS_OVERWRITE:
-            self.selected_bytes = common.underline(self.selected_bytes)
-        view.add_regions(
-            "hex_view",
-            self.selected_bytes,
-            self.highlight_scope,
-            self.highlight_icon,
-            self.highlight_style
-        )
+        # Highlight selected regions, unless they are already shown
+        view_id = self.view.id()
+        if self.changed or hh_shown.get(view_id) is not self.shown:
+            self.view.add_regions(
+                "hex_view",
+                self.selected_bytes,
+                self.highlight_scope,
+                self.highlight_icon,
+                self.highlight_style
+            )
+            hh_shown[view_id] = self.shown
         # Display selected byte addresses and total bytes selected
         self.display_address()
         self.display_total_bytes()
@@ -300,10 +487,9 @@ class HexHighlighterCommand(sublime_plugin.WindowCommand):
     def run(self):
         """Run the command."""
 
-        if hh_thread.ignore_all:
+        if hh_debouncer.ignore_all:
             return
-        start_task()
-        hh_thread.modified = True
+        hh_debouncer.schedule()
 
     def is_enabled(self):
         """Check if command is enabled."""
@@ -317,90 +503,136 @@ class HexHighlighterListenerCommand(sublime_plugin.EventListener):
     def on_selection_modified(self, view):
         """Determine if a highlight should be triggered."""
 
-        if hh_thread is None or not common.is_enabled(view) or hh_thread.ignore_all:
+        if hh_debouncer is None or not common.is_enabled(view) or hh_debouncer.ignore_all:
             return
-        now = time()
-        if now - hh_thread.time > hh_thread.wait_time:
-            sublime.set_timeout(hh_thread.payload, 0)
-        else:
-            start_task()
-            hh_thread.modified = True
-            hh_thread.time = now
+        hh_debouncer.schedule()
 
+    def on_close(self, view):
+        """Forget the highlights of the view."""
 
-class HhThread(threading.Thread):
-    """Load up defaults."""
+        hh_cache.pop(view.id(), None)
+        hh_shown.pop(view.id(), None)
 
-    def __init__(self):
-        """Setup the thread."""
 
-        self.reset()
-        self.queue = Queue()
-        threading.Thread.__init__(self)
+class HighlightDebouncer(object):
+    """
+    Run the highlighter once selection changes settle.
 
-    def reset(self):
-        """Reset the thread variables."""
+    A change after a quiet period is highlighted right away; changes in quick succession
+    push the highlight back until none has happened for the delay.  The delay follows the
+    average cost of recent highlights, so cheap highlights keep up with the cursor while
+    expensive ones aren't run on every change.
 
-        self.wait_time = 0.12
-        self.queue = Queue()
-        self.time = time()
-        self.modified = False
+    Highlights are computed on the async thread from a snapshot of the selections.  Every
+    change bumps the version, and a result is only shown if its snapshot is of the latest
+    version, so highlights of a selection that already changed are dropped.
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        self.delay = HIGHLIGHT_DELAY
+        self.cost = None
+        # Time of the last change or highlight
+        self.time = 0.0
+        self.deadline = None
+        # Timers of a cancelled schedule are ignored when they fire
+        self.generation = 0
+        self.version = 0
         self.ignore_all = False
-        self.abort = False
+
+    def schedule(self):
+        """Schedule a highlight for a selection change."""
+
+        self.version += 1
+        now = time()
+        if self.deadline is None:
+            if now - self.time > self.delay:
+                self.deadline = now
+                self.arm(0)
+            else:
+                self.deadline = now + self.delay
+                self.arm(self.delay)
+        else:
+            # The timer already waiting checks the deadline when it fires
+            self.deadline = max(self.deadline, now + self.delay)
+        self.time = now
+
+    def arm(self, delay):
+        """Start a timer for the given delay in seconds."""
+
+        generation = self.generation
+        sublime.set_timeout(lambda: self.fire(generation), int(delay * 1000))
+
+    def fire(self, generation):
+        """Highlight if the deadline was reached, or wait for the rest of it."""
+
+        if generation != self.generation or self.deadline is None:
+            return
+        remaining = self.deadline - time()
+        if remaining > 0.001:
+            self.arm(remaining)
+            return
+        self.deadline = None
+        self.payload()
 
     def payload(self):
-        """Code to run."""
+        """Snapshot the selections and compute their highlights on the async thread."""
 
-        self.modified = False
+        highlighter = HexHighlighter()
         # Ignore selection and edit events inside the routine
         self.ignore_all = True
-        hh_highlight(sublime.active_window())
-        self.ignore_all = False
+        try:
+            ready = highlighter.snapshot(sublime.active_window(), self.version)
+        finally:
+            self.ignore_all = False
         self.time = time()
+        if ready:
+            start = self.time
+            sublime.set_timeout_async(lambda: self.compute(highlighter, start), 0)
 
-    def kill(self):
-        """Kill thread."""
+    def compute(self, highlighter, start):
+        """Compute the highlights, skipping the work if the selection already changed."""
 
-        self.abort = True
-        self.queue.put(True)
-        while self.is_alive():
-            pass
-        self.reset()
+        if highlighter.version == self.version:
+            highlighter.compute()
+            sublime.set_timeout(lambda: self.apply(highlighter, start), 0)
 
-    def run(self):
-        """Thread loop."""
-
-        task = False
-        while not self.abort:
-            task = self.queue.get()
-            while task and not self.abort:
-                if self.modified is True and time() - self.time > self.wait_time:
-                    sublime.set_timeout(self.payload, 0)
-                    task = False
-                sleep(0.5)
+    def apply(self, highlighter, start):
+        """Show the highlights if they are still current, and adapt the delay to what they cost."""
 
+        if highlighter.version != self.version or not highlighter.is_current():
+            return
+        self.ignore_all = True
+        try:
+            highlighter.apply()
+        finally:
+            self.ignore_all = False
+            self.time = time()
+        cost = self.time - start
+        self.cost = cost if self.cost is None else self.cost + (cost - self.cost) * COST_WEIGHT
+        self.delay = max(MIN_HIGHLIGHT_DELAY, min(MAX_HIGHLIGHT_DELAY, self.cost * DELAY_FACTOR))
 
-def start_task():
-    """Start task."""
+    def cancel(self):
+        """Cancel the scheduled highlight, and drop any being computed."""
 
-    if hh_thread.is_alive():
-        hh_thread.queue.put(True)
+        self.generation += 1
+        self.version += 1
+        self.deadline = None
 
 
 def plugin_loaded():
     """Setup plugin."""
 
-    global hh_highlight
-    global hh_thread
-    hh_highlight = HexHighlighter().run
+    global hh_debouncer
 
-    if 'hh_thread' in globals() and hh_thread is not None:
-        hh_thread.kill()
-    hh_thread = HhThread()
-    hh_thread.start()
+    if hh_debouncer is not None:
+        hh_debouncer.cancel()
+    hh_debouncer = HighlightDebouncer()
 
 
 def plugin_unloaded():
     """Tear down plugin."""
 
-    hh_thread.kill()
+    if hh_debouncer is not None:
+        hh_debouncer.cancel()
@@ -21,7 +21,7 @@ class HexShowInspectorCommand(sublime_plugin.WindowCommand):
     def is_enabled(self):
         """Check if command is enabled."""
 
-        return bool(common.is_enabled() and common.hv_settings("inspector", False))
+        return bool(common.is_enabled() and common.get_settings().inspector)
 
     def run(self):
         """Run the command."""
@@ -44,7 +44,7 @@ class HexHideInspectorCommand(sublime_plugin.WindowCommand):
     def is_enabled(self):
         """Check if command is enabled."""
 
-        return bool(common.is_enabled() and common.hv_settings("inspector", False))
+        return bool(common.is_enabled() and common.get_settings().inspector)
 
     def run(self):
         """Run the command."""
@@ -58,7 +58,7 @@ class HexToggleInspectorEndiannessCommand(sublime_plugin.WindowCommand):
     def is_enabled(self):
         """Check if command is enabled."""
 
-        return bool(common.is_enabled() and common.hv_settings("inspector", False))
+        return bool(common.is_enabled() and common.get_settings().inspector)
 
     def run(self):
         """Run the command."""
@@ -108,47 +108,38 @@ class HexInspectorListenerCommand(sublime_plugin.EventListener):
 class HexInspectorCommand(sublime_plugin.WindowCommand):
     """Hex inspector command."""
 
-    def get_bytes(self, start, bytes_wide):
+    def get_bytes(self, start):
         """Get the bytes at the cursor."""
 
-        byte_str = self.view.substr(sublime.Region(start, start + 2))
-        byte64 = None
-        byte32 = None
-        byte16 = None
-        byte8 = None
-        start += 2
+        geometry = common.get_geometry(self.view)
+        line = self.view.line(start)
+        text = self.view.substr(line)
+        column = geometry.hex_column(geometry.hex_byte(start - line.begin())[0])
+        byte_str = ""
+        target_chars = 16
         size = self.view.size()
-        count = 1
-        group_divide = 1
-        address = 12
-        ascii_divide = group_divide + bytes_wide + address + 1
-        target_bytes = 8
 
         # Look for 64 bit worth of bytes
-        while start < size and count < target_bytes:
-            # Check if sitting on first nibble
-            if self.view.score_selector(start, 'raw.nibble.upper'):
-                byte_str += self.view.substr(sublime.Region(start, start + 2))
-                count += 1
-                start += 2
-            else:
-                # Must be at byte group falling edge; try and step over divider
-                start += group_divide
-                if start < size and self.view.score_selector(start, 'raw.nibble.upper'):
-                    byte_str += self.view.substr(sublime.Region(start, start + 2))
-                    count += 1
-                    start += 2
-                # Must be at line end; try and step to next line
-                else:
-                    start += ascii_divide
-                    if start < size and self.view.score_selector(start, 'raw.nibble.upper'):
-                        byte_str += self.view.substr(sublime.Region(start, start + 2))
-                        count += 1
-                        start += 2
-                    else:
-                        # No more bytes to check
-                        break
-
+        while True:
+            byte_str += text[column:geometry.hex_end].replace(" ", "")
+            if len(byte_str) >= target_chars or line.end() >= size:
+                break
+            next_line = self.view.line(line.end() + 1)
+            next_text = self.view.substr(next_line)
+            column = geometry.address_offset
+            if next_text.startswith("*"):
+                # Next line is a collapsed run repeating this one
+                continue
+            if not geometry.line_bytes(next_text):
+                # No more bytes to check
+                break
+            line, text = next_line, next_text
+
+        byte_str = byte_str[:target_chars]
+        count = len(byte_str) // 2
+        byte16 = None
+        byte32 = None
+        byte64 = None
         byte8 = byte_str[0:2]
         if count > 1:
             byte16 = byte_str[0:4]
@@ -161,12 +152,13 @@ class HexInspectorCommand(sublime_plugin.WindowCommand):
     def display(self, view, byte8, bytes16, bytes32, bytes64):
         """Display hex inspector data."""
 
-        item_dec = common.hv_settings("inspector_integer_format", "%-12s:  %-14d")
-        item_str = common.hv_settings("inspector_missing/bad_format", "%-12s:  %-14s")
-        item_float = common.hv_settings("inspector_float_format", "%-12s:  %-14e")
-        item_double = common.hv_settings("inspector_double_format", "%-12s:  %-14e")
-        item_bin = common.hv_settings("inspector_binary_format", "%-12s:  %-14s")
-        item_timestamp, item_time = common.hv_settings("inspector_timestamp_format", ("%-12s:  %-14s", "%c"))
+        settings = common.get_settings()
+        item_dec = settings.inspector_integer_format
+        item_str = settings.inspector_missing_format
+        item_float = settings.inspector_float_format
+        item_double = settings.inspector_double_format
+        item_bin = settings.inspector_binary_format
+        item_timestamp, item_time = settings.inspector_timestamp_format
         nl = "\n"
         endian = ">" if self.endian == "big" else "<"
         i_buffer = "%28s:%-28s" % ("Hex Inspector ", (" Big Endian" if self.endian == "big" else " Little Endian")) + nl
@@ -265,7 +257,7 @@ class HexInspectorCommand(sublime_plugin.WindowCommand):
         self.endian = hv_endianness
         byte8, bytes16, bytes32, bytes64 = None, None, None, None
         if not reset and first_byte is not None and bytes_wide is not None:
-            byte8, bytes16, bytes32, bytes64 = self.get_bytes(int(first_byte), int(bytes_wide))
+            byte8, bytes16, bytes32, bytes64 = self.get_bytes(int(first_byte))
         self.display(self.window.get_output_panel('hex_viewer_inspector'), byte8, bytes16, bytes32, bytes64)
 
 
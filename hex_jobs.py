@@ -0,0 +1,295 @@
+"""
+Hex Viewer.
+
+Licensed under MIT
+Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+import sublime
+import bisect
+import itertools
+import threading
+import traceback
+from . import hex_common as common
+
+INTERACTIVE = 0
+BACKGROUND = 10
+MAX_JOBS = 3
+IDLE_TIMEOUT = 5.0
+STATUS_INTERVAL = 250
+
+PENDING = 0
+RUNNING = 1
+FINISHED = 2
+
+scheduler = None
+
+
+def progress_bar(ratio):
+    """Get a text progress bar for a ratio from 0 to 1."""
+
+    ratio = max(0.0, min(1.0, ratio))
+    percent = int(ratio * 10)
+    return "[" + "-" * percent + ">" + "-" * (10 - percent) + ("] %3d%%" % int(ratio * 100))
+
+
+class CancelToken(object):
+    """Token that is set when a job is cancelled, for the job to check between units of work."""
+
+    def __init__(self):
+        """Initialize."""
+
+        self.event = threading.Event()
+
+    def cancel(self):
+        """Cancel the job."""
+
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        """Check if the job was cancelled."""
+
+        return self.event.is_set()
+
+
+class Job(object):
+    """
+    Work run by the job scheduler.
+
+    Subclasses implement `run` and regularly check `abort`, which reflects the
+    cancellation token of the job, to stop early.  Jobs mimic the parts of
+    `threading.Thread` the commands use (`start`, `is_alive`, and `join`), and
+    completion callbacks are called on the UI thread with the job.
+    """
+
+    priority = INTERACTIVE
+
+    def __init__(self, priority=None):
+        """Initialize."""
+
+        if priority is not None:
+            self.priority = priority
+        self.token = CancelToken()
+        self.job_state = None
+        self.finished = threading.Event()
+        self.callbacks = []
+        # Quiet jobs don't show their progress in the status bar
+        self.quiet = False
+
+    @property
+    def abort(self):
+        """Check if the job was cancelled."""
+
+        return self.token.cancelled
+
+    @abort.setter
+    def abort(self, value):
+        """Cancel the job if set, a cancelled job can't be resumed."""
+
+        if value:
+            self.token.cancel()
+
+    def cancel(self):
+        """Cancel the job."""
+
+        self.token.cancel()
+
+    def get_progress(self):
+        """Get the progress of the job from 0 to 1."""
+
+        return 0.0
+
+    def describe(self):
+        """Get the description of what the job is doing to show with its progress."""
+
+        return ""
+
+    def start(self, callback=None):
+        """Schedule the job and call the callback when it finishes."""
+
+        return get_scheduler().submit(self, callback)
+
+    def add_done_callback(self, callback):
+        """Add a callback for when the job finishes, it is called right away if the job already finished."""
+
+        get_scheduler().add_done_callback(self, callback)
+
+    def set_priority(self, priority):
+        """Change the priority of the job, moving it up or down the queue if it hasn't started."""
+
+        get_scheduler().set_priority(self, priority)
+
+    def is_alive(self):
+        """Check if the job is scheduled or running."""
+
+        return self.job_state in (PENDING, RUNNING)
+
+    def join(self, timeout=None):
+        """Wait for the job to finish."""
+
+        return self.finished.wait(timeout)
+
+    def run(self):
+        """Do the work."""
+
+
+class JobScheduler(object):
+    """
+    Run jobs on a bounded pool of worker threads.
+
+    Pending jobs run in order of priority.  Background jobs are kept from taking
+    every worker so interactive jobs don't have to wait for them.  Workers are
+    started as needed and exit when idle.  While jobs are active, the status bar
+    shows the progress of each of them.
+    """
+
+    def __init__(self, max_workers=MAX_JOBS):
+        """Initialize."""
+
+        # Background work is kept from the last worker, so there has to be one more for it to run at all
+        self.max_workers = max(2, int(max_workers))
+        self.background_workers = self.max_workers - 1
+        self.condition = threading.Condition()
+        self.counter = itertools.count()
+        self.pending = []
+        self.jobs = []
+        self.workers = 0
+        self.idle = 0
+        self.background = 0
+        self.ticking = False
+
+    def submit(self, job, callback=None):
+        """Schedule a job."""
+
+        with self.condition:
+            job.job_state = PENDING
+            if callback is not None:
+                job.callbacks.append(callback)
+            self.jobs.append(job)
+            bisect.insort(self.pending, (job.priority, next(self.counter), job))
+            self.wake()
+            if not self.ticking:
+                self.ticking = True
+                sublime.set_timeout(self.show_status, 0)
+        return job
+
+    def wake(self):
+        """Get an idle worker, or a new one if there is room, to look for a job to run; the lock must be held."""
+
+        if self.idle:
+            self.condition.notify()
+        elif self.workers < self.max_workers:
+            self.workers += 1
+            threading.Thread(target=self.work, daemon=True).start()
+
+    def set_priority(self, job, priority):
+        """Change the priority of a job, moving it in the queue if it is still pending."""
+
+        with self.condition:
+            job.priority = priority
+            for index, entry in enumerate(self.pending):
+                if entry[2] is job:
+                    del self.pending[index]
+                    bisect.insort(self.pending, (priority, next(self.counter), job))
+                    # A background job waiting for a worker may be able to run now
+                    self.wake()
+                    break
+
+    def add_done_callback(self, job, callback):
+        """Add a callback for when the job finishes."""
+
+        with self.condition:
+            if job.job_state != FINISHED:
+                job.callbacks.append(callback)
+                return
+        sublime.set_timeout(lambda: callback(job), 0)
+
+    def active(self, kind=None):
+        """Get the active jobs of the given kind, or all of them, leaving out quiet background work."""
+
+        with self.condition:
+            return [job for job in self.jobs if not job.quiet and (kind is None or isinstance(job, kind))]
+
+    def cancel(self, kind=None):
+        """Cancel the active jobs of the given kind, or all of them."""
+
+        jobs = self.active(kind)
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def next_job(self):
+        """Take the pending job with the highest priority that can run now."""
+
+        for index, entry in enumerate(self.pending):
+            job = entry[2]
+            if job.priority < BACKGROUND or job.abort or self.background < self.background_workers:
+                del self.pending[index]
+                return job
+        return None
+
+    def work(self):
+        """Run jobs until there are none left for a while."""
+
+        while True:
+            with self.condition:
+                job = self.next_job()
+                while job is None:
+                    self.idle += 1
+                    notified = self.condition.wait(IDLE_TIMEOUT)
+                    self.idle -= 1
+                    job = self.next_job()
+                    if job is None and not notified:
+                        self.workers -= 1
+                        return
+                background = job.priority >= BACKGROUND
+                if background:
+                    self.background += 1
+                job.job_state = RUNNING
+
+            try:
+                if not job.abort:
+                    job.run()
+            except Exception:
+                print(str(traceback.format_exc()))
+            finally:
+                self.finish(job, background)
+
+    def finish(self, job, background):
+        """Mark the job as finished and call its callbacks on the UI thread."""
+
+        with self.condition:
+            if background:
+                self.background -= 1
+                # A background job may have been waiting for this worker
+                self.condition.notify()
+            job.job_state = FINISHED
+            self.jobs.remove(job)
+            callbacks = job.callbacks
+            job.callbacks = []
+        job.finished.set()
+        for callback in callbacks:
+            sublime.set_timeout(lambda callback=callback: callback(job), 0)
+
+    def show_status(self):
+        """Show the progress of the active jobs while there are any."""
+
+        with self.condition:
+            jobs = [job for job in self.jobs if not job.quiet]
+            self.ticking = bool(self.jobs)
+        if jobs:
+            sublime.status_message(
+                " | ".join([progress_bar(job.get_progress()) + " " + job.describe() for job in jobs])
+            )
+        if self.ticking:
+            sublime.set_timeout(self.show_status, STATUS_INTERVAL)
+
+
+def get_scheduler():
+    """Get the shared job scheduler."""
+
+    global scheduler
+
+    if scheduler is None:
+        scheduler = JobScheduler(common.hv_settings("max_jobs", MAX_JOBS))
+    return scheduler
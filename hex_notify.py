@@ -5,6 +5,7 @@ Licensed under MIT
 Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
 """
 import sublime
+from . import hex_common as common
 try:
     from SubNotify.sub_notify import SubNotifyIsReadyCommand as Notify
 except Exception:
@@ -21,8 +22,7 @@ except Exception:
 def notify(msg):
     """Notify message."""
 
-    settings = sublime.load_settings("hex_viewer.sublime-settings")
-    if settings.get("use_sub_notify", False) and Notify.is_ready():
+    if common.get_settings().use_sub_notify and Notify.is_ready():
         sublime.run_command("sub_notify", {"title": "HexViewer", "msg": msg})
     else:
         sublime.status_message(msg)
@@ -31,8 +31,7 @@ def notify(msg):
 def error(msg):
     """Error message."""
 
-    settings = sublime.load_settings("hex_viewer.sublime-settings")
-    if settings.get("use_sub_notify", False) and Notify.is_ready():
+    if common.get_settings().use_sub_notify and Notify.is_ready():
         sublime.run_command("sub_notify", {"title": "HexViewer", "msg": msg, "level": "error"})
     else:
         sublime.error_message("HexViewer:\n%s" % msg)
@@ -6,125 +6,484 @@ Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
 """
 import sublime
 import sublime_plugin
-import struct
-import threading
-from os.path import basename, exists
-from os.path import getsize as get_file_size
+from os.path import basename, exists, join
+import os
 from os import remove
 from . import hex_common as common
-from fnmatch import fnmatch
+from .hex_format import (
+    HexFormatter, get_block_size, get_layout, fingerprint,
+    DEFAULT_BIT_GROUP, DEFAULT_BYTES_WIDE, VALID_BITS, VALID_BYTES
+)
+from .hex_convert import HexConverter, RenderState, get_compression, get_members
+from .hex_cache import RenderCache
+from .hex_jobs import Job, INTERACTIVE, BACKGROUND, get_scheduler
+from fnmatch import translate
+import re
 import tempfile
 import subprocess
+import traceback
+from queue import Queue, Empty
+from time import time
 from .hex_notify import notify, error
 
-DEFAULT_BIT_GROUP = 16
-DEFAULT_BYTES_WIDE = 24
 DEFAULT_MAX_FILE_SIZE = 50000.0
-VALID_BITS = [8, 16, 32, 64, 128]
-VALID_BYTES = [8, 10, 16, 24, 32, 48, 64, 128, 256, 512]
+DEFAULT_WINDOW_LINES = 0
+CONVERSION_PROCESSES = 0
+RENDER_CACHE_SIZE = 256
+STREAM_BUDGET = 0.03
+STREAM_BATCH_SIZE = 65536
 AUTO_OPEN = False
+AUTO_OPEN_SNIFF = False
+SNIFF_SIZE = 4096
+SNIFF_RATIO = 0.3
+SNIFF_CACHE_SIZE = 1024
+PROGRESSIVE_DISPLAY = True
+COLLAPSE_SPARSE_HOLES = False
+COLLAPSE_REPEATED_LINES = False
+DECOMPRESS_FILES = False
+SPECULATIVE_CONVERSION = True
+
+# Bytes that are common in text: printable ASCII, tabs, line endings, etc., and anything that can be part of UTF-8
+TEXT_BYTES = bytes([7, 8, 9, 10, 12, 13, 27] + list(range(32, 127)) + list(range(128, 256)))
+
+speculative_thread = None
+render_states = {}
+sniff_cache = {}
+auto_open_matcher = (None, None)
+
+
+class WindowFiles(object):
+    """
+    Index of the names of the files open in each window.
+
+    Preview views are not open in their window, so this is used to tell them apart
+    without listing every view of the window on each activation.  The views of a
+    window are only listed the first time it is checked; after that, files are added
+    as views are opened in it, and removed when their views close or move.
+    """
+
+    def __init__(self):
+        """Initialize."""
+
+        self.windows = {}
+
+    def contains(self, window, file_name):
+        """Check if the file is open in the window."""
+
+        files = self.windows.get(window.id())
+        if files is None:
+            files = set([view.file_name() for view in window.views()])
+            self.windows[window.id()] = files
+        return file_name in files
+
+    def add(self, view):
+        """Add the file of a view that was opened in its window, unless it is only a preview."""
 
-active_thread = None
+        window = view.window()
+        file_name = view.file_name()
+        if window is None or file_name is None:
+            return
+        files = self.windows.get(window.id())
+        sheet = view.sheet()
+        if files is not None and sheet is not None and not sheet.is_transient():
+            files.add(file_name)
+
+    def discard(self, view):
+        """Remove the file of a view that is closing or moving from every window."""
+
+        file_name = view.file_name()
+        for files in self.windows.values():
+            files.discard(file_name)
+
+    def forget(self, window):
+        """Forget the index of a window."""
+
+        if window is not None:
+            self.windows.pop(window.id(), None)
+
+
+window_files = WindowFiles()
+
+
+def get_auto_open_matcher(patterns):
+    """Get a single compiled matcher for all of the auto open patterns, compiling it only when the patterns change."""
+
+    global auto_open_matcher
+
+    key = tuple(patterns)
+    if auto_open_matcher[0] != key:
+        if patterns:
+            # Match the same way as `fnmatch`, which normalizes the case of the patterns and names
+            match = re.compile("|".join([translate(os.path.normcase(pattern)) for pattern in patterns])).match
+        else:
+            def match(name):
+                return None
+        auto_open_matcher = (key, match)
+    return auto_open_matcher[1]
 
 
-class ReadBin(threading.Thread):
+def is_binary_content(file_name):
+    """
+    Check if the start of a file looks like binary data.
+
+    The file is binary if the first block has NUL bytes or too many bytes that aren't
+    common in text.  The verdict is cached until the file is modified.
+    """
+
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return False
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    cached = sniff_cache.get(file_name)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    try:
+        with open(file_name, "rb") as f:
+            data = f.read(SNIFF_SIZE)
+    except OSError:
+        return False
+    binary = b"\0" in data or len(data.translate(None, TEXT_BYTES)) > len(data) * SNIFF_RATIO
+
+    if len(sniff_cache) >= SNIFF_CACHE_SIZE:
+        sniff_cache.clear()
+    sniff_cache[file_name] = (stamp, binary)
+    return binary
+
+
+def get_view_name(file_name, member=None):
+    """Get the name of the hex view of a file, or of a member of a zip archive."""
+
+    return basename(member if member else file_name) + ".hxv"
+
+
+def show_hex_view(view):
+    """Place the cursor on the first byte and show the inspector if desired."""
+
+    view.sel().clear()
+    # Offset past address to first byte
+    address_offset = common.get_geometry(view).address_offset
+    view.sel().add(sublime.Region(address_offset, address_offset))
+    if common.get_settings().inspector_auto_show:
+        window = view.window()
+        if window is not None:
+            window.run_command("hex_show_inspector")
+
+
+def get_render_cache():
+    """Get the render cache if enabled."""
+
+    size = float(common.hv_settings("render_cache_size_mb", RENDER_CACHE_SIZE))
+    if size <= 0:
+        return None
+    return RenderCache(join(sublime.cache_path(), "HexViewer", "render"), int(size * 1048576))
+
+
+class ReadBin(HexConverter, Job):
     """Read a file in binary mode."""
 
-    def __init__(self, file_name, bytes_wide, group_size, starting_address=0):
+    speculative = False
+
+    def __init__(
+        self, file_name, bytes_wide, group_size, starting_address=0, offset=0, length=None, fingerprints=None,
+        compression=None, member=None
+    ):
         """Initialize."""
 
-        self.starting_address = starting_address
-        self.bytes_wide = int(bytes_wide)
-        self.group_size = int(group_size)
-        self.file_name = file_name
-        self.file_size = get_file_size(file_name)
-        self.read_count = 0
-        self.abort = False
-        self.hex_lower = common.use_hex_lowercase()
-        threading.Thread.__init__(self)
-
-    def iterfile(self, maxblocksize=4096):
-        """Iterate through the file chunking the data in 4096 blocks."""
-
-        with open(self.file_name, "rb") as bin_file:
-            # Ensure read block is a multiple of groupsize
-            bytes_wide = self.bytes_wide
-            blocksize = maxblocksize - (maxblocksize % bytes_wide)
-
-            start = 0
-            byte_array = bin_file.read(blocksize)
-            while byte_array:
-                outbytes = byte_array[start:start + bytes_wide]
-                while outbytes:
-                    yield outbytes
-                    start += bytes_wide
-                    outbytes = byte_array[start:start + bytes_wide]
-                start = 0
-                byte_array = bin_file.read(blocksize)
+        Job.__init__(self)
+        max_file_size = float(common.hv_settings("max_file_size_kb", DEFAULT_MAX_FILE_SIZE))
+        HexConverter.__init__(
+            self, file_name, bytes_wide, group_size, starting_address, offset, length, fingerprints,
+            common.use_hex_lowercase(), common.hv_settings("conversion_processes", CONVERSION_PROCESSES),
+            common.hv_settings("collapse_sparse_holes", COLLAPSE_SPARSE_HOLES),
+            common.hv_settings("collapse_repeated_lines", COLLAPSE_REPEATED_LINES),
+            compression, member,
+            # The decompressed size is generally only known once decompressed, so the limit is checked while reading
+            int(max_file_size * 1000) if compression is not None else None
+        )
+        self.error = None
+        # Called on the UI thread when there is converted text in the queue to stream
+        self.on_output = None
+        self.output_pending = False
+        # Keep the bytes of the whole file so layout changes don't have to read it again
+        self.keep_bytes = (
+            length is None and not self.collapsing and compression is None and self.total_size * 0.001 <= max_file_size
+        )
+        if self.keep_bytes and not self.speculative:
+            self.keep_data()
+        self.cached = False
+        self.cache = get_render_cache()
+        self.cache_key = None
+        # Collapsed ranges are not cached as the view needs to know where they are
+        if self.cache is not None and not self.collapsing:
+            self.cache_key = self.cache.key(
+                file_name, self.bytes_wide, self.group_size, self.hex_lower,
+                starting_address, self.offset, self.file_size, self.get_source()
+            )
+
+    def get_source(self):
+        """Get what is converted if the file isn't read as is: the kind of compression and the zip member."""
+
+        if self.compression is None:
+            return None
+        return self.compression if self.member is None else "%s:%s" % (self.compression, self.member)
+
+    def get_progress(self):
+        """Get the progress of the conversion."""
+
+        return float(self.read_count) / float(self.file_size) if self.file_size else 1.0
+
+    def describe(self):
+        """Describe the conversion."""
+
+        return "%s converted to hex" % get_view_name(self.file_name, self.member)[:-4]
+
+    def emit(self, f, text):
+        """Write converted text, letting the hex view know if there is text to stream."""
+
+        HexConverter.emit(self, f, text)
+        if self.on_output is not None and not self.output_pending:
+            self.output_pending = True
+            sublime.set_timeout(self.on_output, 0)
+
+    def load_cached(self):
+        """Use a cached conversion instead of converting the file, if available."""
+
+        if self.cache_key is None:
+            return False
+
+        try:
+            self.hex_name = self.cache.temp_file()
+        except OSError:
+            return False
+        remove(self.hex_name)
+        if self.cache.get(self.cache_key, self.hex_name):
+            self.read_count = self.file_size
+            self.cached = True
+            return True
+        return False
 
     def run(self):
         """Run the command."""
 
-        byte_string = "%02x" if self.hex_lower else "%02X"
-        address_string = "%08x" if self.hex_lower else "%08X"
-        translate_table = str.maketrans(
-            "".join([chr(c) for c in range(0, 256)]),
-            "".join(["."] * 32 + [chr(c) for c in range(32, 127)] + ["."] * 129)
-        )
-        def_struct = struct.Struct("=" + ("B" * self.bytes_wide))
-        def_template = ((byte_string * self.group_size) + " ") * int(self.bytes_wide / self.group_size)
+        try:
+            self.convert_file()
+        except Exception as e:
+            # Corrupt or encrypted compressed data can't be converted
+            print(str(traceback.format_exc()))
+            self.error = str(e)
+            self.abort = True
+
+    def convert_file(self):
+        """Convert the file, or only fingerprint it if it doesn't need to be converted."""
+
+        if self.old_fingerprints is not None or self.cached:
+            if self.cached:
+                self.fingerprint()
+            else:
+                self.diff()
+            self.state.complete = not self.abort
+            return
 
-        line = 0
-        read_count = 0
         with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix=".hxv") as f:
             self.hex_name = f.name
-            for byte_array in self.iterfile():
-                if self.abort:
-                    return
-                l_buffer = []
+            self.write(f)
+        # Collapsed conversions have no block fingerprints to reload incrementally from
+        self.state.complete = not self.abort and not self.collapsing
+
+        if self.cache_key is not None and not self.abort:
+            # Don't cache the conversion if the file changed while converting
+            key = self.cache.key(
+                self.file_name, self.bytes_wide, self.group_size, self.hex_lower,
+                self.starting_address, self.offset, self.file_size, self.get_source()
+            )
+            if key == self.cache_key:
+                self.cache.put(self.cache_key, self.hex_name)
 
-                read_count += self.bytes_wide
-                self.read_count = read_count if read_count < self.file_size else self.file_size
 
-                # Add line number
-                l_buffer.append((address_string + ":  ") % ((line * self.bytes_wide) + self.starting_address))
+class SpeculativeReadBin(ReadBin):
+    """
+    Convert a previewed file in the background, at low priority, to have it ready if the preview is opened.
+
+    The conversion is stored in the render cache.  If the preview is opened while
+    converting, the hex view command adopts the conversion instead of starting over.
+    The bytes of the file are only read again for the render state once adopted.
+    """
+
+    speculative = True
+
+    def __init__(self, file_name, bytes_wide, group_size, compression=None):
+        """Initialize."""
+
+        ReadBin.__init__(self, file_name, bytes_wide, group_size, compression=compression)
+        self.priority = BACKGROUND
+        self.quiet = True
+        # Convert serially so the work can be interrupted between blocks
+        self.processes = 0
+        self.done = False
+
+    def adopt(self):
+        """Take over the conversion for a hex view, unless it already finished."""
+
+        with self.lock:
+            if self.done:
+                return False
+            self.speculative = False
+            self.quiet = False
+        # A hex view now waits for the conversion, so it must not wait behind background work
+        self.set_priority(INTERACTIVE)
+        return True
+
+    def run(self):
+        """Run the command."""
+
+        ReadBin.run(self)
+        with self.lock:
+            self.done = True
+            # Only the render cache entry is kept, unless a hex view adopted the conversion
+            hex_name = getattr(self, "hex_name", None)
+            if self.speculative and hex_name is not None and exists(hex_name):
+                remove(hex_name)
+            adopted = not self.speculative
+        if adopted and self.keep_bytes and self.state.complete:
+            self.load_data()
+
+    def load_data(self):
+        """Read the bytes of the file that weren't kept while converting speculatively, if it hasn't changed."""
+
+        try:
+            with open(self.file_name, "rb") as f:
+                data = bytearray(f.read())
+            stat = os.stat(self.file_name)
+        except OSError:
+            return
+        if self.state.stamp == (stat.st_size, stat.st_mtime_ns) and len(data) == self.file_size:
+            self.state.data = data
 
-                try:
-                    # Complete line
-                    # Convert to decimal value
-                    values = def_struct.unpack(byte_array)
-
-                    # Add hex value
-                    l_buffer.append(def_template % values)
-                except struct.error:
-                    # Incomplete line
-                    # Convert to decimal value
-                    values = struct.unpack("=" + ("B" * len(byte_array)), byte_array)
-
-                    # Add hex value
-                    remain_group = int(len(byte_array) / self.group_size)
-                    remain_extra = len(byte_array) % self.group_size
-                    l_buffer.append(
-                        (
-                            ((byte_string * self.group_size) + " ") *
-                            (remain_group) + (byte_string * remain_extra)
-                        ) % values
-                    )
 
-                    # Append printable chars to incomplete line
-                    delta = self.bytes_wide - len(byte_array)
-                    group_space = int(delta / self.group_size)
-                    extra_space = (1 if delta % self.group_size else 0)
+class Relayout(Job):
+    """Format the bytes kept in memory of a hex view with a new layout."""
 
-                    l_buffer.append(" " * (group_space + extra_space + delta * 2))
+    def __init__(self, state, bytes_wide, group_size, hex_lower, starting_address):
+        """Initialize."""
+
+        Job.__init__(self)
+        self.old_state = state
+        self.bytes_wide = int(bytes_wide)
+        self.group_size = int(group_size)
+        self.state = RenderState(
+            state.file_name, self.bytes_wide, self.group_size, hex_lower, starting_address,
+            address_width=state.address_width
+        )
+        self.state.stamp = state.stamp
+        self.state.data = state.data
+        self.text = None
+
+    def get_progress(self):
+        """Get the progress of the formatting."""
+
+        return 1.0 if self.text is not None else 0.0
+
+    def describe(self):
+        """Describe the formatting."""
+
+        return "%s reformatted" % basename(self.state.file_name)
+
+    def run(self):
+        """Run the command."""
+
+        state = self.state
+        blocksize = get_block_size(self.bytes_wide)
+        with memoryview(state.data) as data:
+            text = HexFormatter(
+                self.bytes_wide, self.group_size, state.hex_lower, state.starting_address, state.address_width
+            ).format_lines(data)
+            state.fingerprints = [fingerprint(data[i:i + blocksize]) for i in range(0, len(data), blocksize)]
+        state.complete = True
+        self.text = text
+
+
+def start_speculative(file_name):
+    """Start converting a previewed file in the background if it will be worth it."""
+
+    global speculative_thread
+
+    if speculative_thread is not None and speculative_thread.file_name == file_name:
+        return
+    cancel_speculative()
+    if not common.hv_settings("speculative_conversion", SPECULATIVE_CONVERSION):
+        return
+
+    compression = None
+    if common.hv_settings("decompress_files", DECOMPRESS_FILES):
+        compression = get_compression(file_name)
+        if compression == "zip":
+            # The member to show has to be chosen first
+            return
+
+    bytes_wide, group_size = get_layout(
+        int(common.hv_settings('group_bytes_by_bits', DEFAULT_BIT_GROUP)),
+        int(common.hv_settings('bytes_per_line', DEFAULT_BYTES_WIDE)),
+        common.hv_settings("valid_bytes_per_line", VALID_BYTES)
+    )
+    try:
+        thread = SpeculativeReadBin(file_name, bytes_wide, group_size, compression)
+    except Exception:
+        return
+
+    # Only files that are shown whole, and can be cached, are worth converting ahead of time
+    if (
+        thread.cache_key is None or exists(thread.cache.path(thread.cache_key)) or
+        thread.data_size * 0.001 > float(common.hv_settings("max_file_size_kb", DEFAULT_MAX_FILE_SIZE))
+    ):
+        return
+    speculative_thread = thread
+    thread.start()
+
+
+def cancel_speculative(file_name=None):
+    """Cancel the background conversion of a preview, unless it is of the given file."""
+
+    global speculative_thread
 
-                # Append printable chars
-                l_buffer.append(" :" + "".join([chr(translate_table[b]) for b in byte_array]))
+    if speculative_thread is not None and speculative_thread.file_name != file_name:
+        speculative_thread.cancel()
+        speculative_thread = None
 
-                # Add line to buffer
-                f.write(("\n" if line > 0 else "") + "".join(l_buffer))
 
-                line += 1
+def adopt_speculative(cache_key):
+    """Take over the background conversion with the given cache key if it is still running."""
+
+    global speculative_thread
+
+    thread = speculative_thread
+    if thread is None or cache_key is None or thread.cache_key != cache_key:
+        return None
+    speculative_thread = None
+    return thread if thread.adopt() else None
+
+
+class HexViewerGlobal(object):
+    """Global hex viewer data."""
+
+    replacements = None
+
+    @classmethod
+    def clear(cls):
+        """Clear."""
+
+        cls.replacements = None
+
+
+class HexViewerApplyCommand(sublime_plugin.TextCommand):
+    """Apply replacements to the hex view."""
+
+    def run(self, edit):
+        """Run command."""
+
+        for region, text in HexViewerGlobal.replacements:
+            self.view.replace(edit, region, text)
 
 
 class HexViewerListenerCommand(sublime_plugin.EventListener):
@@ -134,16 +493,17 @@ class HexViewerListenerCommand(sublime_plugin.EventListener):
 
     def is_bin_file(self, file_path, encoding):
         """Determine if view is a bin file."""
-        match = False
+
         if not common.hv_settings("disable_auto_open_hex_encoding", False) and encoding == "Hexadecimal":
-            match = True
-        else:
-            patterns = common.hv_settings("auto_open_patterns", [])
-            for pattern in patterns:
-                match |= fnmatch(file_path, pattern)
-                if match:
-                    break
-        return match
+            return True
+        if get_auto_open_matcher(common.hv_settings("auto_open_patterns", []))(os.path.normcase(file_path)):
+            return True
+        return bool(common.hv_settings("auto_open_sniff", AUTO_OPEN_SNIFF)) and is_binary_content(file_path)
+
+    def is_preview(self, view, window):
+        """Check if the view is a preview of a file that is not open in the window."""
+
+        return bool(window) and not window_files.contains(window, view.file_name())
 
     def open_bin_file(self, view=None, window=None):
         """Logic to open bin file as a hex view."""
@@ -159,64 +519,100 @@ class HexViewerListenerCommand(sublime_plugin.EventListener):
                 view = window.active_view()
         # Open bin file in hex viewer
         if window and view and (open_now or view.file_name() == self.open_me):
-            is_preview = window and view.file_name() not in [file.file_name() for file in window.views()]
-            if is_preview:
+            if self.is_preview(view, window):
                 return
             view.settings().set("hex_no_auto_open", True)
             window.run_command('hex_viewer')
 
-    def auto_load(self, view, window, is_preview):
+    def auto_load(self, view, window, previews=True):
         """Auto load the hex view."""
 
         file_name = view.file_name()
-        if file_name is not None and not exists(file_name):
-            file_name = None
-        encoding = view.encoding()
         # Make sure we have a file name and that we haven't already processed the view
-        if file_name is not None and not view.settings().get("hex_no_auto_open", False):
-            # Make sure the file is specified in our binary file list
-            if self.is_bin_file(file_name, encoding):
-                # Handle previw or direct open
-                if is_preview:
+        if file_name is None or view.settings().get("hex_no_auto_open", False) or not exists(file_name):
+            return
+
+        # Make sure the file is specified in our binary file list
+        if self.is_bin_file(file_name, view.encoding()):
+            # Only check for previews once we know the file is wanted
+            is_preview = self.is_preview(view, window)
+            # Handle previw or direct open
+            if is_preview:
+                if previews:
                     self.open_me = file_name
+                    start_speculative(file_name)
                     sublime.set_timeout(self.open_bin_file, 100)
-                else:
-                    self.open_me = file_name
-                    self.open_bin_file(view, window)
+            else:
+                self.open_me = file_name
+                self.open_bin_file(view, window)
 
     def on_activated(self, view):
         """Logic for preview windows."""
 
+        # A preview that was opened for good is in its window from now on
+        window_files.add(view)
         if common.hv_settings("auto_open", AUTO_OPEN) and not view.settings().get('is_widget'):
-            window = view.window()
-            is_preview = window and view.file_name() not in [file.file_name() for file in window.views()]
+            # The preview being converted in the background was abandoned
+            cancel_speculative(view.file_name())
             if view.settings().get("hex_view_postpone_hexview", True) and not view.is_loading():
-                self.auto_load(view, window, is_preview)
+                self.auto_load(view, view.window())
 
     def on_load(self, view):
         """Determine if anything needs to be done with the loaded file."""
 
+        window_files.add(view)
         # Logic for direct open files
         if common.hv_settings("auto_open", AUTO_OPEN) and not view.settings().get('is_widget'):
             window = view.window()
-            is_preview = window and view.file_name() not in [file.file_name() for file in window.views()]
-            if window and not is_preview and view.settings().get("hex_view_postpone_hexview", True):
-                self.auto_load(view, window, is_preview)
+            if window and view.settings().get("hex_view_postpone_hexview", True):
+                self.auto_load(view, window, previews=False)
 
         temp_file = view.settings().get("hex_viewer_temp_file", None)
         if temp_file is not None:
             if exists(temp_file):
                 remove(temp_file)
 
-            view.set_name(basename(view.settings().get("hex_viewer_file_name")) + ".hxv")
+            view.set_name(
+                get_view_name(view.settings().get("hex_viewer_file_name"), view.settings().get("hex_viewer_member"))
+            )
+            show_hex_view(view)
+
+    def on_new(self, view):
+        """Add the file of a new view to the files of its window."""
+
+        window_files.add(view)
+
+    def on_clone(self, view):
+        """Add the file of a cloned view to the files of its window."""
+
+        window_files.add(view)
+
+    def on_close(self, view):
+        """Forget the render state of closed views."""
+
+        render_states.pop(view.id(), None)
+        window_files.discard(view)
+        common.forget_view(view)
+
+    def on_pre_move(self, view):
+        """Forget the file of a view that is moving to another window."""
+
+        window_files.discard(view)
+
+    def on_post_move(self, view):
+        """Add the file of a view that moved to the files of its new window."""
 
-            view.sel().clear()
-            # Offset past address to first byte
-            view.sel().add(sublime.Region(common.ADDRESS_OFFSET, common.ADDRESS_OFFSET))
-            if common.hv_settings("inspector", False) and common.hv_settings("inspector_auto_show", False):
-                window = view.window()
-                if window is not None:
-                    view.window().run_command("hex_show_inspector")
+        window_files.add(view)
+
+    def on_pre_close_window(self, window):
+        """Forget the files of a closing window."""
+
+        window_files.forget(window)
+
+    def on_post_save_as(self, view):
+        """Add the file the view now has to the files of its window."""
+
+        window_files.add(view)
 
     def on_pre_save(self, view):
         """
@@ -238,6 +634,15 @@ class HexViewerListenerCommand(sublime_plugin.EventListener):
             view.settings().erase("hex_viewer_actual_bytes")
             view.settings().erase("hex_viewer_file_name")
             view.settings().erase("hex_viewer_starting_address")
+            view.settings().erase("hex_viewer_address_width")
+            view.settings().erase("hex_viewer_window_lines")
+            view.settings().erase("hex_viewer_window_start")
+            view.settings().erase("hex_viewer_file_size")
+            view.settings().erase("hex_viewer_collapsed")
+            view.settings().erase("hex_viewer_range")
+            view.settings().erase("hex_viewer_compression")
+            view.settings().erase("hex_viewer_member")
+            view.settings().erase("hex_viewer_raw")
 
 
 class HexViewerCommand(sublime_plugin.WindowCommand):
@@ -246,28 +651,17 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
     handshake = -1
     file_name = ""
     thread = None
+    stream_view = None
+    byte_range = None
+    member = None
+    raw = False
 
     def set_format(self):
         """Set the hex view format."""
 
-        self.group_size = DEFAULT_BIT_GROUP / common.BITS_PER_BYTE
-        self.bytes_wide = DEFAULT_BYTES_WIDE
-
-        # Set grouping
-        if self.bits in VALID_BITS:
-            self.group_size = self.bits / common.BITS_PER_BYTE
-
-        # Set bytes per line
-        if self.bytes in common.hv_settings("valid_bytes_per_line", VALID_BYTES):
-            self.bytes_wide = self.bytes
-
-        # Check if grouping and bytes per line do not align
-        # Round to nearest bytes
-        offset = self.bytes_wide % self.group_size
-        if offset == self.bytes_wide:
-            self.bytes_wide = self.bits / common.BITS_PER_BYTE
-        elif offset != 0:
-            self.bytes_wide -= offset
+        self.bytes_wide, self.group_size = get_layout(
+            self.bits, self.bytes, common.hv_settings("valid_bytes_per_line", VALID_BYTES)
+        )
 
     def buffer_init(self, bits, byte_array):
         """Initialize info for the hex buffer."""
@@ -279,6 +673,7 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
         else:
             self.id = self.window.active_sheet().id()
         file_name = None
+        self.window_offset = 0
         if self.sheet is not None:
             self.font = common.hv_settings('custom_font', 'none')
             self.font_size = common.hv_settings('custom_font_size', 0)
@@ -313,62 +708,164 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
             self.bits = bits if bits is not None else int(current_bits)
             self.bytes = byte_array if byte_array is not None else int(current_bytes)
             self.set_format()
+
+            # Keep showing the same byte range of the file, or member of the zip archive
+            if self.byte_range is None:
+                self.byte_range = self.view.settings().get("hex_viewer_range")
+            if self.member is None:
+                self.member = self.view.settings().get("hex_viewer_member")
+            if not self.raw:
+                self.raw = self.view.settings().get("hex_viewer_raw", False)
+
+            # Keep the window around the cursor when reloading a windowed view
+            if common.is_windowed(self.view) and len(self.view.sel()):
+                row = self.view.rowcol(self.view.sel()[0].begin())[0]
+                self.window_offset = (
+                    self.view.settings().get("hex_viewer_window_start", 0) +
+                    row * int(self.view.settings().get("hex_viewer_actual_bytes"))
+                )
         return file_name
 
+    def get_range(self):
+        """Get the offset and length of the byte range to convert, or the whole file if no range was given."""
+
+        if self.byte_range is None:
+            return 0, None
+        start, end = self.byte_range
+        start = max(0, int(start))
+        return start, max(0, int(end) - start)
+
+    def get_source(self, file_name):
+        """Get the compression of the file, if it is to be decompressed, and the zip member to read."""
+
+        compression = None
+        if self.byte_range is None and not self.raw and common.hv_settings("decompress_files", DECOMPRESS_FILES):
+            compression = get_compression(file_name)
+        return compression, (self.member if compression == "zip" else None)
+
+    def select_member(self, file_name):
+        """Select the member of the zip archive to read."""
+
+        try:
+            members = get_members(file_name)
+        except Exception:
+            print(str(traceback.format_exc()))
+            error("%s is not a valid zip archive!" % basename(file_name))
+            return
+        if not members:
+            error("%s has no files!" % basename(file_name))
+            return
+
+        def read_member(value):
+            """Read the selected member."""
+
+            if value == -1:
+                return
+            sheet = self.window.active_sheet()
+            if sheet is None or self.handshake != sheet.id():
+                error("Target view is no longer in focus!  Hex view aborted.")
+                return
+            self.member = members[value].filename
+            self.read_bin(file_name)
+
+        if len(members) == 1:
+            read_member(0)
+        else:
+            self.window.show_quick_panel(
+                [[info.filename, "%d bytes" % info.file_size] for info in members], read_member
+            )
+
     def is_file_too_big(self):
         """Check if file is too big and display prompt if desired."""
 
-        file_size = float(self.thread.file_size) * 0.001
+        # Collapsed holes of sparse files are not read, so only count the data
+        file_size = float(self.thread.data_size) * 0.001
         max_file_size = float(common.hv_settings("max_file_size_kb", DEFAULT_MAX_FILE_SIZE))
         too_big = file_size > max_file_size
         if too_big and common.hv_settings("prompt_on_file_too_big", False):
             if sublime.ok_cancel_dialog(
                 'File you\'re trying to open is larger than allowed (in settings). Open anyway?\n\n'
                 'Skipping opening will fall back to the default action '
-                '(open in external viewer if available or terminate operation).',
+                '(open a window of the file, open in external viewer if available, or terminate operation).',
                 'Open'
             ):
                 too_big = False
+                self.thread.max_data_size = None
         return too_big
 
     def read_bin(self, file_name):
         """Read the binary file."""
 
-        global active_thread
-        self.abort = False
-        self.thread = ReadBin(file_name, self.bytes_wide, self.group_size, self.starting_address)
+        self.stream_view = None
+        compression, member = self.get_source(file_name)
+        if compression == "zip" and member is None:
+            self.select_member(file_name)
+            return
+        offset, length = self.get_range()
+        self.thread = ReadBin(
+            file_name, self.bytes_wide, self.group_size, self.starting_address, offset, length,
+            compression=compression, member=member
+        )
+        self.window_lines = 0
         if self.is_file_too_big():
-            viewer = common.hv_settings("external_viewer", {}).get("viewer", "")
-            if exists(viewer):
-                self.window.run_command("hex_external_viewer")
-            else:
+            # Only whole, uncompressed files can be shown a window at a time
+            if length is not None or compression is not None:
                 error(
-                    "File size exceeded HexViewers configured max limit of %s KB" % str(
-                        common.hv_settings("max_file_size_kb", DEFAULT_MAX_FILE_SIZE)
+                    "%s exceeded HexViewers configured max limit of %s KB" % (
+                        "Byte range" if length is not None else "Decompressed file",
+                        str(common.hv_settings("max_file_size_kb", DEFAULT_MAX_FILE_SIZE))
                     )
                 )
-            self.reset_thread()
-        else:
-            self.thread.start()
-            self.handle_thread()
-            active_thread = self.thread
+                self.reset_thread()
+                return
 
-    def load_hex_view(self):
-        """Load up the hex view."""
+            self.window_lines = int(common.hv_settings("window_lines", DEFAULT_WINDOW_LINES))
+            if self.window_lines <= 0:
+                viewer = common.hv_settings("external_viewer", {}).get("viewer", "")
+                if exists(viewer):
+                    self.window.run_command("hex_external_viewer")
+                else:
+                    error(
+                        "File size exceeded HexViewers configured max limit of %s KB" % str(
+                            common.hv_settings("max_file_size_kb", DEFAULT_MAX_FILE_SIZE)
+                        )
+                    )
+                self.reset_thread()
+                return
 
-        file_name = self.thread.file_name
-        hex_name = self.thread.hex_name
-        abort = self.thread.abort
-        self.thread = None
+            # Only convert a window of lines around the current offset
+            start = common.get_window_start(
+                self.window_offset, self.bytes_wide, self.window_lines, self.thread.total_size
+            )
+            self.thread = ReadBin(
+                file_name, self.bytes_wide, self.group_size, self.starting_address,
+                start, self.window_lines * self.bytes_wide
+            )
 
-        if abort:
-            notify("Conversion aborted!")
-            if exists(hex_name):
-                remove(hex_name)
+        # The file may already be converting in the background since it was previewed
+        thread = adopt_speculative(self.thread.cache_key)
+        if thread is not None:
+            self.thread = thread
+            thread.add_done_callback(self.on_converted)
             return
 
-        # Show binary data
-        view = self.window.open_file(hex_name)
+        if self.thread.load_cached():
+            thread = self.thread
+            self.load_hex_view()
+            if self.window_lines == 0:
+                # Fingerprint the file in the background so reloads can be incremental
+                thread.priority = BACKGROUND
+                thread.quiet = True
+                thread.start()
+            return
+
+        if common.hv_settings("progressive_display", PROGRESSIVE_DISPLAY):
+            self.open_stream_view()
+
+        self.thread.start(self.on_converted)
+
+    def close_source(self):
+        """Close the view or sheet that the hex view replaces."""
 
         if self.view:
             self.window.focus_view(self.view)
@@ -378,7 +875,11 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
             self.window.focus_sheet(self.sheet)
             if self.window.active_sheet().id() == self.sheet.id():
                 self.window.run_command("close_file")
-        self.window.focus_view(view)
+
+    def init_hex_view(self, view, hex_name=None):
+        """Apply the hex view settings to the view."""
+
+        window_start = self.thread.offset
 
         # Set font
         if self.font != 'none':
@@ -390,19 +891,300 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
         view.settings().set("hex_viewer_bits", self.bits)
         view.settings().set("hex_viewer_bytes", self.bytes)
         view.settings().set("hex_viewer_actual_bytes", self.bytes_wide)
-        view.settings().set("hex_viewer_file_name", file_name)
+        view.settings().set("hex_viewer_file_name", self.thread.file_name)
         view.settings().set("hex_no_auto_open", True)
         view.settings().set("hex_viewer_fake", False)
-        view.settings().set("hex_viewer_temp_file", hex_name)
-        view.settings().set("hex_viewer_starting_address", self.starting_address)
+        if hex_name is not None:
+            view.settings().set("hex_viewer_temp_file", hex_name)
+        view.settings().set("hex_viewer_starting_address", self.starting_address + window_start)
+        view.settings().set("hex_viewer_address_width", self.thread.address_width)
+        view.settings().set("hex_viewer_collapsed", self.thread.collapsed)
+        if self.byte_range is not None:
+            # Addresses of the rendered range are true file offsets
+            view.settings().set("hex_viewer_range", list(self.byte_range))
+        if self.thread.compression is not None:
+            view.settings().set("hex_viewer_compression", self.thread.compression)
+            if self.thread.member is not None:
+                view.settings().set("hex_viewer_member", self.thread.member)
+        if self.raw:
+            # Keep showing the compressed bytes when reloading or changing the layout
+            view.settings().set("hex_viewer_raw", True)
+        if self.window_lines > 0:
+            # Addresses of the rendered window are relative to the window start
+            view.settings().set("hex_viewer_window_lines", self.window_lines)
+            view.settings().set("hex_viewer_window_start", window_start)
+            view.settings().set("hex_viewer_file_size", self.thread.total_size)
+        else:
+            # Remember the rendered blocks for incremental reloads
+            render_states[view.id()] = self.thread.state
         # Show hex content in view; make read only
         view.set_scratch(True)
         view.set_read_only(True)
 
+    def open_stream_view(self):
+        """Open an empty hex view that converted lines are streamed into as they are produced."""
+
+        view = self.window.new_file()
+        view.set_name(get_view_name(self.thread.file_name, self.thread.member))
+        view.set_syntax_file("Packages/HexViewer/HexViewer.%s" % common.ST_SYNTAX)
+        self.init_hex_view(view)
+        self.close_source()
+        self.window.focus_view(view)
+
+        self.stream_view = view
+        self.stream_batches = 0
+        self.batch_size = STREAM_BATCH_SIZE
+        self.thread.queue = Queue()
+        self.thread.on_output = self.stream
+
+    def close_stream_view(self):
+        """Close a partially streamed hex view and show the original file again."""
+
+        view = self.stream_view
+        self.stream_view = None
+        if view is not None and view.is_valid():
+            file_name = view.settings().get("hex_viewer_file_name")
+            self.window.focus_view(view)
+            self.window.run_command("close_file")
+            source = self.window.open_file(file_name)
+            source.settings().set("hex_no_auto_open", True)
+
+    def stream(self):
+        """Append the converted lines to the streamed hex view, adapting the batch size to stay responsive."""
+
+        view = self.stream_view
+        thread = self.thread
+        if view is None or thread is None:
+            return
+        thread.output_pending = False
+        if not view.is_valid():
+            # The view was closed, so there is nothing left to convert for
+            self.stream_view = None
+            thread.cancel()
+            return
+
+        deadline = time() + STREAM_BUDGET
+        while time() < deadline:
+            chunks = []
+            size = 0
+            while size < self.batch_size:
+                try:
+                    text = thread.queue.get_nowait()
+                except Empty:
+                    break
+                chunks.append(text)
+                size += len(text)
+            if not chunks:
+                break
+
+            start = time()
+            view.set_read_only(False)
+            HexViewerGlobal.replacements = [(sublime.Region(view.size()), "".join(chunks))]
+            view.run_command("hex_viewer_apply")
+            HexViewerGlobal.clear()
+            view.set_read_only(True)
+            elapsed = time() - start
+
+            # Keep a single append well within the time budget
+            if elapsed < STREAM_BUDGET / 4:
+                self.batch_size = min(STREAM_BATCH_SIZE * 64, self.batch_size * 2)
+            elif elapsed > STREAM_BUDGET / 2:
+                self.batch_size = max(STREAM_BATCH_SIZE // 4, self.batch_size // 2)
+
+            if not self.stream_batches:
+                show_hex_view(view)
+            self.stream_batches += 1
+
+        # Keep the rows of the collapsed ranges up to date for navigation
+        collapsed = thread.collapsed
+        if len(collapsed) != len(view.settings().get("hex_viewer_collapsed", [])):
+            view.settings().set("hex_viewer_collapsed", collapsed[:])
+
+        # Give the UI a turn before streaming the rest
+        if not thread.queue.empty() and not thread.output_pending:
+            thread.output_pending = True
+            sublime.set_timeout(self.stream, 0)
+
+    def load_hex_view(self):
+        """Load up the hex view."""
+
+        hex_name = getattr(self.thread, "hex_name", None)
+        abort = self.thread.abort
+        changes = self.thread.changes
+        state = self.thread.state
+
+        if abort:
+            if self.thread.error is not None:
+                error("Failed to convert %s!\n\n%s" % (basename(self.thread.file_name), self.thread.error))
+            else:
+                notify("Conversion aborted!")
+            self.thread = None
+            if hex_name is not None and exists(hex_name):
+                remove(hex_name)
+            self.close_stream_view()
+            return
+
+        if changes is not None:
+            self.thread = None
+            self.apply_changes(changes, state)
+            return
+
+        if self.stream_view is not None:
+            # Everything has already been streamed into the view
+            if self.stream_view.is_valid():
+                self.stream_view.settings().set("hex_viewer_collapsed", self.thread.collapsed)
+            self.thread = None
+            self.stream_view = None
+            if hex_name is not None and exists(hex_name):
+                remove(hex_name)
+            return
+
+        # Show binary data
+        view = self.window.open_file(hex_name)
+        self.close_source()
+        self.window.focus_view(view)
+        self.init_hex_view(view, hex_name)
+        self.thread = None
+
+    def apply_changes(self, changes, state):
+        """Replace the lines of the blocks that changed since the hex view was rendered."""
+
+        view = self.view
+        if view is None or not view.is_valid() or view.id() not in render_states:
+            return
+
+        lines = get_block_size(self.bytes_wide) // int(self.bytes_wide)
+        old_count = len(render_states[view.id()].fingerprints)
+        new_count = len(state.fingerprints)
+        rows = view.rowcol(view.size())[0] + 1
+        blocks = dict(changes)
+
+        # Replacements are ordered from the end of the view so earlier regions remain valid
+        replacements = []
+        if new_count < old_count:
+            # File shrunk: remove the trailing blocks along with the preceding newline
+            start = view.text_point(new_count * lines, 0)
+            replacements.append((sublime.Region(start - 1 if new_count else 0, view.size()), ""))
+        elif new_count > old_count:
+            # File grew: append the new blocks
+            text = "\n".join([blocks[index] for index in range(old_count, new_count)])
+            replacements.append((sublime.Region(view.size()), ("\n" if view.size() else "") + text))
+        for index in sorted([i for i in blocks if i < min(old_count, new_count)], reverse=True):
+            begin = view.text_point(index * lines, 0)
+            end = view.text_point((index + 1) * lines, 0) - 1 if (index + 1) * lines < rows else view.size()
+            replacements.append((sublime.Region(begin, end), blocks[index]))
+
+        # Keep the selections and scroll position
+        selections = [(sel.a, sel.b) for sel in view.sel()]
+        position = view.viewport_position()
+
+        view.set_read_only(False)
+        HexViewerGlobal.replacements = replacements
+        view.run_command("hex_viewer_apply")
+        HexViewerGlobal.clear()
+        view.set_read_only(True)
+
+        size = view.size()
+        view.sel().clear()
+        for a, b in selections:
+            view.sel().add(sublime.Region(min(a, size), min(b, size)))
+        view.set_viewport_position(position, False)
+
+        render_states[view.id()] = state
+        notify("Hex view reloaded: %d blocks changed" % len(changes))
+
+    def reload_bin(self, file_name, state):
+        """Reload the hex view converting only the blocks of the file that changed."""
+
+        self.window_lines = 0
+        offset, length = self.get_range()
+        compression, member = self.get_source(file_name)
+        if compression == "zip" and member is None:
+            self.read_bin(file_name)
+            return
+        self.thread = ReadBin(
+            file_name, self.bytes_wide, self.group_size, self.starting_address, offset, length,
+            state.fingerprints, compression, member
+        )
+        max_file_size = float(common.hv_settings("max_file_size_kb", DEFAULT_MAX_FILE_SIZE))
+        if (
+            not state.matches(self.thread.state) or self.thread.collapsing or
+            self.thread.total_size * 0.001 > max_file_size
+        ):
+            self.read_bin(file_name)
+            return
+
+        self.thread.start(self.on_converted)
+
+    def relayout(self, state):
+        """Re-render the hex view with the new layout from the bytes kept in memory, keeping the cursor in place."""
+
+        self.thread = Relayout(
+            state, self.bytes_wide, self.group_size, common.use_hex_lowercase(), self.starting_address
+        )
+        self.thread.start(self.on_relayout)
+
+    def on_relayout(self, thread):
+        """Replace the text of the hex view with the new layout once it is formatted."""
+
+        if thread is not self.thread:
+            # The formatting was replaced by another conversion
+            return
+        self.thread = None
+        view = self.view
+        if (
+            thread.text is None or view is None or not view.is_valid() or
+            render_states.get(view.id()) is not thread.old_state or common.is_hex_dirty(view)
+        ):
+            # The view was closed, reloaded, or edited in the meantime
+            return
+
+        state = thread.state
+        offset = common.get_byte_offset(view, view.sel()[0].begin()) if len(view.sel()) else 0
+        view.set_read_only(False)
+        HexViewerGlobal.replacements = [(sublime.Region(0, view.size()), thread.text)]
+        view.run_command("hex_viewer_apply")
+        HexViewerGlobal.clear()
+        view.set_read_only(True)
+
+        view.settings().set("hex_viewer_bits", self.bits)
+        view.settings().set("hex_viewer_bytes", self.bytes)
+        view.settings().set("hex_viewer_actual_bytes", self.bytes_wide)
+        view.settings().set("hex_viewer_starting_address", self.starting_address)
+        render_states[view.id()] = state
+
+        # Keep the cursor on the same byte
+        offset = max(0, min(offset, len(state.data) - 1))
+        pt = view.text_point(
+            int(offset / self.bytes_wide),
+            common.ascii_to_hex_col(offset % self.bytes_wide, self.group_size, common.get_geometry(view).address_offset)
+        )
+        view.sel().clear()
+        view.sel().add(sublime.Region(pt))
+        view.show_at_center(pt)
+        self.window.run_command('hex_highlighter')
+
+    def can_relayout(self, file_name):
+        """Check if the hex view can be re-laid out from the bytes kept in memory."""
+
+        state = render_states.get(self.view.id())
+        if (
+            state is None or state.data is None or not state.complete or
+            state.file_name != file_name or common.is_windowed(self.view)
+        ):
+            return False
+
+        # The kept bytes are only valid if the file hasn't changed (or been exported over)
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return False
+        return state.stamp == (stat.st_size, stat.st_mtime_ns)
+
     def read_file(self, file_name):
         """Read the file."""
 
-        if common.hv_settings("inspector", False):
+        if common.get_settings().inspector:
             self.window.run_command("hex_hide_inspector")
         view = self.window.open_file(file_name)
         view.settings().set("hex_no_auto_open", True)
@@ -415,27 +1197,18 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
 
         self.thread = None
 
-    def handle_thread(self):
-        """Handle the thread and update status."""
+    def on_converted(self, thread):
+        """Finish the hex view when the conversion is done."""
 
-        if self.abort is True:
-            self.thread.abort = True
-            notify("Hex View aborted!")
-            sublime.set_timeout(self.reset_thread, 500)
+        if thread is not self.thread:
+            # The conversion was replaced by another one
             return
-        ratio = float(self.thread.read_count) / float(self.thread.file_size)
-        percent = int(ratio * 10)
-        leftover = 10 - percent
-        message = "[" + "-" * percent + ">" + "-" * leftover + ("] %3d%%" % int(ratio * 100)) + " converted to hex"
-        sublime.status_message(message)
-        if not self.thread.is_alive():
-            sublime.set_timeout(self.load_hex_view, 100)
-        else:
-            sublime.set_timeout(self.handle_thread, 100)
-
-    def abort_hex_load(self):
-        """Abort the loading of the hex view."""
-        self.abort = True
+        if self.stream_view is not None and not thread.abort and not thread.queue.empty():
+            # Stream the rest of the lines first
+            self.stream()
+            sublime.set_timeout(lambda: self.on_converted(thread), 0)
+            return
+        self.load_hex_view()
 
     def discard_changes(self, value):
         """Discard changes."""
@@ -488,23 +1261,25 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
                 ) or
                 self.window.active_sheet()
             ) and
-            not (active_thread is not None and active_thread.is_alive())
+            not (self.thread is not None and self.thread.is_alive())
         )
 
-    def run(self, bits=None, byte_array=None, starting_address=0, reload=False):
+    def run(
+        self, bits=None, byte_array=None, starting_address=0, reload=False, byte_range=None, member=None, raw=False
+    ):
         """Run the command."""
 
         self.starting_address = starting_address
-        if active_thread is not None and active_thread.is_alive():
+        self.byte_range = byte_range
+        self.member = member
+        # Show the bytes of compressed files as they are instead of decompressed
+        self.raw = raw
+        if self.thread is not None and self.thread.is_alive():
             error(
                 "HexViewer is already converting a file!\n"
                 "Please run the abort command to stop the current conversion."
             )
             return
-        # If thread is active cancel thread
-        if self.thread is not None and self.thread.is_alive():
-            self.abort_hex_load()
-            return
 
         # Init Buffer
         file_name = self.buffer_init(bits, byte_array)
@@ -523,19 +1298,27 @@ class HexViewerCommand(sublime_plugin.WindowCommand):
                 self.view_type = "hex"
                 if reload:
                     self.file_name = file_name
+                    dirty = common.is_hex_dirty(self.view)
                     common.clear_edits(self.view)
-                    self.read_bin(file_name)
+                    state = render_states.get(self.view.id())
+                    if state is not None and not dirty and not common.is_windowed(self.view):
+                        self.reload_bin(file_name, state)
+                    else:
+                        self.read_bin(file_name)
                 elif common.is_hex_dirty(self.view):
                     self.file_name = file_name
-                    if bits is None and byte_array is None:
+                    if bits is None and byte_array is None and byte_range is None and member is None and not raw:
                         self.switch_type = "file"
                     else:
                         self.switch_type = "hex"
                     self.discard_panel()
                 else:
-                    if bits is None and byte_array is None:
+                    if bits is None and byte_array is None and byte_range is None and member is None and not raw:
                         # Switch back to traditional output
                         self.read_file(file_name)
+                    elif byte_range is None and member is None and not raw and self.can_relayout(file_name):
+                        # Reformat the bytes already in memory with the new settings
+                        self.relayout(render_states[self.view.id()])
                     else:
                         # Reload hex with new settings
                         self.read_bin(file_name)
@@ -599,6 +1382,70 @@ class HexViewerOptionsCommand(sublime_plugin.WindowCommand):
                     self.window.show_quick_panel(option_list, self.set_bytes)
 
 
+class HexViewerRangeCommand(sublime_plugin.WindowCommand):
+    """Open a byte range of the file in a hex view."""
+
+    def get_file_name(self):
+        """Get the name of the file of the current view."""
+
+        view = self.window.active_view()
+        if view is None:
+            return self.window.extract_variables().get('file')
+        return view.settings().get("hex_viewer_file_name", view.file_name())
+
+    def parse_range(self, value):
+        """
+        Parse a `start:end` byte range.
+
+        Offsets can be decimal or prefixed hex (`0x`).  The end is excluded and
+        defaults to the end of the file.
+        """
+
+        start, sep, end = value.strip().partition(":")
+        start = int(start, 0) if start.strip() else 0
+        end = int(end, 0) if end.strip() else os.path.getsize(self.file_name)
+        if not sep or start < 0 or end <= start:
+            raise ValueError(value)
+        return start, end
+
+    def open_range(self, value):
+        """Open the entered byte range."""
+
+        try:
+            start, end = self.parse_range(value)
+        except (ValueError, OSError):
+            error("Invalid byte range! Use 'start:end'.")
+            return
+        self.window.run_command("hex_viewer", {"byte_range": [start, end]})
+
+    def is_enabled(self):
+        """Check if command is enabled."""
+
+        view = self.window.active_view()
+        return (
+            self.get_file_name() is not None and
+            not (view is not None and view.settings().get("hex_viewer_fake", False))
+        )
+
+    def run(self, start=None, end=None):
+        """Run command."""
+
+        self.file_name = self.get_file_name()
+        if start is not None and end is not None:
+            self.window.run_command("hex_viewer", {"byte_range": [start, end]})
+            return
+
+        view = self.window.active_view()
+        current = view.settings().get("hex_viewer_range") if view is not None else None
+        self.window.show_input_panel(
+            "Byte Range (start:end):",
+            "0x%x:0x%x" % tuple(current) if current else "0x0:",
+            self.open_range,
+            None,
+            None
+        )
+
+
 class HexExternalViewerCommand(sublime_plugin.WindowCommand):
     """Open hex data in external hex program."""
 
@@ -628,16 +1475,32 @@ class HexExternalViewerCommand(sublime_plugin.WindowCommand):
         return exists(viewer) and file_name is not None
 
 
+class HexViewerClearCacheCommand(sublime_plugin.WindowCommand):
+    """Clear the render cache."""
+
+    def run(self):
+        """Run the command."""
+
+        cache = get_render_cache()
+        if cache is not None:
+            cache.clear()
+        notify("Render cache cleared!")
+
+    def is_enabled(self):
+        """Check if command is enabled."""
+
+        return get_render_cache() is not None
+
+
 class HexViewerAbortCommand(sublime_plugin.WindowCommand):
     """Abort loading the hex view."""
 
     def run(self):
         """Run the command."""
 
-        if active_thread is not None and active_thread.is_alive():
-            active_thread.abort = True
+        get_scheduler().cancel(ReadBin)
 
     def is_enabled(self):
         """Check if command is enabled."""
 
-        return active_thread is not None and active_thread.is_alive()
+        return bool(get_scheduler().active(ReadBin))
@@ -0,0 +1,273 @@
+"""
+Hex Viewer.
+
+Licensed under MIT
+Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
+"""
+import sublime
+import sublime_plugin
+from os.path import basename, getsize as get_file_size
+from . import hex_common as common
+from .hex_format import HexFormatter
+from .hex_jobs import Job
+from .hex_notify import error
+
+WINDOW_POLL = 250
+
+# Pending window renders by view id
+window_renders = {}
+# Ids of the views whose scrolling is watched
+window_polls = set()
+
+
+class HexWindowGlobal(object):
+    """Global hex window data."""
+
+    bfr = None
+    region = None
+
+    @classmethod
+    def clear(cls):
+        """Clear."""
+
+        cls.bfr = None
+        cls.region = None
+
+
+class HexWindowApplyCommand(sublime_plugin.TextCommand):
+    """Apply the rendered window to the view."""
+
+    def run(self, edit):
+        """Run command."""
+
+        self.view.replace(edit, HexWindowGlobal.region, HexWindowGlobal.bfr)
+
+
+def move_to_offset(view, offset, top=None):
+    """
+    Move the cursor of a windowed view to a file offset.
+
+    If `top` is given, the line at that file offset is scrolled to the top of the viewport instead of centering the
+    cursor, and the cursor is placed on that line if its offset is not in the window.
+    """
+
+    settings = view.settings()
+    geometry = common.get_geometry(view)
+    bytes_wide = geometry.bytes_wide
+    window_start = settings.get("hex_viewer_window_start", 0)
+    window_size = (view.rowcol(view.size())[0] + 1) * bytes_wide
+
+    if top is not None and not (window_start <= offset < window_start + window_size):
+        offset = top
+    wanted = max(0, min(offset - window_start, window_size - 1))
+    pt = view.text_point(
+        int(wanted / bytes_wide),
+        common.ascii_to_hex_col(wanted % bytes_wide, geometry.group_size, geometry.address_offset)
+    )
+    view.sel().clear()
+    view.sel().add(sublime.Region(pt))
+    if top is None:
+        view.show_at_center(pt)
+    else:
+        # Keep the same bytes in view
+        row = max(0, int((top - window_start) / bytes_wide))
+        view.set_viewport_position((view.viewport_position()[0], row * view.line_height()), False)
+    view.window().run_command('hex_highlighter')
+
+
+class WindowRender(Job):
+    """Read and format a window of lines of a file."""
+
+    def __init__(self, view, start, length, offset, top=None):
+        """Initialize."""
+
+        Job.__init__(self)
+        settings = view.settings()
+        self.view = view
+        self.file_name = settings.get("hex_viewer_file_name")
+        self.window_start = start
+        self.length = length
+        self.offset = offset
+        self.top = top
+        self.bytes_wide = int(settings.get("hex_viewer_actual_bytes"))
+        self.group_size = int(settings.get("hex_viewer_bits")) / common.BITS_PER_BYTE
+        self.hex_lower = common.use_hex_lowercase()
+        self.address_width = settings.get("hex_viewer_address_width", common.ADDRESS_WIDTH)
+        # Address of the first byte of the file
+        self.base = settings.get("hex_viewer_starting_address", 0) - settings.get("hex_viewer_window_start", 0)
+        self.text = None
+
+    def get_progress(self):
+        """Get the progress of the rendering."""
+
+        return 1.0 if self.text is not None else 0.0
+
+    def describe(self):
+        """Describe the rendering."""
+
+        return "%s window rendered" % basename(self.file_name)
+
+    def run(self):
+        """Run the command."""
+
+        with open(self.file_name, "rb") as f:
+            f.seek(self.window_start)
+            data = f.read(self.length)
+        self.text = HexFormatter(
+            self.bytes_wide, self.group_size, self.hex_lower, self.base + self.window_start, self.address_width
+        ).format_lines(data)
+
+
+def render_window(view, offset, center=None, top=None):
+    """
+    Move the cursor of a windowed view to a file offset, rendering a new window in the background if needed.
+
+    The window is centered on `center`, or on `offset` if not given.  See `move_to_offset` for `top`.
+    """
+
+    settings = view.settings()
+    bytes_wide = int(settings.get("hex_viewer_actual_bytes"))
+    window_lines = int(settings.get("hex_viewer_window_lines"))
+
+    try:
+        file_size = get_file_size(settings.get("hex_viewer_file_name"))
+    except OSError:
+        error("Can't read %s!" % settings.get("hex_viewer_file_name"))
+        return
+    settings.set("hex_viewer_file_size", file_size)
+
+    offset = max(0, min(offset, file_size - 1))
+    start = common.get_window_start(offset if center is None else center, bytes_wide, window_lines, file_size)
+    pending = window_renders.pop(view.id(), None)
+    if pending is not None:
+        pending.cancel()
+    if start == settings.get("hex_viewer_window_start", 0):
+        move_to_offset(view, offset, top)
+        return
+
+    # Read and format the new window off the UI thread
+    job = WindowRender(view, start, window_lines * bytes_wide, offset, top)
+    window_renders[view.id()] = job
+    job.start(on_window_rendered)
+
+
+def on_window_rendered(job):
+    """Replace the text of the view with the rendered window."""
+
+    view = job.view
+    if window_renders.get(view.id()) is not job:
+        # Replaced by a newer window
+        return
+    del window_renders[view.id()]
+    if job.text is None or not view.is_valid() or not common.is_windowed(view):
+        return
+
+    view.sel().clear()
+    view.set_read_only(False)
+    HexWindowGlobal.bfr = job.text
+    HexWindowGlobal.region = sublime.Region(0, view.size())
+    view.run_command("hex_window_apply")
+    HexWindowGlobal.clear()
+    view.set_read_only(True)
+
+    settings = view.settings()
+    settings.set("hex_viewer_window_start", job.window_start)
+    settings.set("hex_viewer_starting_address", job.base + job.window_start)
+    move_to_offset(view, job.offset, job.top)
+
+
+def watch_window(view):
+    """Start watching the scrolling of a windowed view."""
+
+    if view.id() not in window_polls and common.is_windowed(view):
+        window_polls.add(view.id())
+        poll_window(view)
+
+
+def poll_window(view):
+    """Move the window when the view is scrolled near its edge, for as long as the view is active."""
+
+    window = view.window()
+    active = window.active_view() if window is not None else None
+    if not view.is_valid() or active is None or active.id() != view.id() or not common.is_windowed(view):
+        window_polls.discard(view.id())
+        return
+
+    if view.id() not in window_renders:
+        settings = view.settings()
+        bytes_wide = common.get_geometry(view).bytes_wide
+        window_start = settings.get("hex_viewer_window_start", 0)
+        file_size = settings.get("hex_viewer_file_size", 0)
+        visible = view.visible_region()
+        top = view.rowcol(visible.begin())[0]
+        bottom = view.rowcol(visible.end())[0]
+        last_row = view.rowcol(view.size())[0]
+        # Keep at least a screen of lines on either side of the viewport
+        margin = bottom - top + 1
+
+        if (
+            (top < margin and window_start > 0) or
+            (bottom > last_row - margin and window_start + (last_row + 1) * bytes_wide < file_size)
+        ):
+            # Center the window on the viewport, keeping the cursor on its byte
+            offset = window_start + common.get_byte_offset(view, view.sel()[0].b) if len(view.sel()) else 0
+            render_window(
+                view, offset,
+                window_start + int((top + bottom) / 2) * bytes_wide,
+                window_start + top * bytes_wide
+            )
+
+    sublime.set_timeout(lambda: poll_window(view), WINDOW_POLL)
+
+
+class HexViewerWindowCommand(sublime_plugin.WindowCommand):
+    """Render the window of lines around a file offset and move the cursor to it."""
+
+    def is_enabled(self, offset=0):
+        """Check if command is enabled."""
+
+        view = self.window.active_view()
+        return common.is_enabled() and view is not None and common.is_windowed(view)
+
+    def run(self, offset=0):
+        """Run command."""
+
+        render_window(self.window.active_view(), offset)
+
+
+class HexViewerWindowListenerCommand(sublime_plugin.EventListener):
+    """Move the window of a windowed hex view when the cursor reaches its edge or the view is scrolled near it."""
+
+    def on_activated(self, view):
+        """Watch the scrolling of windowed views."""
+
+        watch_window(view)
+
+    def on_selection_modified(self, view):
+        """Check if the cursor is at the edge of the window."""
+
+        if not common.is_windowed(view) or len(view.sel()) != 1 or not common.is_enabled(view):
+            return
+        watch_window(view)
+        if view.id() in window_renders:
+            # The window is already moving
+            return
+
+        settings = view.settings()
+        state = common.get_view_state(view)
+        bytes_wide = state.geometry.bytes_wide
+        window_start = settings.get("hex_viewer_window_start", 0)
+        file_size = settings.get("hex_viewer_file_size", 0)
+        pt = view.sel()[0].b
+        row = view.rowcol(pt)[0]
+        last_row = view.rowcol(view.size())[0]
+
+        if (
+            (row == 0 and window_start > 0) or
+            (row == last_row and window_start + (last_row + 1) * bytes_wide < file_size)
+        ):
+            # Keep the cursor on the same byte
+            offset = window_start + common.get_byte_offset(view, pt)
+
+            if common.get_window_start(offset, bytes_wide, state.window_lines, file_size) != window_start:
+                view.window().run_command("hex_viewer_window", {"offset": offset})
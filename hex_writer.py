@@ -6,10 +6,10 @@ Copyright (c) 2011-2020 Isaac Muse <isaacmuse@gmail.com>
 """
 import sublime
 import sublime_plugin
-from os.path import dirname, exists
+from os.path import basename, dirname, exists, join, samefile, splitext
 from . import hex_common as common
 from .hex_checksum import Checksum, parse_view_data
-import threading
+from .hex_jobs import Job, BACKGROUND, get_scheduler
 import traceback
 from io import StringIO
 from .hex_notify import notify, error
@@ -18,23 +18,33 @@ USE_CHECKSUM_ON_SAVE = True
 WRITE_GOOD = 0
 WRITE_FAIL = 1
 
-active_thread = None
 
-
-class ThreadedWrite(threading.Thread):
+class ThreadedWrite(Job):
     """Threaded write."""
 
-    def __init__(self, data, file_name, fmt_callback=None, count=None):
+    def __init__(self, data, file_name, fmt_callback=None, count=None, offset=None):
         """Initialize."""
 
+        Job.__init__(self)
         self.data = data
         self.file_name = file_name
+        # When an offset is given, the data is written over the existing file at that offset
+        self.offset = offset
         self.chunk = 0
         self.chunks = len(data) if count is None else count
-        self.abort = False
         self.fmt_callback = fmt_callback if fmt_callback is not None else self.format
         self.status = WRITE_GOOD
-        threading.Thread.__init__(self)
+
+    def get_progress(self):
+        """Get the progress of the write."""
+
+        # Collapsed holes are expanded in several chunks, so the count can exceed the line count
+        return min(1.0, float(self.chunk) / float(self.chunks)) if self.chunks > 0 else 1.0
+
+    def describe(self):
+        """Describe the write."""
+
+        return "chunks written"
 
     def format(self, data):  # noqa: A003
         """Format."""
@@ -46,7 +56,9 @@ class ThreadedWrite(threading.Thread):
         """Run command."""
 
         try:
-            with open(self.file_name, "wb") as f:
+            with open(self.file_name, "wb" if self.offset is None else "r+b") as f:
+                if self.offset is not None:
+                    f.seek(self.offset)
                 for chunk in self.fmt_callback(self.data):
                     self.chunk += 1
                     if self.abort:
@@ -64,13 +76,12 @@ class HexWriterAbortCommand(sublime_plugin.WindowCommand):
     def run(self):
         """Run command."""
 
-        if active_thread is not None and active_thread.is_alive():
-            active_thread.abort = True
+        get_scheduler().cancel(ThreadedWrite)
 
     def is_enabled(self):
         """Check if command is enabled."""
 
-        return active_thread is not None and active_thread.is_alive()
+        return bool(get_scheduler().active(ThreadedWrite))
 
 
 class HexWriterCommand(sublime_plugin.WindowCommand):
@@ -78,6 +89,8 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
 
     export_path = ""
     handshake = -1
+    byte_range = None
+    thread = None
 
     def is_enabled(self):
         """Check if command is enabled."""
@@ -86,7 +99,8 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
         return (
             common.is_enabled() and
             view is not None and not view.settings().get("hex_viewer_fake", False) and
-            not (active_thread is not None and active_thread.is_alive())
+            not common.is_windowed(view) and
+            not (self.thread is not None and self.thread.is_alive())
         )
 
     def export_panel(self):
@@ -100,13 +114,35 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
             self.reset
         )
 
+    def get_export_path(self):
+        """Get the default path to export to: the file itself, or where it would be decompressed to."""
+
+        settings = self.view.settings()
+        file_name = settings.get("hex_viewer_file_name")
+        member = settings.get("hex_viewer_member")
+        if member:
+            return join(dirname(file_name), basename(member))
+        if settings.get("hex_viewer_compression"):
+            root, ext = splitext(file_name)
+            return root + ".tar" if ext.lower() == ".tgz" else root
+        return file_name
+
+    def is_write_back(self):
+        """Check if the byte range of the view is being written back into the file it was read from."""
+
+        file_name = self.view.settings().get("hex_viewer_file_name")
+        return (
+            self.byte_range is not None and exists(self.export_path) and
+            file_name is not None and exists(file_name) and samefile(self.export_path, file_name)
+        )
+
     def overwrite(self, value):
         """Handle the overwrite response."""
 
         if value.strip().lower() == "yes":
             self.export()
         else:
-            self.export_path = self.view.settings().get("hex_viewer_file_name")
+            self.export_path = self.get_export_path()
             self.export_panel()
 
     def prepare_export(self, file_path):
@@ -116,7 +152,7 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
         if exists(dirname(file_path)):
             if exists(file_path):
                 self.window.show_input_panel(
-                    "Overwrite File? (yes | no):",
+                    "Write Back Byte Range? (yes | no):" if self.is_write_back() else "Overwrite File? (yes | no):",
                     "no",
                     self.overwrite,
                     None,
@@ -126,7 +162,7 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
                 self.export()
         else:
             error("Directory does not exist!")
-            self.export_path = self.view.settings().get("hex_viewer_file_name")
+            self.export_path = self.get_export_path()
             self.export_panel()
 
     def reset_thread(self):
@@ -142,12 +178,20 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
             self.hex_buffer.seek(0)
             # Checksum will be threaded and will show the result when done
             sublime.set_timeout(lambda: sublime.status_message("Checksumming..."), 0)
-            hex_hash.threaded_update(self.hex_buffer, parse_view_data, self.row)
+            hex_hash.threaded_update(self.hex_buffer, parse_view_data, self.row, BACKGROUND)
+
+        if self.byte_range is not None and not self.write_back:
+            # The range was extracted to another file, so the view still shows the range of the original
+            self.reset()
+            return
 
         # Update the tab name
         self.view.set_name(common.basename(self.export_path) + ".hxv")
         # Update the internal path
         self.view.settings().set("hex_viewer_file_name", self.export_path)
+        # The exported file holds the decompressed data
+        self.view.settings().erase("hex_viewer_compression")
+        self.view.settings().erase("hex_viewer_member")
         # Tie it to a real view if not already
         self.view.settings().set("hex_viewer_fake", False)
         # Clear the marked edits
@@ -155,42 +199,35 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
         # Reset class
         self.reset()
 
-    def export_thread(self):
-        """Thread the export."""
-
-        ratio = float(self.thread.chunk) / float(self.thread.chunks)
-        percent = int(ratio * 10)
-        leftover = 10 - percent
-        message = "[" + "-" * percent + ">" + "-" * leftover + ("] %3d%%" % int(ratio * 100)) + " chunks written"
-        sublime.status_message(message)
-        if not self.thread.is_alive():
-            if self.thread.abort is True:
-                notify("Write aborted!")
-                sublime.set_timeout(self.reset_thread, 500)
-            else:
-                status = self.thread.status
-                self.reset_thread()
-                if status == WRITE_GOOD:
-                    sublime.set_timeout(self.finish_export, 500)
-                else:
-                    error("Failed to export to " + self.export_path)
+    def on_written(self, thread):
+        """Handle the end of the write."""
+
+        if thread is not self.thread:
+            return
+        self.reset_thread()
+        if thread.abort:
+            notify("Write aborted!")
+        elif thread.status == WRITE_GOOD:
+            self.finish_export()
         else:
-            sublime.set_timeout(self.export_thread, 500)
+            error("Failed to export to " + self.export_path)
 
     def export(self):
         """Export the data."""
 
-        global active_thread
         self.view = self.window.active_view()
         if self.handshake != -1 and self.handshake == self.view.id():
             try:
                 sublime.set_timeout(lambda: sublime.status_message("Writing..."), 0)
                 self.row = self.view.rowcol(self.view.size())[0] + 1
                 self.hex_buffer = StringIO(self.view.substr(sublime.Region(0, self.view.size())))
-                self.thread = ThreadedWrite(self.hex_buffer, self.export_path, parse_view_data, self.row)
-                self.thread.start()
-                self.export_thread()
-                active_thread = self.thread
+                # A byte range is written back in place, leaving the rest of the file untouched
+                self.write_back = self.is_write_back()
+                self.thread = ThreadedWrite(
+                    self.hex_buffer, self.export_path, parse_view_data, self.row,
+                    self.byte_range[0] if self.write_back else None
+                )
+                self.thread.start(self.on_written)
             except Exception:
                 print(str(traceback.format_exc()))
                 error("Failed to export to " + self.export_path)
@@ -211,7 +248,7 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
     def run(self):
         """Run command."""
 
-        if active_thread is not None and active_thread.is_alive():
+        if self.thread is not None and self.thread.is_alive():
             error("HexViewer is already exporting a file!\nPlease run the abort command to stop the current export.")
         else:
             self.view = self.window.active_view()
@@ -221,6 +258,7 @@ class HexWriterCommand(sublime_plugin.WindowCommand):
                 self.reset()
             self.handshake = self.view.id()
 
-            self.export_path = self.view.settings().get("hex_viewer_file_name")
+            self.byte_range = self.view.settings().get("hex_viewer_range")
+            self.export_path = self.get_export_path()
 
             self.export_panel()
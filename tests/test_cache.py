@@ -0,0 +1,111 @@
+"""Test the render cache."""
+import os
+import shutil
+import tempfile
+import unittest
+from hex_cache import RenderCache
+
+
+class TestCache(unittest.TestCase):
+    """Test the keys, entries, and eviction of the render cache."""
+
+    def setUp(self):
+        """Setup."""
+
+        self.temp = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp, "file.bin")
+        with open(self.file_name, "wb") as f:
+            f.write(b"data")
+        os.utime(self.file_name, ns=(1000000000, 1000000000))
+        self.cache = RenderCache(os.path.join(self.temp, "render"), 100)
+
+    def tearDown(self):
+        """Tear down."""
+
+        shutil.rmtree(self.temp)
+
+    def create(self, size):
+        """Create a converted file of the given size."""
+
+        fd, name = tempfile.mkstemp(suffix=".hxv", dir=self.temp)
+        with os.fdopen(fd, "wb") as f:
+            f.write(b"x" * size)
+        return name
+
+    def key(self, **kwargs):
+        """Get the key of the file with the default format, overriding the given arguments."""
+
+        args = {"bytes_wide": 24, "group_size": 2, "hex_lower": True, "starting_address": 0}
+        args.update(kwargs)
+        return RenderCache.key(self.file_name, **args)
+
+    def test_key(self):
+        """Test that keys change with the size and modified time of the file and the layout."""
+
+        key = self.key()
+        self.assertEqual(self.key(), key)
+        self.assertNotEqual(self.key(bytes_wide=16), key)
+        self.assertNotEqual(self.key(group_size=4), key)
+        self.assertNotEqual(self.key(hex_lower=False), key)
+        self.assertNotEqual(self.key(starting_address=16), key)
+        self.assertNotEqual(self.key(offset=1, length=2), key)
+        self.assertNotEqual(self.key(source="gzip"), key)
+
+        os.utime(self.file_name, ns=(2000000000, 2000000000))
+        self.assertNotEqual(self.key(), key)
+        modified = self.key()
+
+        with open(self.file_name, "wb") as f:
+            f.write(b"more data")
+        os.utime(self.file_name, ns=(2000000000, 2000000000))
+        self.assertNotIn(self.key(), (key, modified))
+
+        # Files that don't exist or have no size can't be cached
+        open(self.file_name, "wb").close()
+        self.assertIsNone(self.key())
+        self.assertIsNone(RenderCache.key(os.path.join(self.temp, "missing.bin"), 24, 2, True, 0))
+
+    def test_get(self):
+        """Test that entries are gotten to a file next to the entries and aren't evicted from there."""
+
+        key = self.key()
+        dest = self.cache.temp_file()
+        os.remove(dest)
+        self.assertFalse(self.cache.get(key, dest))
+
+        self.cache.put(key, self.create(60))
+        self.assertTrue(self.cache.get(key, dest))
+        self.assertEqual(os.path.getsize(dest), 60)
+        self.assertEqual(os.stat(dest).st_dev, os.stat(self.cache.path(key)).st_dev)
+
+        # Files gotten to are not evicted with the entry
+        os.utime(self.cache.path(key), (1000, 1000))
+        self.cache.put(self.key(bytes_wide=16), self.create(50))
+        self.assertFalse(os.path.exists(self.cache.path(key)))
+        self.assertEqual(os.path.getsize(dest), 60)
+
+    def test_put_over_budget(self):
+        """Test that conversions larger than the whole budget are not stored."""
+
+        key = self.key()
+        self.cache.put(key, self.create(101))
+        self.assertFalse(os.path.exists(self.cache.path(key)))
+        self.cache.put(key, self.create(100))
+        self.assertTrue(os.path.exists(self.cache.path(key)))
+
+    def test_evict(self):
+        """Test that the least recently used entries are evicted first."""
+
+        cache = RenderCache(os.path.join(self.temp, "render"), 130)
+        keys = [self.key(bytes_wide=width) for width in (8, 16, 24, 32)]
+        for index, key in enumerate(keys[:3]):
+            cache.put(key, self.create(40))
+            os.utime(cache.path(key), (1000 + index, 1000 + index))
+
+        # Using the oldest entry makes the second the least recently used
+        self.assertTrue(cache.get(keys[0], os.path.join(self.temp, "dest.hxv")))
+        cache.put(keys[3], self.create(40))
+        self.assertEqual([os.path.exists(cache.path(key)) for key in keys], [True, False, True, True])
+
+        cache.clear()
+        self.assertFalse(any(os.path.exists(cache.path(key)) for key in keys))
@@ -0,0 +1,569 @@
+"""Test converting files."""
+import bz2
+import gzip
+import importlib
+import io
+import lzma
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+from hex_format import HexFormatter, get_block_size, get_collapsed_row_offset, get_collapsed_offset_row
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_module(name):
+    """Import a module of the plugin package, which uses relative imports, without loading Sublime."""
+
+    if os.path.dirname(ROOT) not in sys.path:
+        sys.path.insert(0, os.path.dirname(ROOT))
+    return importlib.import_module("%s.%s" % (os.path.basename(ROOT), name))
+
+
+hex_convert = import_module("hex_convert")
+
+
+class TestIterFile(unittest.TestCase):
+    """Test iterating the blocks of a file from a memory map and from reads into a buffer."""
+
+    def setUp(self):
+        """Setup."""
+
+        rand = random.Random(0)
+        self.data = bytes(rand.getrandbits(8) for _ in range(0, 200003))
+        self.temp = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp, "test.bin")
+        with open(self.file_name, "wb") as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        """Tear down."""
+
+        shutil.rmtree(self.temp)
+
+    def blocks(self, converter, start=None, end=None):
+        """Get copies of the blocks of the file."""
+
+        return [bytes(block) for block in converter.iterfile(4096, start, end)]
+
+    def test_fallback(self):
+        """Test that reading into a buffer gives the same blocks as the memory map."""
+
+        converter = hex_convert.HexConverter(self.file_name, 24, 2)
+        for start, end in ((None, None), (0, len(self.data)), (1001, 150017), (4080, 8160), (199999, 200003)):
+            mapped = self.blocks(converter, start, end)
+            with mock.patch.object(hex_convert.mmap, "mmap", side_effect=OSError):
+                read = self.blocks(converter, start, end)
+            self.assertEqual(read, mapped)
+            self.assertEqual(b"".join(read), self.data[start:end])
+            # Only the last block may end with an incomplete line
+            self.assertTrue(all(len(block) == 4080 for block in read[:-1]))
+
+    def test_fallback_range(self):
+        """Test converting a byte range that doesn't start at 0 without a memory map."""
+
+        converter = hex_convert.HexConverter(self.file_name, 24, 2, 0x100, 1001, 150000)
+        f = io.StringIO()
+        converter.write(f)
+        with mock.patch.object(hex_convert.mmap, "mmap", side_effect=OSError):
+            fallback = hex_convert.HexConverter(self.file_name, 24, 2, 0x100, 1001, 150000)
+            f2 = io.StringIO()
+            fallback.write(f2)
+        self.assertEqual(f2.getvalue(), f.getvalue())
+        self.assertEqual(f.getvalue(), HexFormatter(24, 2, True, 0x100 + 1001).format_lines(self.data[1001:151001]))
+        self.assertEqual(fallback.state.fingerprints, converter.state.fingerprints)
+        self.assertEqual(fallback.read_count, 150000)
+
+
+class TestDecompress(unittest.TestCase):
+    """Test converting the decompressed data of compressed files and zip archive members."""
+
+    def setUp(self):
+        """Setup."""
+
+        rand = random.Random(0)
+        self.data = bytes(rand.getrandbits(8) for _ in range(0, 100000)) + bytes(50000) + b"end"
+        self.temp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Tear down."""
+
+        shutil.rmtree(self.temp)
+
+    def create(self, name, content):
+        """Create a file in the temporary folder."""
+
+        file_name = os.path.join(self.temp, name)
+        with open(file_name, "wb") as f:
+            f.write(content)
+        return file_name
+
+    def convert(self, file_name, compression, member=None, max_data_size=None):
+        """Convert a file and get the text."""
+
+        converter = hex_convert.HexConverter(
+            file_name, 24, 2, compression=compression, member=member, max_data_size=max_data_size
+        )
+        f = io.StringIO()
+        converter.write(f)
+        return f.getvalue()
+
+    def test_compressed(self):
+        """Test that gzip, bz2, and xz files convert to the hex of their decompressed data."""
+
+        expected = HexFormatter(24, 2).format_lines(self.data)
+        for name, compress in (("a.gz", gzip.compress), ("a.bz2", bz2.compress), ("a.xz", lzma.compress)):
+            file_name = self.create(name, compress(self.data))
+            compression = hex_convert.get_compression(file_name)
+            self.assertEqual(self.convert(file_name, compression), expected, name)
+
+    def test_zip_member(self):
+        """Test that a zip archive member converts to the hex of its data."""
+
+        file_name = os.path.join(self.temp, "a.zip")
+        with zipfile.ZipFile(file_name, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("dir/first.bin", b"first")
+            archive.writestr("second.bin", self.data)
+        self.assertEqual(hex_convert.get_compression(file_name), "zip")
+        self.assertEqual(
+            [info.filename for info in hex_convert.get_members(file_name)], ["dir/first.bin", "second.bin"]
+        )
+        self.assertEqual(self.convert(file_name, "zip", "second.bin"), HexFormatter(24, 2).format_lines(self.data))
+        self.assertEqual(self.convert(file_name, "zip", "dir/first.bin"), HexFormatter(24, 2).format_lines(b"first"))
+
+    def test_corrupt(self):
+        """Test that corrupt compressed data fails to convert."""
+
+        for name, content in (
+            ("bad.gz", b"\x1f\x8b" + b"garbage" * 10),
+            ("bad.bz2", b"BZh9" + b"garbage" * 10),
+            ("bad.xz", b"\xfd7zXZ\x00" + b"garbage" * 10),
+            ("truncated.gz", gzip.compress(self.data)[:-1000])
+        ):
+            file_name = self.create(name, content)
+            with self.assertRaises(Exception, msg=name):
+                self.convert(file_name, hex_convert.get_compression(file_name))
+        with self.assertRaises(zipfile.BadZipFile):
+            hex_convert.get_members(self.create("bad.zip", b"garbage"))
+
+    def test_limit(self):
+        """Test that converting stops once more data is decompressed than allowed."""
+
+        file_name = self.create("a.gz", gzip.compress(self.data))
+        with self.assertRaises(ValueError):
+            self.convert(file_name, "gzip", max_data_size=len(self.data) - 1)
+        self.assertEqual(
+            self.convert(file_name, "gzip", max_data_size=len(self.data)), HexFormatter(24, 2).format_lines(self.data)
+        )
+
+
+class TestDiff(unittest.TestCase):
+    """Test converting only the blocks of a file that changed since it was rendered."""
+
+    def setUp(self):
+        """Setup."""
+
+        rand = random.Random(0)
+        self.bytes_wide = 24
+        self.blocksize = get_block_size(self.bytes_wide)
+        # Three whole blocks and a partial one
+        self.data = bytes(rand.getrandbits(8) for _ in range(self.blocksize * 3 + 1000))
+        fd, self.file_name = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        """Tear down."""
+
+        os.remove(self.file_name)
+
+    def render(self, data):
+        """Write the data to the file and convert it, returning the text and the fingerprints of its blocks."""
+
+        self.write(data)
+        converter = hex_convert.HexConverter(self.file_name, self.bytes_wide, 2)
+        f = io.StringIO()
+        converter.write(f)
+        return f.getvalue(), converter.state.fingerprints
+
+    def write(self, data):
+        """Write the data to the file."""
+
+        with open(self.file_name, "wb") as f:
+            f.write(data)
+
+    def diff(self, data, fingerprints):
+        """Write the data to the file and convert the blocks that changed since the given fingerprints."""
+
+        self.write(data)
+        converter = hex_convert.HexConverter(self.file_name, self.bytes_wide, 2, fingerprints=fingerprints)
+        converter.diff()
+        return converter.changes, converter.state.fingerprints
+
+    def apply(self, text, changes, old_count, new_count):
+        """Replace the lines of the changed blocks the way the hex view does, from the end of the old text."""
+
+        lines = self.blocksize // self.bytes_wide
+        result = text.split("\n") if text else []
+        blocks = dict(changes)
+        if new_count < old_count:
+            del result[new_count * lines:]
+        elif new_count > old_count:
+            result.append("\n".join([blocks[index] for index in range(old_count, new_count)]))
+        for index in sorted([i for i in blocks if i < min(old_count, new_count)], reverse=True):
+            # The last old block may have fewer lines, and new blocks are after it
+            end = min((index + 1) * lines, len(text.split("\n")))
+            result[index * lines:end] = [blocks[index]]
+        return "\n".join(result)
+
+    def check(self, old, new, expected_blocks):
+        """Check that only the expected blocks change and that applying them gives the new rendering."""
+
+        text, fingerprints = self.render(old)
+        changes, new_fingerprints = self.diff(new, fingerprints)
+        self.assertEqual([index for index, _ in changes], expected_blocks)
+        expected, expected_fingerprints = self.render(new)
+        self.assertEqual(new_fingerprints, expected_fingerprints)
+        self.assertEqual(self.apply(text, changes, len(fingerprints), len(new_fingerprints)), expected)
+
+    def test_unchanged(self):
+        """Test that an unchanged file has no changed blocks."""
+
+        self.check(self.data, self.data, [])
+
+    def test_changed(self):
+        """Test that only the blocks with changed bytes are converted."""
+
+        data = bytearray(self.data)
+        data[self.blocksize + 5] ^= 0xff
+        data[self.blocksize * 3 + 999] ^= 0xff
+        self.check(self.data, bytes(data), [1, 3])
+
+    def test_changed_lines(self):
+        """Test that the text of a changed block is the text of the lines of the block."""
+
+        text, fingerprints = self.render(self.data)
+        data = bytearray(self.data)
+        data[self.blocksize * 2] ^= 0xff
+        changes, _ = self.diff(bytes(data), fingerprints)
+        lines = self.blocksize // self.bytes_wide
+        expected = self.render(bytes(data))[0].split("\n")
+        self.assertEqual(changes, [(2, "\n".join(expected[lines * 2:lines * 3]))])
+
+    def test_grow(self):
+        """Test that a growing file converts its partial last block and the new blocks."""
+
+        self.check(self.data, self.data + bytes(self.blocksize * 2), [3, 4, 5])
+
+    def test_shrink(self):
+        """Test that a shrinking file converts its new partial last block and drops the rest."""
+
+        self.check(self.data, self.data[:self.blocksize + 100], [1])
+        self.check(self.data, self.data[:self.blocksize * 2], [])
+
+    def test_partial_line(self):
+        """Test that a last block ending in a partial line is converted when it changes."""
+
+        self.check(self.data, self.data + b"abc", [3])
+        self.check(self.data + b"abc", self.data, [3])
+
+
+class TestSparse(unittest.TestCase):
+    """Test collapsing the holes of sparse files."""
+
+    def setUp(self):
+        """Setup."""
+
+        self.temp = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp, "sparse.bin")
+        self.head = bytes(range(256)) * 16
+        self.tail = b"end of the sparse file" * 5
+        with open(self.file_name, "wb") as f:
+            f.write(self.head)
+            f.truncate(131072)
+            f.seek(131072)
+            f.write(self.tail)
+        self.data = self.head + bytes(131072 - len(self.head)) + self.tail
+
+    def tearDown(self):
+        """Tear down."""
+
+        shutil.rmtree(self.temp)
+
+    def has_holes(self):
+        """Check if the file system reports the hole of the file."""
+
+        if not hasattr(os, "SEEK_HOLE"):
+            return False
+        with open(self.file_name, "rb") as f:
+            try:
+                return os.lseek(f.fileno(), 0, os.SEEK_HOLE) == len(self.head)
+            except OSError:
+                return False
+
+    def test_holes(self):
+        """Test the holes that are found, the marker lines, and the offsets of the rows."""
+
+        if not self.has_holes():
+            self.skipTest("The file system does not support sparse files")
+
+        converter = hex_convert.HexConverter(self.file_name, 16, 2, sparse=True)
+        self.assertEqual(converter.holes, [(4096, 131072)])
+        f = io.StringIO()
+        converter.write(f)
+
+        formatter = HexFormatter(16, 2)
+        marker = formatter.format_hole(4096, 131072)
+        self.assertEqual(marker, "00001000-0001ffff:  -- sparse hole: 126976 zero bytes --")
+        self.assertEqual(
+            f.getvalue(),
+            "\n".join([formatter.format_lines(self.head), marker, formatter.format_lines(self.tail, 131072 // 16)])
+        )
+        self.assertEqual(converter.read_count, len(self.data))
+
+        # The marker row stands in for all of the lines of the hole
+        collapsed = converter.collapsed
+        self.assertEqual(collapsed, [[256, 4096, 131072]])
+        self.assertEqual(get_collapsed_row_offset(collapsed, 16, 10), 160)
+        self.assertEqual(get_collapsed_row_offset(collapsed, 16, 256), 4096)
+        self.assertEqual(get_collapsed_row_offset(collapsed, 16, 257), 131072)
+        self.assertEqual(get_collapsed_row_offset(collapsed, 16, 258), 131088)
+        self.assertEqual(get_collapsed_offset_row(collapsed, 16, 4095), 255)
+        self.assertEqual(get_collapsed_offset_row(collapsed, 16, 4096), 256)
+        self.assertEqual(get_collapsed_offset_row(collapsed, 16, 100000), 256)
+        self.assertEqual(get_collapsed_offset_row(collapsed, 16, 131072), 257)
+        self.assertEqual(get_collapsed_offset_row(collapsed, 16, 131090), 258)
+
+    def test_unaligned(self):
+        """Test that only whole lines of a hole are collapsed."""
+
+        if not self.has_holes():
+            self.skipTest("The file system does not support sparse files")
+
+        converter = hex_convert.HexConverter(self.file_name, 24, 2, sparse=True)
+        # 4096 and 131072 are not multiples of 24
+        self.assertEqual(converter.holes, [(4104, 131064)])
+        f = io.StringIO()
+        converter.write(f)
+        lines = f.getvalue().split("\n")
+        self.assertEqual(lines[171], HexFormatter(24, 2).format_hole(4104, 131064))
+        self.assertEqual(
+            "\n".join(lines[:171] + lines[172:]),
+            "\n".join(
+                [HexFormatter(24, 2).format_lines(self.data[:4104]), HexFormatter(24, 2).format_lines(
+                    self.data[131064:], 131064 // 24
+                )]
+            )
+        )
+
+    def test_disabled(self):
+        """Test that holes are read as zeros when not collapsed."""
+
+        converter = hex_convert.HexConverter(self.file_name, 16, 2)
+        f = io.StringIO()
+        converter.write(f)
+        self.assertEqual(converter.holes, [])
+        self.assertEqual(f.getvalue(), HexFormatter(16, 2).format_lines(self.data))
+
+
+class TestRepeats(unittest.TestCase):
+    """Test collapsing runs of repeated lines."""
+
+    def setUp(self):
+        """Setup."""
+
+        self.temp = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp, "repeats.bin")
+        self.rand = random.Random(0)
+        self.lines_per_block = get_block_size(16) // 16
+
+    def tearDown(self):
+        """Tear down."""
+
+        shutil.rmtree(self.temp)
+
+    def random_lines(self, count):
+        """Get lines of random bytes."""
+
+        return bytes(self.rand.getrandbits(8) for _ in range(count * 16))
+
+    def collapse(self, data):
+        """Collapse the repeated lines of the data line by line."""
+
+        formatter = HexFormatter(16, 2)
+        lines = []
+        collapsed = []
+        prev = None
+        run_start = None
+        for pos in range(0, len(data), 16):
+            line = data[pos:pos + 16]
+            if line == prev:
+                if run_start is None:
+                    run_start = pos
+                continue
+            if run_start is not None:
+                collapsed.append([len(lines), run_start, pos])
+                lines.append(formatter.format_repeat(run_start, pos))
+                run_start = None
+            lines.append(formatter.format_lines(line, pos // 16))
+            prev = line if len(line) == 16 else None
+        if run_start is not None:
+            collapsed.append([len(lines), run_start, len(data)])
+            lines.append(formatter.format_repeat(run_start, len(data)))
+        return "\n".join(lines), collapsed
+
+    def check(self, data, expected_collapsed=None):
+        """Check the collapsed conversion of the data against collapsing it line by line."""
+
+        with open(self.file_name, "wb") as f:
+            f.write(data)
+        converter = hex_convert.HexConverter(self.file_name, 16, 2, repeats=True)
+        f = io.StringIO()
+        converter.write(f)
+        text, collapsed = self.collapse(data)
+        self.assertEqual(f.getvalue(), text)
+        self.assertEqual(converter.collapsed, collapsed)
+        if expected_collapsed is not None:
+            self.assertEqual(collapsed, expected_collapsed)
+        self.assertEqual(converter.read_count, len(data))
+
+    def test_within_block(self):
+        """Test runs inside a block."""
+
+        line = b"0123456789abcdef"
+        self.check(
+            self.random_lines(3) + line * 5 + self.random_lines(2) + line * 2 + self.random_lines(1),
+            [[4, 64, 128], [8, 176, 192]]
+        )
+
+    def test_across_blocks(self):
+        """Test a run that starts in one block and ends in the next."""
+
+        start = self.lines_per_block - 10
+        self.check(
+            self.random_lines(start) + b"x" * 16 * 30 + self.random_lines(5),
+            [[start + 1, (start + 1) * 16, (start + 30) * 16]]
+        )
+
+    def test_whole_blocks(self):
+        """Test a run that covers whole blocks."""
+
+        start = self.lines_per_block - 1
+        end = start + self.lines_per_block * 2 + 7
+        self.check(
+            self.random_lines(start) + bytes(16 * (end - start)) + self.random_lines(1),
+            [[start + 1, (start + 1) * 16, end * 16]]
+        )
+
+    def test_short_last_line(self):
+        """Test a run ending in a short last line, which is never part of the run."""
+
+        line = b"0123456789abcdef"
+        self.check(self.random_lines(2) + line * 4 + line[:8], [[3, 48, 96]])
+        self.check(self.random_lines(2) + line * 4, [[3, 48, 96]])
+
+    def test_short_last_line_across_blocks(self):
+        """Test a run ending at the end of a block followed by a short last line."""
+
+        start = self.lines_per_block - 5
+        self.check(
+            self.random_lines(start) + bytes(16 * 5) + bytes(3),
+            [[start + 1, (start + 1) * 16, self.lines_per_block * 16]]
+        )
+
+
+class TestParallel(unittest.TestCase):
+    """Test converting files in a process pool."""
+
+    def setUp(self):
+        """Setup."""
+
+        rand = random.Random(0)
+        self.temp = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp, "test.bin")
+        with open(self.file_name, "wb") as f:
+            f.write(bytes(rand.getrandbits(8) for _ in range(0, 1000003)))
+        # Use small chunks so the file is split between the processes
+        self.chunk_size = hex_convert.PARALLEL_CHUNK_SIZE
+        hex_convert.PARALLEL_CHUNK_SIZE = get_block_size(24) * 3
+
+    def tearDown(self):
+        """Tear down."""
+
+        hex_convert.PARALLEL_CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.temp)
+
+    def convert(self, processes, **kwargs):
+        """Convert the file and get the converter and the text."""
+
+        class ParallelConverter(hex_convert.HexConverter):
+            """Converter that fails instead of falling back to the serial conversion."""
+
+            def convert(self, f):
+                """Fail."""
+
+                raise AssertionError("The file was not converted in parallel")
+
+        converter = (ParallelConverter if processes > 1 else hex_convert.HexConverter)(
+            self.file_name, 24, 2, processes=processes, **kwargs
+        )
+        converter.keep_data()
+        f = io.StringIO()
+        converter.write(f)
+        return converter, f.getvalue()
+
+    def test_parallel(self):
+        """Test that the parallel conversion matches the serial conversion."""
+
+        serial, serial_text = self.convert(0)
+        parallel, parallel_text = self.convert(2)
+        self.assertEqual(parallel_text, serial_text)
+        self.assertEqual(parallel.state.fingerprints, serial.state.fingerprints)
+        self.assertEqual(parallel.read_count, serial.read_count)
+        self.assertEqual(parallel.read_count, 1000003)
+        self.assertEqual(parallel.state.data, serial.state.data)
+
+    def test_parallel_range(self):
+        """Test that the parallel conversion of a byte range matches the serial conversion."""
+
+        serial, serial_text = self.convert(0, offset=1001, length=900000, starting_address=0x10)
+        parallel, parallel_text = self.convert(2, offset=1001, length=900000, starting_address=0x10)
+        self.assertEqual(parallel_text, serial_text)
+        self.assertEqual(parallel.state.fingerprints, serial.state.fingerprints)
+        self.assertEqual(parallel.read_count, serial.read_count)
+        self.assertEqual(parallel.read_count, 900000)
+
+
+class TestDump(unittest.TestCase):
+    """Test dumping files to hex files."""
+
+    def setUp(self):
+        """Setup."""
+
+        self.temp = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.temp, "test.bin")
+        with open(self.file_name, "wb") as f:
+            f.write(bytes(range(256)))
+
+    def tearDown(self):
+        """Tear down."""
+
+        shutil.rmtree(self.temp)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "File modes are not supported on Windows")
+    def test_mode(self):
+        """Test that hex files are created with the mode of new files instead of the temporary file's."""
+
+        hex_dump = import_module("hex_dump")
+        umask = os.umask(0o022)
+        try:
+            hex_name = hex_dump.dump_file(self.file_name, self.file_name + ".hxv", 16, 2)
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(hex_name).st_mode & 0o777, 0o644)
+        with open(hex_name) as f:
+            self.assertEqual(f.read(), HexFormatter(16, 2).format_lines(bytes(range(256))))
@@ -0,0 +1,230 @@
+"""Test hex formatting."""
+import unittest
+import random
+import struct
+from hex_format import HexFormatter, ByteGeometry, get_address_width, get_layout
+
+VALID_BITS = [8, 16, 32, 64, 128]
+VALID_BYTES = [8, 10, 16, 24, 32, 48, 64, 128, 256, 512]
+
+
+def legacy_format(data, bytes_wide, group_size, hex_lower=True, starting_address=0):
+    """Format data the way `ReadBin` did byte by byte (reference implementation)."""
+
+    byte_string = "%02x" if hex_lower else "%02X"
+    address_string = "%08x" if hex_lower else "%08X"
+    translate_table = str.maketrans(
+        "".join([chr(c) for c in range(0, 256)]),
+        "".join(["."] * 32 + [chr(c) for c in range(32, 127)] + ["."] * 129)
+    )
+    def_struct = struct.Struct("=" + ("B" * bytes_wide))
+    def_template = ((byte_string * group_size) + " ") * int(bytes_wide / group_size)
+
+    out = []
+    for line, start in enumerate(range(0, len(data), bytes_wide)):
+        byte_array = data[start:start + bytes_wide]
+        l_buffer = [(address_string + ":  ") % ((line * bytes_wide) + starting_address)]
+        try:
+            l_buffer.append(def_template % def_struct.unpack(byte_array))
+        except struct.error:
+            values = struct.unpack("=" + ("B" * len(byte_array)), byte_array)
+            remain_group = int(len(byte_array) / group_size)
+            remain_extra = len(byte_array) % group_size
+            l_buffer.append(
+                (((byte_string * group_size) + " ") * (remain_group) + (byte_string * remain_extra)) % values
+            )
+            delta = bytes_wide - len(byte_array)
+            group_space = int(delta / group_size)
+            extra_space = (1 if delta % group_size else 0)
+            l_buffer.append(" " * (group_space + extra_space + delta * 2))
+        l_buffer.append(" :" + "".join([chr(translate_table[b]) for b in byte_array]))
+        out.append("".join(l_buffer))
+    return "\n".join(out)
+
+
+def layouts():
+    """Get every valid group size and line width combination (as `HexViewerCommand.set_format` adjusts them)."""
+
+    for bits in VALID_BITS:
+        group_size = bits // 8
+        for bytes_wide in VALID_BYTES:
+            offset = bytes_wide % group_size
+            if offset == bytes_wide:
+                bytes_wide = group_size
+            elif offset != 0:
+                bytes_wide -= offset
+            yield bytes_wide, group_size
+
+
+class TestFormat(unittest.TestCase):
+    """Test the block formatter against the reference implementation."""
+
+    def setUp(self):
+        """Setup."""
+
+        rand = random.Random(0)
+        self.data = bytes(rand.getrandbits(8) for _ in range(0, 2048))
+
+    def test_get_layout(self):
+        """Test that line widths are rounded to whole groups and invalid values use the defaults."""
+
+        bits = [b for b in VALID_BITS for _ in VALID_BYTES]
+        self.assertEqual([get_layout(b, w) for b, w in zip(bits, VALID_BYTES * len(VALID_BITS))], list(layouts()))
+        self.assertEqual(get_layout(12, 7), (24, 2))
+        self.assertEqual(get_layout(64, 12, [12]), (8, 8))
+
+    def test_layouts(self):
+        """Test every layout, including incomplete last lines."""
+
+        for bytes_wide, group_size in layouts():
+            for size in (0, 1, group_size + 1, bytes_wide - 1, bytes_wide, bytes_wide * 3 + 5, len(self.data)):
+                data = self.data[:size]
+                for lower in (True, False):
+                    formatter = HexFormatter(bytes_wide, group_size, lower, 0x10)
+                    self.assertEqual(
+                        formatter.format_lines(data),
+                        legacy_format(data, bytes_wide, group_size, lower, 0x10),
+                        "Mismatch: bytes=%d group=%d size=%d" % (bytes_wide, group_size, size)
+                    )
+
+    def test_blocks(self):
+        """Test that formatting in blocks is the same as formatting everything at once."""
+
+        for bytes_wide, group_size in layouts():
+            formatter = HexFormatter(bytes_wide, group_size)
+            blocksize = bytes_wide * 7
+            blocks = [
+                formatter.format_lines(self.data[i:i + blocksize], i // bytes_wide)
+                for i in range(0, len(self.data), blocksize)
+            ]
+            self.assertEqual("\n".join(blocks), legacy_format(self.data, bytes_wide, group_size))
+
+    def test_hole(self):
+        """Test the marker line of a collapsed hole."""
+
+        self.assertEqual(
+            HexFormatter(16, 2, True, 0x10).format_hole(0x100, 0x2000),
+            "00000110-0000200f:  -- sparse hole: 7936 zero bytes --"
+        )
+        self.assertEqual(
+            HexFormatter(16, 2, False).format_hole(0xa0, 0xc0),
+            "000000A0-000000BF:  -- sparse hole: 32 zero bytes --"
+        )
+
+    def test_repeat(self):
+        """Test the marker line of a collapsed run of repeated lines."""
+
+        self.assertEqual(
+            HexFormatter(16, 2, True, 0x10).format_repeat(0x20, 0x60),
+            "* 00000030-0000006f:  -- previous line repeated 4 times --"
+        )
+
+    def test_split_repeat(self):
+        """Test taking the first line out of a run of repeated lines when the line before it is edited."""
+
+        formatter = HexFormatter(16, 2, True, 0x10)
+        line = formatter.format_lines(b"0123456789abcdef")
+        collapsed = [[1, 0x10, 0x50], [4, 0x100, 0x1000]]
+        self.assertEqual(
+            formatter.split_repeat(collapsed, 0, line),
+            "00000020:  3031 3233 3435 3637 3839 6162 6364 6566  :0123456789abcdef\n"
+            "* 00000030-0000005f:  -- previous line repeated 3 times --"
+        )
+        # The following collapsed ranges move down a row
+        self.assertEqual(collapsed, [[2, 0x20, 0x50], [5, 0x100, 0x1000]])
+
+        # A run of a single line is replaced by the line
+        collapsed = [[1, 0x10, 0x20], [4, 0x100, 0x1000]]
+        self.assertEqual(
+            formatter.split_repeat(collapsed, 0, line),
+            "00000020:  3031 3233 3435 3637 3839 6162 6364 6566  :0123456789abcdef"
+        )
+        self.assertEqual(collapsed, [[4, 0x100, 0x1000]])
+
+        # Wide addresses
+        formatter = HexFormatter(16, 2, False, 0, 10)
+        collapsed = [[1, 0x10, 0x30]]
+        self.assertEqual(
+            formatter.split_repeat(collapsed, 0, formatter.format_lines(b"0123456789ABCDEF")),
+            "0000000010:  3031 3233 3435 3637 3839 4142 4344 4546  :0123456789ABCDEF\n"
+            "* 0000000020-000000002F:  -- previous line repeated 1 times --"
+        )
+        self.assertEqual(collapsed, [[2, 0x20, 0x30]])
+
+    def test_geometry(self):
+        """Test that byte geometry finds the text of every byte and the bytes covered by selections."""
+
+        for bytes_wide, group_size in layouts():
+            geometry = ByteGeometry(bytes_wide, group_size)
+            data = self.data[:bytes_wide * 2 + 3]
+            lines = HexFormatter(bytes_wide, group_size).format_lines(data).split("\n")
+            for line, text in enumerate(lines):
+                line_data = data[line * bytes_wide:(line + 1) * bytes_wide]
+                count = geometry.line_bytes(text)
+                self.assertEqual(count, len(line_data))
+                for byte, value in enumerate(line_data):
+                    column = geometry.hex_column(byte)
+                    self.assertEqual(text[column:column + 2], "%02x" % value)
+                    self.assertEqual(geometry.hex_byte(column), (byte, 0))
+                    self.assertEqual(geometry.hex_byte(column + 1), (byte, 1))
+                    self.assertEqual(text[geometry.ascii_column(byte)], chr(value) if 32 <= value < 127 else ".")
+                    self.assertEqual(geometry.select_hex(column + 1, column + 1, count), (byte, 1))
+                    ascii_column = geometry.ascii_column(byte)
+                    self.assertEqual(geometry.select_ascii(ascii_column, ascii_column, count), (byte, 1))
+                start, end = geometry.hex_span(0, count)
+                self.assertEqual(text[start:end], text[11:geometry.hex_end].strip())
+                self.assertEqual(geometry.select_lines(None, None, count), (0, count) if count else (None, 0))
+                self.assertEqual(geometry.select_lines(None, len(text), count), (0, count) if count else (None, 0))
+                self.assertEqual(geometry.select_lines(None, 11, count), (None, 0))
+                if count:
+                    last_ascii, last_hex = geometry.ascii_column(count - 1), geometry.hex_column(count - 1)
+                    self.assertEqual(geometry.select_lines(last_ascii, None, count), (count - 1, 1))
+                    self.assertEqual(geometry.select_lines(None, last_hex + 1, count), (0, count))
+                self.assertEqual(geometry.select_hex(11, geometry.hex_end, count), (0, count))
+                self.assertEqual(geometry.select_hex(geometry.hex_end, geometry.hex_end, count), (None, 0))
+
+        geometry = ByteGeometry(16, 2)
+        # Starting on the space before a group starts at the group, and ending on one ends before it
+        self.assertEqual(geometry.select_hex(15, 20, 16), (2, 2))
+        self.assertEqual(geometry.select_hex(15, 15, 16), (None, 0))
+        self.assertEqual(geometry.line_bytes(HexFormatter(16, 2).format_hole(0x10, 0x1000)), 0)
+        self.assertEqual(geometry.line_bytes(HexFormatter(16, 2).format_repeat(0x10, 0x1000)), 0)
+
+        # Selections spanning several lines start and end on the bytes they are dragged from and to
+        geometry = ByteGeometry(24, 2)
+        self.assertEqual(geometry.select_lines(geometry.hex_column(5), None, 24), (5, 19))
+        self.assertEqual(geometry.select_lines(geometry.hex_column(5) + 1, None, 24), (5, 19))
+        self.assertEqual(geometry.select_lines(geometry.hex_column(6) - 1, None, 24), (6, 18))
+        self.assertEqual(geometry.select_lines(geometry.ascii_column(5), None, 24), (5, 19))
+        self.assertEqual(geometry.select_lines(geometry.hex_end, None, 24), (0, 24))
+        self.assertEqual(geometry.select_lines(None, geometry.ascii_column(3) + 1, 24), (0, 4))
+        self.assertEqual(geometry.select_lines(None, geometry.ascii_column(3), 24), (0, 3))
+        self.assertEqual(geometry.select_lines(None, geometry.hex_column(3) + 1, 24), (0, 4))
+        self.assertEqual(geometry.select_lines(None, geometry.hex_column(4) - 1, 24), (0, 4))
+        self.assertEqual(geometry.select_lines(None, geometry.ascii_start, 24), (0, 24))
+        self.assertEqual(geometry.select_lines(None, geometry.ascii_column(20), 10), (0, 10))
+        self.assertEqual(geometry.select_lines(geometry.hex_column(12), None, 10), (None, 0))
+
+    def test_address_width(self):
+        """Test that addresses past 4 GiB widen the address column and the geometry follows it."""
+
+        self.assertEqual(get_address_width(0), 8)
+        self.assertEqual(get_address_width(0x100000000), 8)
+        self.assertEqual(get_address_width(0x100000001), 9)
+        self.assertEqual(get_address_width(0x10000000000), 10)
+
+        data = self.data[:40]
+        formatter = HexFormatter(16, 2, True, 0xfffffff0, get_address_width(0x100000020))
+        lines = formatter.format_lines(data).split("\n")
+        self.assertEqual([text[:10] for text in lines], ["0fffffff0:", "100000000:", "100000010:"])
+        self.assertEqual(formatter.format_hole(0x10, 0x20), "100000000-10000000f:  -- sparse hole: 16 zero bytes --")
+
+        geometry = ByteGeometry(16, 2, 9)
+        self.assertEqual(geometry.address_offset, 12)
+        for text, line_data in zip(lines, (data[:16], data[16:32], data[32:])):
+            self.assertEqual(geometry.line_bytes(text), len(line_data))
+            for byte, value in enumerate(line_data):
+                column = geometry.hex_column(byte)
+                self.assertEqual(text[column:column + 2], "%02x" % value)
+                self.assertEqual(text[geometry.ascii_column(byte)], chr(value) if 32 <= value < 127 else ".")
+        self.assertEqual(geometry.line_bytes(formatter.format_repeat(0x10, 0x30)), 0)
@@ -0,0 +1,225 @@
+"""
+Benchmark hex conversion.
+
+Converts synthetic files of random, zero, and text data with every valid group size
+and line width combination, and reports throughput, peak memory, and the time until
+the first converted line is available.  Each conversion runs in a fresh process so
+the peak memory of one case doesn't leak into the next.  Results are written as JSON
+so runs can be compared with `--compare`.
+
+    python tools/benchmark.py --sizes 1,16 --output before.json
+    python tools/benchmark.py --sizes 1,16 --output after.json --compare before.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = "1,16,256,1024"
+DATA_KINDS = ("random", "zero", "text")
+MB = 1048576
+WORDS = (
+    "the quick brown fox jumps over lazy dog hex viewer sublime text binary file offset address byte "
+    "group line width ascii inspector checksum export edit"
+).split()
+
+
+def import_module(name):
+    """Import a module of the plugin package without loading Sublime."""
+
+    sys.path.insert(0, os.path.dirname(ROOT))
+    return importlib.import_module("%s.%s" % (os.path.basename(ROOT), name))
+
+
+def create_file(file_name, size, kind):
+    """Create a synthetic file of the given size and kind of data."""
+
+    rand = random.Random(0)
+    with open(file_name, "wb") as f:
+        remain = size
+        while remain > 0:
+            count = min(MB, remain)
+            if kind == "random":
+                data = os.urandom(count)
+            elif kind == "zero":
+                data = bytes(count)
+            else:
+                text = []
+                length = 0
+                while length < count:
+                    line = " ".join(rand.choice(WORDS) for _ in range(rand.randint(4, 16))) + "\n"
+                    text.append(line)
+                    length += len(line)
+                data = "".join(text).encode("ascii")[:count]
+            f.write(data)
+            remain -= count
+
+
+def get_peak_rss():
+    """Get the peak resident set size of this process and its children in bytes, if available."""
+
+    if resource is None:
+        return None
+    # Linux reports kilobytes, macOS reports bytes
+    scale = 1 if sys.platform == "darwin" else 1024
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) * scale
+
+
+def run_case(file_name, bytes_wide, group_size, processes):
+    """Convert the file once and print the measurements as JSON."""
+
+    hex_convert = import_module("hex_convert")
+
+    class TimedConverter(hex_convert.HexConverter):
+        """Converter that records when the first lines are written."""
+
+        first_line = None
+
+        def emit(self, f, text):
+            """Write converted text."""
+
+            if self.first_line is None:
+                self.first_line = time.perf_counter()
+            hex_convert.HexConverter.emit(self, f, text)
+
+    fd, hex_name = tempfile.mkstemp(suffix=".hxv", dir=os.path.dirname(file_name))
+    os.close(fd)
+    try:
+        start = time.perf_counter()
+        converter = TimedConverter(file_name, bytes_wide, group_size, processes=processes)
+        with open(hex_name, "w") as f:
+            converter.write(f)
+        end = time.perf_counter()
+    finally:
+        os.remove(hex_name)
+
+    print(
+        json.dumps(
+            {
+                "seconds": end - start,
+                "first_line": (converter.first_line - start) if converter.first_line is not None else None,
+                "peak_rss": get_peak_rss()
+            }
+        )
+    )
+
+
+def measure(file_name, bytes_wide, group_size, processes):
+    """Run a single case in a new process and return its measurements."""
+
+    output = subprocess.check_output(
+        [
+            sys.executable, os.path.abspath(__file__), "--case", file_name,
+            str(bytes_wide), str(group_size), str(processes)
+        ]
+    )
+    return json.loads(output.decode("utf-8").strip().splitlines()[-1])
+
+
+def compare(results, baseline):
+    """Print the throughput change of each case against a previous run."""
+
+    def key(result):
+        return (result["size"], result["data"], result["bits"], result["bytes"])
+
+    previous = {key(result): result for result in baseline["results"]}
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old["mb_per_sec"]:
+            continue
+        print(
+            "%6g MB %-6s %3d bits %3d bytes: %8.1f -> %8.1f MB/s (%+.1f%%)" % (
+                result["size"] / MB, result["data"], result["bits"], result["bytes"],
+                old["mb_per_sec"], result["mb_per_sec"],
+                (result["mb_per_sec"] / old["mb_per_sec"] - 1) * 100
+            )
+        )
+
+
+def main():
+    """Run the benchmarks."""
+
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmark hex conversion.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated file sizes in MB.")
+    parser.add_argument("--data", default=",".join(DATA_KINDS), help="Comma separated kinds of data.")
+    parser.add_argument("--processes", type=int, default=0, help="Value of 'conversion_processes'.")
+    parser.add_argument("--directory", default=None, help="Directory to create the synthetic files in.")
+    parser.add_argument("--output", default="benchmark.json", help="File to write the JSON results to.")
+    parser.add_argument("--compare", default=None, help="Previous JSON results to compare against.")
+    parser.add_argument("--case", nargs=4, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        file_name, bytes_wide, group_size, processes = args.case
+        run_case(file_name, int(bytes_wide), int(group_size), int(processes))
+        return 0
+
+    hex_format = import_module("hex_format")
+    sizes = [int(float(size) * MB) for size in args.sizes.split(",")]
+    kinds = [kind for kind in args.data.split(",") if kind in DATA_KINDS]
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        for size in sizes:
+            for kind in kinds:
+                file_name = os.path.join(directory, "%s-%d.bin" % (kind, size))
+                create_file(file_name, size, kind)
+                for bits in hex_format.VALID_BITS:
+                    for bytes_per_line in hex_format.VALID_BYTES:
+                        bytes_wide, group_size = hex_format.get_layout(bits, bytes_per_line)
+                        result = measure(file_name, bytes_wide, group_size, args.processes)
+                        result.update(
+                            {
+                                "size": size,
+                                "data": kind,
+                                "bits": bits,
+                                "bytes": bytes_per_line,
+                                "bytes_wide": bytes_wide,
+                                "group_size": group_size,
+                                "mb_per_sec": (size / MB) / result["seconds"] if result["seconds"] else None
+                            }
+                        )
+                        results.append(result)
+                        print(
+                            "%6g MB %-6s %3d bits %3d bytes: %8.1f MB/s, first line %7.1f ms, peak RSS %s" % (
+                                size / MB, kind, bits, bytes_per_line, result["mb_per_sec"] or 0,
+                                (result["first_line"] or 0) * 1000,
+                                "%.1f MB" % (result["peak_rss"] / MB) if result["peak_rss"] else "n/a"
+                            )
+                        )
+                os.remove(file_name)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "processes": args.processes,
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,456 @@
+"""
+Benchmark the latency of selection handling.
+
+Measures how long highlighting the selections, adjusting a hex selection to the bytes it
+covers, and reading the bytes for the inspector take per selection change.  The plugin
+runs against an in-process stand-in for the Sublime API, with a view over the real hex
+text of a synthetic file, so no Sublime Text is needed.  Each layout is measured with a
+single cursor, many cursors of which one moves at a time, and large selections, and the
+50th and 99th percentile latencies are reported.  Results are written as JSON so runs can
+be compared with `--compare`.
+
+    python tools/latency.py --output before.json
+    python tools/latency.py --output after.json --compare before.json
+"""
+import argparse
+import bisect
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LAYOUTS = "8:16,16:24,32:32,64:64"
+CASES = ("cursor", "cursors", "selection")
+MB = 1048576
+
+
+class Region(object):
+    """Stand-in for `sublime.Region`."""
+
+    def __init__(self, a, b=None):
+        """Initialize."""
+
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        """Get the start of the region."""
+
+        return min(self.a, self.b)
+
+    def end(self):
+        """Get the end of the region."""
+
+        return max(self.a, self.b)
+
+    def size(self):
+        """Get the size of the region."""
+
+        return abs(self.b - self.a)
+
+    def empty(self):
+        """Check if the region is empty."""
+
+        return self.a == self.b
+
+    def __eq__(self, other):
+        """Compare regions."""
+
+        return isinstance(other, Region) and self.a == other.a and self.b == other.b
+
+    def __hash__(self):
+        """Hash the region."""
+
+        return hash((self.a, self.b))
+
+
+class Settings(dict):
+    """Stand-in for `sublime.Settings`."""
+
+    def get(self, key, default=None):
+        """Get a setting."""
+
+        return dict.get(self, key, default)
+
+    def set(self, key, value):  # noqa: A003
+        """Set a setting."""
+
+        self[key] = value
+
+    def has(self, key):
+        """Check if a setting is set."""
+
+        return key in self
+
+    def erase(self, key):
+        """Erase a setting."""
+
+        self.pop(key, None)
+
+    def add_on_change(self, key, callback):
+        """Ignore change listeners, the settings don't change while benchmarking."""
+
+    def clear_on_change(self, key):
+        """Ignore change listeners."""
+
+
+class Selection(list):
+    """Stand-in for `sublime.Selection`."""
+
+    def clear(self):
+        """Remove all selections."""
+
+        del self[:]
+
+    def add(self, region):
+        """Add a selection."""
+
+        self.append(region if isinstance(region, Region) else Region(region))
+
+
+class View(object):
+    """Stand-in for `sublime.View` over a hex text, with the line lookups Sublime does by index."""
+
+    def __init__(self, text, bits, bytes_wide):
+        """Initialize."""
+
+        self.text = text
+        self.starts = [0]
+        index = text.find("\n")
+        while index != -1:
+            self.starts.append(index + 1)
+            index = text.find("\n", index + 1)
+        self.selection = Selection()
+        self.view_settings = Settings(
+            {
+                "syntax": "Packages/HexViewer/HexViewer.sublime-syntax",
+                "hex_viewer_bits": bits,
+                "hex_viewer_actual_bytes": bytes_wide,
+                "hex_viewer_starting_address": 0,
+                "hex_viewer_collapsed": []
+            }
+        )
+        self.regions = {}
+        self.status = {}
+
+    def id(self):  # noqa: A003
+        """Get the view id."""
+
+        return 1
+
+    def change_count(self):
+        """Get the change count, the text doesn't change while benchmarking."""
+
+        return 0
+
+    def size(self):
+        """Get the size of the text."""
+
+        return len(self.text)
+
+    def settings(self):
+        """Get the view settings."""
+
+        return self.view_settings
+
+    def sel(self):
+        """Get the selections."""
+
+        return self.selection
+
+    def substr(self, region):
+        """Get the text of a region, or the character at a point."""
+
+        if isinstance(region, Region):
+            return self.text[region.begin():region.end()]
+        return self.text[region:region + 1] or "\x00"
+
+    def rowcol(self, point):
+        """Get the row and column of a point."""
+
+        row = bisect.bisect_right(self.starts, min(point, len(self.text))) - 1
+        return row, point - self.starts[row]
+
+    def text_point(self, row, col):
+        """Get the point of a row and column."""
+
+        return self.starts[min(row, len(self.starts) - 1)] + col
+
+    def line(self, point):
+        """Get the region of the line of a point or region."""
+
+        if isinstance(point, Region):
+            point = point.begin()
+        row = self.rowcol(point)[0]
+        end = self.starts[row + 1] - 1 if row + 1 < len(self.starts) else len(self.text)
+        return Region(self.starts[row], end)
+
+    def score_selector(self, point, selector):
+        """Score the hex byte scopes of the syntax by column; other selectors don't match."""
+
+        column = self.rowcol(point)[1]
+        char = self.substr(point)
+        bytes_wide = self.view_settings.get("hex_viewer_actual_bytes")
+        group_size = self.view_settings.get("hex_viewer_bits") // 8
+        hex_end = 11 + bytes_wide * 2 + bytes_wide // group_size - 1
+        if selector.startswith("raw.byte") and 11 <= column < hex_end and char != " ":
+            return 1
+        if selector.startswith("raw.punctuation") and 11 <= column < hex_end and char == " ":
+            return 1
+        return 0
+
+    def add_regions(self, key, regions, scope="", icon="", flags=0):
+        """Keep the regions."""
+
+        self.regions[key] = list(regions)
+
+    def get_regions(self, key):
+        """Get the regions."""
+
+        return self.regions.get(key, [])
+
+    def erase_regions(self, key):
+        """Erase the regions."""
+
+        self.regions.pop(key, None)
+
+    def set_status(self, key, value):
+        """Keep the status."""
+
+        self.status[key] = value
+
+    def set_read_only(self, value):
+        """Ignore, the view is read only."""
+
+    def set_scratch(self, value):
+        """Ignore, the view is scratch."""
+
+    def window(self):
+        """Get the window."""
+
+        return sublime.active_window()
+
+
+class Window(object):
+    """Stand-in for `sublime.Window` with a single view."""
+
+    def __init__(self):
+        """Initialize."""
+
+        self.view = None
+
+    def active_view(self):
+        """Get the view."""
+
+        return self.view
+
+    def run_command(self, name, args=None):
+        """Ignore commands."""
+
+
+sublime = types.ModuleType("sublime")
+window = Window()
+
+
+def install_sublime():
+    """Install the Sublime API stand-in so the plugin can be imported."""
+
+    settings = Settings()
+    sublime.Region = Region
+    sublime.DRAW_OUTLINED = 256
+    sublime.DRAW_NO_FILL = 32
+    sublime.DRAW_NO_OUTLINE = 64
+    sublime.DRAW_SOLID_UNDERLINE = 512
+    sublime.HIDDEN = 128
+    sublime.load_settings = lambda name: settings
+    sublime.active_window = lambda: window
+    sublime.set_timeout = lambda callback, delay=0: callback()
+    sublime.set_timeout_async = lambda callback, delay=0: callback()
+    sublime.status_message = lambda message: None
+    sublime.error_message = lambda message: None
+    sublime.run_command = lambda name, args=None: None
+
+    sublime_plugin = types.ModuleType("sublime_plugin")
+    for name in ("ApplicationCommand", "WindowCommand", "TextCommand", "EventListener", "ViewEventListener"):
+        setattr(
+            sublime_plugin, name,
+            type(name, (object,), {"__init__": lambda self, window=None: setattr(self, "window", window)})
+        )
+    sys.modules["sublime"] = sublime
+    sys.modules["sublime_plugin"] = sublime_plugin
+
+
+def import_module(name):
+    """Import a module of the plugin package."""
+
+    sys.path.insert(0, os.path.dirname(ROOT))
+    return importlib.import_module("%s.%s" % (os.path.basename(ROOT), name))
+
+
+def percentile(samples, percent):
+    """Get the percentile of the samples."""
+
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))]
+
+
+def random_point(rand, view, geometry):
+    """Get a random point on a byte of a line, in the hex or the ASCII column."""
+
+    row = rand.randrange(len(view.starts) - 1)
+    byte = rand.randrange(geometry.bytes_wide)
+    if rand.random() < 0.5:
+        column = geometry.hex_column(byte) + rand.randrange(2)
+    else:
+        column = geometry.ascii_column(byte)
+    return view.text_point(row, column)
+
+
+def measure_case(modules, view, geometry, case, args, rand):
+    """Measure the latency in seconds of each operation over the trials of a case."""
+
+    hex_common, hex_highlighter, hex_inspector = modules
+    inspector = hex_inspector.HexInspectorCommand(window)
+    inspector.view = view
+    selection = view.sel()
+    selection.clear()
+    hex_highlighter.hh_cache.clear()
+    hex_highlighter.hh_shown.clear()
+    if case == "cursors":
+        for _ in range(args.cursors):
+            selection.add(Region(random_point(rand, view, geometry)))
+        selection.sort(key=lambda region: region.begin())
+
+    def highlight():
+        highlighter = hex_highlighter.HexHighlighter()
+        highlighter.snapshot(window, 0)
+        highlighter.compute()
+        highlighter.apply()
+
+    operations = [("highlight", highlight)]
+    if case == "cursor":
+        operations.append(
+            ("adjust_hex_sel", lambda: hex_common.adjust_hex_sel(view, point, point + 1, geometry))
+        )
+        operations.append(("get_bytes", lambda: inspector.get_bytes(point)))
+
+    samples = {name: [] for name, operation in operations}
+    span = int(args.selection_mb * MB / geometry.bytes_wide) * (geometry.ascii_start + geometry.bytes_wide + 1)
+    for _ in range(args.trials):
+        point = random_point(rand, view, geometry)
+        if case == "cursor":
+            selection.clear()
+            selection.add(Region(point))
+        elif case == "cursors":
+            selection[rand.randrange(len(selection))] = Region(point)
+            selection.sort(key=lambda region: region.begin())
+        else:
+            start = rand.randrange(max(1, view.size() - span))
+            selection.clear()
+            selection.add(Region(start, min(view.size(), start + span)))
+        for name, operation in operations:
+            start_time = time.perf_counter()
+            operation()
+            samples[name].append(time.perf_counter() - start_time)
+    return samples
+
+
+def compare(results, baseline):
+    """Print the change of the 99th percentile latency of each case against a previous run."""
+
+    def key(result):
+        return (result["bits"], result["bytes"], result["case"], result["operation"])
+
+    previous = {key(result): result for result in baseline["results"]}
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old["p99_ms"]:
+            continue
+        print(
+            "%3d bits %3d bytes %-9s %-14s: p99 %8.3f -> %8.3f ms (%+.1f%%)" % (
+                result["bits"], result["bytes"], result["case"], result["operation"],
+                old["p99_ms"], result["p99_ms"], (result["p99_ms"] / old["p99_ms"] - 1) * 100
+            )
+        )
+
+
+def main():
+    """Run the benchmarks."""
+
+    parser = argparse.ArgumentParser(prog="latency", description="Benchmark the latency of selection handling.")
+    parser.add_argument(
+        "--layouts", default=DEFAULT_LAYOUTS, help="Comma separated bits per group and bytes per line, as 'bits:bytes'."
+    )
+    parser.add_argument("--size", type=float, default=4, help="Size of the viewed data in MB.")
+    parser.add_argument("--cases", default=",".join(CASES), help="Comma separated cases to measure.")
+    parser.add_argument("--trials", type=int, default=200, help="Number of selection changes per case.")
+    parser.add_argument("--cursors", type=int, default=100, help="Number of cursors of the 'cursors' case.")
+    parser.add_argument(
+        "--selection-mb", type=float, default=1, help="Size in MB of the selections of the 'selection' case."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random data and selections.")
+    parser.add_argument("--output", default="latency.json", help="File to write the JSON results to.")
+    parser.add_argument("--compare", default=None, help="Previous JSON results to compare against.")
+    args = parser.parse_args()
+
+    install_sublime()
+    hex_format = import_module("hex_format")
+    modules = (import_module("hex_common"), import_module("hex_highlighter"), import_module("hex_inspector"))
+    rand = random.Random(args.seed)
+    data = bytes(rand.getrandbits(8) for _ in range(int(args.size * MB)))
+    cases = [case for case in args.cases.split(",") if case in CASES]
+
+    results = []
+    for layout in args.layouts.split(","):
+        bits, bytes_per_line = [int(value) for value in layout.split(":")]
+        bytes_wide, group_size = hex_format.get_layout(bits, bytes_per_line)
+        view = View(
+            hex_format.HexFormatter(bytes_wide, group_size).format_lines(data),
+            group_size * hex_format.BITS_PER_BYTE, bytes_wide
+        )
+        window.view = view
+        geometry = hex_format.ByteGeometry(bytes_wide, group_size)
+        for case in cases:
+            samples = measure_case(modules, view, geometry, case, args, rand)
+            for operation, times in samples.items():
+                result = {
+                    "bits": bits,
+                    "bytes": bytes_per_line,
+                    "case": case,
+                    "operation": operation,
+                    "p50_ms": percentile(times, 50) * 1000,
+                    "p99_ms": percentile(times, 99) * 1000
+                }
+                results.append(result)
+                print(
+                    "%3d bits %3d bytes %-9s %-14s: p50 %8.3f ms, p99 %8.3f ms" % (
+                        bits, bytes_per_line, case, operation, result["p50_ms"], result["p99_ms"]
+                    )
+                )
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "size": int(args.size * MB),
+        "trials": args.trials,
+        "cursors": args.cursors,
+        "selection_mb": args.selection_mb,
+        "results": results
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())